@@ -9,14 +9,8 @@ app = Flask(__name__)
 app.config.from_object(Config)
 db.init_app(app)
 
-# 配置CORS以支持CDN访问
-CORS(app, resources={
-    r"/api/*": {
-        "origins": "*",  # 允许所有来源，支持CDN访问
-        "methods": ["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
+# 配置CORS以支持CDN访问（来源/方法/请求头见 Config.CORS_*，asgi.py 的聊天网关共用这份配置）
+CORS(app, resources=r"/api/*")
 
 # 错误处理器：确保 API 路由返回 JSON 格式的错误
 @app.errorhandler(RequestEntityTooLarge)
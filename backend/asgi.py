@@ -0,0 +1,24 @@
+"""
+ASGI 入口：看板娘聊天走异步网关，其余请求仍由 Flask 处理。
+
+    python -m uvicorn asgi:app --host 127.0.0.1 --port 5000
+
+流式聊天在事件循环里等待上游 token，不再占用工作线程；Flask 应用包装成 ASGI 后挂在网关后面，
+在独立线程池（RAG_GATEWAY_WSGI_WORKERS）里运行，行为与 waitress 下一致。
+"""
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError as e:
+    # 不退回 uvicorn 自带的 WSGIMiddleware（已弃用、行为不同）：缺依赖就直接启动失败
+    raise ImportError("缺少 a2wsgi：请执行 pip install -r requirements.txt，或改用 waitress 运行 app:app") from e
+from flask_cors.core import get_cors_options
+
+from app import app as flask_app
+from routes.rag_bot.gateway import ChatGateway
+from routes.rag_bot.runtime import get_runtime
+
+app = ChatGateway(
+    fallback=WSGIMiddleware(flask_app, workers=get_runtime().config().gateway_wsgi_workers),
+    # 与 Flask-CORS 相同的配置（Config.CORS_*）
+    cors=get_cors_options(flask_app),
+)
@@ -4,6 +4,9 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///comments.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # CORS（Flask-CORS 的配置项；asgi.py 里的聊天网关用同一份配置生成响应头）
     CORS_ORIGINS = ['*']  # 允许所有来源，生产环境应限制
+    CORS_METHODS = ['GET', 'POST', 'OPTIONS', 'PUT', 'DELETE']
+    CORS_ALLOW_HEADERS = ['Content-Type', 'Authorization']
     # 文件上传大小限制：50MB
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
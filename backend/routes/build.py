@@ -0,0 +1,228 @@
+"""
+Hexo 静态文件生成队列。
+
+以前发文 / 更新 / 删除各自起一个线程跑 `npx hexo generate`：编辑器里连续保存几次，
+就是几个全站 Node 构建同时抢 CPU、同时写 public/。这里：
+- 同一时间最多只跑一个构建
+- 构建进行中到达的请求合并成一次后续构建（不管来了多少次）
+- 去抖：最后一次请求后等待 HEXO_BUILD_DEBOUNCE_MS 再开始，连续保存只构建一次；
+  最多推迟 HEXO_BUILD_MAX_DELAY_MS，避免一直有人保存时迟迟不构建
+- 构建优先交给常驻 Hexo 进程（hexo_worker.py），省掉每次的 Node 冷启动；不可用时回退为 npx
+- /api/build/status 报告排队情况、上次构建耗时与退出状态、最近几次构建的日志，以及常驻进程状态
+"""
+import os
+import platform
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from flask import Blueprint, jsonify, request
+
+from .hexo_worker import get_hexo_worker
+
+bp = Blueprint('build', __name__)
+
+BASE_DIR = Path(__file__).parent.parent.parent
+# 每次构建保留的日志尾部字符数
+_LOG_TAIL = 4000
+
+
+def run_hexo_generate(timeout: float) -> Dict[str, Any]:
+    """冷启动执行一次 npx hexo generate，返回 {status: ok/failed/timeout/error, returncode, log, mode}"""
+    if platform.system() == 'Windows':
+        cmd = 'npx hexo generate'
+    else:
+        cmd = ['npx', 'hexo', 'generate']
+    try:
+        result = subprocess.run(
+            cmd,
+            check=False,
+            capture_output=True,
+            text=True,
+            encoding='utf-8',  # 显式指定 utf-8
+            errors='replace',  # 忽略解码错误
+            shell=(platform.system() == 'Windows'),
+            timeout=timeout,
+            cwd=str(BASE_DIR)
+        )
+    except subprocess.TimeoutExpired as e:
+        out = e.stdout.decode('utf-8', 'replace') if isinstance(e.stdout, bytes) else (e.stdout or '')
+        return {'status': 'timeout', 'returncode': None, 'log': out, 'mode': 'cold'}
+    except Exception as e:
+        return {'status': 'error', 'returncode': None, 'log': str(e), 'mode': 'cold'}
+    output = (result.stdout or '') + (result.stderr or '')
+    status = 'ok' if result.returncode == 0 else 'failed'
+    return {'status': status, 'returncode': result.returncode, 'log': output, 'mode': 'cold'}
+
+
+def run_build(timeout: float) -> Dict[str, Any]:
+    """优先交给常驻 Hexo 进程（hexo_worker.py），不可用时冷启动"""
+    worker = get_hexo_worker()
+    if worker is not None:
+        result = worker.generate(timeout)
+        if result is not None:
+            return result
+    return run_hexo_generate(timeout)
+
+
+class BuildQueue:
+    def __init__(
+        self,
+        run_build: Callable[[], Dict[str, Any]],
+        debounce: float = 1.5,
+        max_delay: float = 10.0,
+        log_keep: int = 10,
+    ) -> None:
+        self.run_build = run_build
+        self.debounce = max(0.0, debounce)
+        self.max_delay = max(self.debounce, max_delay)
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        # 等待中的请求（下一次构建会一并处理）
+        self._pending: List[str] = []
+        self._first_at = 0.0
+        self._last_at = 0.0
+        self._current: Optional[Dict[str, Any]] = None
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=max(1, log_keep))
+        self._seq = 0
+        self.requests = 0
+        self.builds = 0
+        self.coalesced = 0
+        # 各方式（worker 常驻 / cold 冷启动）最近的构建耗时，对比常驻进程的收益
+        self._durations: Dict[str, Deque[float]] = {}
+
+    def request(self, reason: str = '') -> str:
+        """登记一次构建请求；返回 queued（新排队）或 coalesced（并入已在排队的构建）"""
+        with self._cond:
+            now = time.monotonic()
+            self.requests += 1
+            state = 'coalesced' if self._pending else 'queued'
+            if not self._pending:
+                self._first_at = now
+            self._pending.append(reason)
+            self._last_at = now
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name='hexo-build', daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+            return state
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 去抖：最后一次请求后安静 debounce 秒，或从第一次请求起已等满 max_delay
+                while True:
+                    now = time.monotonic()
+                    due = min(self._last_at + self.debounce, self._first_at + self.max_delay)
+                    if now >= due:
+                        break
+                    self._cond.wait(due - now)
+                reasons, self._pending = self._pending, []
+                self.coalesced += len(reasons) - 1
+                self._seq += 1
+                now = time.monotonic()
+                self._current = {
+                    'id': self._seq,
+                    'requests': len(reasons),
+                    'reasons': reasons[-10:],
+                    'started_at': datetime.now().isoformat(timespec='seconds'),
+                    # 第一次请求到开始构建（去抖 + 等上一次构建）
+                    'wait_seconds': round(now - self._first_at, 2),
+                    '_t0': now,
+                }
+            self._run(self._current)
+
+    def _run(self, build: Dict[str, Any]) -> None:
+        try:
+            result = self.run_build()
+        except Exception as e:
+            result = {'status': 'error', 'returncode': None, 'log': str(e)}
+        duration = time.monotonic() - build.pop('_t0')
+        status, output = result.get('status'), result.get('log') or ''
+        build.update({
+            'status': status,
+            'returncode': result.get('returncode'),
+            'mode': result.get('mode'),
+            'duration_seconds': round(duration, 2),
+            # 保存到发布完成：等待 + 构建
+            'latency_seconds': round(build['wait_seconds'] + duration, 2),
+            'log': output[-_LOG_TAIL:],
+        })
+        if status == 'ok':
+            print(f"静态文件生成成功（{build['mode']}，{duration:.1f}s，合并 {build['requests']} 次请求）")
+        else:
+            print(f"生成静态文件失败[{status}]: {output[-200:] if output else '未知错误'}")
+        with self._cond:
+            self.builds += 1
+            self._history.append(build)
+            mode = self._durations.setdefault(build['mode'] or 'unknown', deque(maxlen=50))
+            mode.append(duration)
+            self._current = None
+
+    def status(self, logs: bool = True) -> Dict[str, Any]:
+        with self._cond:
+            current = None
+            if self._current is not None:
+                current = {k: v for k, v in self._current.items() if not k.startswith('_')}
+                current['elapsed_seconds'] = round(time.monotonic() - self._current['_t0'], 2)
+            history = [dict(b) for b in reversed(self._history)]
+            if not logs:
+                for b in history:
+                    b.pop('log', None)
+            return {
+                'running': current,
+                'queue_depth': len(self._pending),
+                'debounce_ms': int(self.debounce * 1000),
+                'requests': self.requests,
+                'builds': self.builds,
+                'coalesced': self.coalesced,
+                'avg_duration_seconds': {m: round(sum(d) / len(d), 2) for m, d in self._durations.items() if d},
+                'last': history[0] if history else None,
+                'history': history,
+            }
+
+
+_queue: Optional[BuildQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_build_queue() -> BuildQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            timeout = float(os.getenv('HEXO_BUILD_TIMEOUT') or 120)
+            _queue = BuildQueue(
+                lambda: run_build(timeout),
+                debounce=float(os.getenv('HEXO_BUILD_DEBOUNCE_MS') or 1500) / 1000.0,
+                max_delay=float(os.getenv('HEXO_BUILD_MAX_DELAY_MS') or 10000) / 1000.0,
+                log_keep=int(os.getenv('HEXO_BUILD_LOG_KEEP') or 10),
+            )
+        return _queue
+
+
+@bp.record_once
+def _start_hexo_worker(state):
+    """应用启动时在后台拉起常驻 Hexo 进程（预加载站点，第一次发文就不用冷启动）"""
+    try:
+        get_hexo_worker()
+    except Exception as e:
+        print(f"Hexo 常驻进程启动跳过: {e}")
+
+
+@bp.route('/build/status', methods=['GET'])
+def build_status():
+    """静态文件构建队列状态（?logs=0 不返回日志）"""
+    try:
+        logs = (request.args.get('logs') or '1').strip().lower() not in ('0', 'false', 'no')
+        data = get_build_queue().status(logs=logs)
+        worker = get_hexo_worker()
+        data['worker'] = worker.status() if worker is not None else None
+        return jsonify({'errno': 0, 'data': data})
+    except Exception as e:
+        return jsonify({'errno': 1, 'errmsg': f'获取构建状态失败: {str(e)}'}), 500
@@ -0,0 +1,277 @@
+"""
+常驻 Hexo 生成进程的看护（进程本身见项目根目录 hexo-worker.js）。
+
+冷启动一次 `npx hexo generate` 要解析 npx、启动 Node、加载 Hexo 与全部插件，往往比渲染本身还慢。
+这里让后端管理一个长驻的 Node 进程：
+- 应用启动时在后台拉起并预加载站点，构建队列（build.py）有请求时直接让它 generate
+- 进程退出 / 健康检查（ping）失败 / 单次构建超时：杀掉后按指数退避重启
+- 进程不可用（未安装 node 或 hexo、HEXO_WORKER=0、还没启动成功）时，构建回退为 npx 冷启动
+"""
+import atexit
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional
+
+BASE_DIR = Path(__file__).parent.parent.parent
+WORKER_SCRIPT = BASE_DIR / "hexo-worker.js"
+_PREFIX = "@@hexo-worker "
+
+
+class HexoWorker:
+    def __init__(self, script: Path, cwd: Path, startup_timeout: float = 120.0, health_interval: float = 30.0) -> None:
+        self.script = Path(script)
+        self.cwd = Path(cwd)
+        self.startup_timeout = startup_timeout
+        self.health_interval = max(1.0, health_interval)
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        self._waiters: Dict[int, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._log: Deque[str] = deque(maxlen=200)
+        self._busy = False
+        self.state = "stopped"
+        self.started_at: Optional[str] = None
+        self.startup_seconds: Optional[float] = None
+        self.restarts = 0
+        self.generations = 0
+        self.last_ping_ms: Optional[float] = None
+        self.last_error = ""
+
+    def available(self) -> bool:
+        return self.script.exists() and shutil.which("node") is not None and (self.cwd / "node_modules" / "hexo").exists()
+
+    # ---- 进程管理 ----
+
+    def start(self) -> None:
+        with self._lock:
+            if self._supervisor is not None and self._supervisor.is_alive():
+                return
+            self._stop.clear()
+            self.state = "starting"
+            self._supervisor = threading.Thread(target=self._supervise, name="hexo-worker", daemon=True)
+            self._supervisor.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._kill()
+
+    def _spawn(self) -> bool:
+        self._ready.clear()
+        self.state = "starting"
+        t0 = time.monotonic()
+        try:
+            proc = subprocess.Popen(
+                ["node", str(self.script)],
+                cwd=str(self.cwd),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                bufsize=1,
+            )
+        except Exception as e:
+            self.state = "dead"
+            self.last_error = f"启动失败: {e}"
+            return False
+        with self._lock:
+            self._proc = proc
+        threading.Thread(target=self._read, args=(proc,), name="hexo-worker-read", daemon=True).start()
+        deadline = t0 + self.startup_timeout
+        while not self._ready.wait(0.5) and proc.poll() is None and time.monotonic() < deadline:
+            pass
+        if not self._ready.is_set() or proc.poll() is not None:
+            if proc.poll() is None:
+                self.last_error = f"启动超时（{self.startup_timeout:.0f}s）"
+            self._kill()
+            return False
+        self.startup_seconds = round(time.monotonic() - t0, 2)
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.state = "ready"
+        print(f"Hexo 常驻进程已就绪（pid={proc.pid}，加载 {self.startup_seconds}s）")
+        return True
+
+    def _kill(self) -> None:
+        with self._lock:
+            proc = self._proc
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=10)
+        except Exception:
+            pass
+
+    def _read(self, proc: subprocess.Popen) -> None:
+        for line in proc.stdout:
+            if not line.startswith(_PREFIX):
+                self._log.append(line.rstrip())
+                continue
+            try:
+                msg = json.loads(line[len(_PREFIX):])
+            except ValueError:
+                continue
+            if msg.get("type") == "ready":
+                self._ready.set()
+            elif msg.get("type") == "fatal":
+                self.last_error = (msg.get("error") or "")[-500:]
+            else:
+                with self._lock:
+                    waiter = self._waiters.pop(msg.get("id"), None)
+                if waiter is not None:
+                    waiter["result"] = msg
+                    waiter["event"].set()
+        # 进程退出：唤醒所有等待中的请求，通知看护线程重启
+        proc.wait()
+        with self._lock:
+            if self._proc is proc:
+                self.state = "dead"
+            waiters, self._waiters = self._waiters, {}
+        for waiter in waiters.values():
+            waiter["event"].set()
+        if not self.last_error:
+            self.last_error = f"进程退出（code={proc.returncode}）"
+        self._ready.clear()
+        self._wake.set()
+
+    def _supervise(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            with self._lock:
+                proc = self._proc
+            if proc is None or proc.poll() is not None:
+                if proc is not None:
+                    self.restarts += 1
+                    print(f"Hexo 常驻进程已退出，{backoff:.0f}s 后重启: {self.last_error[-200:]}")
+                    if self._stop.wait(backoff):
+                        return
+                if self._spawn():
+                    backoff = 1.0
+                    self.last_error = ""
+                else:
+                    # 启动失败（Popen 报错 / 加载失败 / 启动超时）同样退避后再试，不能原地空转
+                    with self._lock:
+                        self._proc = None
+                    print(f"Hexo 常驻进程启动失败，{backoff:.0f}s 后重试: {self.last_error[-200:]}")
+                    if self._stop.wait(backoff):
+                        return
+                    backoff = min(backoff * 2, 60.0)
+                    continue
+            elif not self._busy:
+                try:
+                    t0 = time.monotonic()
+                    self._call("ping", 10)
+                    self.last_ping_ms = round((time.monotonic() - t0) * 1000, 1)
+                except Exception as e:
+                    self.last_error = f"健康检查失败: {e}"
+                    self._kill()
+                    continue
+            self._wake.wait(self.health_interval)
+            self._wake.clear()
+
+    # ---- 请求 ----
+
+    def _call(self, cmd: str, timeout: float) -> Dict[str, Any]:
+        waiter: Dict[str, Any] = {"event": threading.Event(), "result": None}
+        with self._lock:
+            proc = self._proc
+            if proc is None or proc.poll() is not None or not self._ready.is_set():
+                raise RuntimeError("Hexo 常驻进程未就绪")
+            req_id = next(self._ids)
+            self._waiters[req_id] = waiter
+            try:
+                proc.stdin.write(json.dumps({"id": req_id, "cmd": cmd}) + "\n")
+                proc.stdin.flush()
+            except OSError:
+                self._waiters.pop(req_id, None)
+                raise
+        if not waiter["event"].wait(timeout):
+            with self._lock:
+                self._waiters.pop(req_id, None)
+            raise TimeoutError(f"{cmd} 超时（{timeout:.0f}s）")
+        if waiter["result"] is None:
+            raise RuntimeError("Hexo 常驻进程已退出")
+        return waiter["result"]
+
+    def generate(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """让常驻进程生成一次；进程不可用时返回 None（由调用方回退为冷启动）"""
+        # 启动时的预加载还没完成：等它，比再起一个冷启动的 Node 进程更快
+        deadline = time.monotonic() + self.startup_timeout
+        while self.state == "starting" and not self._ready.wait(0.5) and time.monotonic() < deadline:
+            pass
+        if not self._ready.is_set():
+            return None
+        self._busy = True
+        self.state = "busy"
+        try:
+            msg = self._call("generate", timeout)
+        except TimeoutError as e:
+            # 卡住的进程状态未知：杀掉，由看护线程重启
+            self.last_error = str(e)
+            self._kill()
+            return {"status": "timeout", "returncode": None, "log": "\n".join(list(self._log)[-50:]), "mode": "worker"}
+        except Exception as e:
+            self.last_error = str(e)
+            return None
+        finally:
+            self._busy = False
+            if self.state == "busy":
+                self.state = "ready"
+        self.generations += 1
+        log = msg.get("log") or ""
+        if not msg.get("ok"):
+            log = (log + "\n" + (msg.get("error") or "")).strip()
+        return {"status": "ok" if msg.get("ok") else "failed", "returncode": 0 if msg.get("ok") else 1, "log": log, "mode": "worker"}
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            proc = self._proc
+        return {
+            "state": self.state,
+            "pid": proc.pid if proc is not None and proc.poll() is None else None,
+            "started_at": self.started_at,
+            "startup_seconds": self.startup_seconds,
+            "restarts": self.restarts,
+            "generations": self.generations,
+            "last_ping_ms": self.last_ping_ms,
+            "last_error": self.last_error or None,
+        }
+
+
+_worker: Optional[HexoWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_hexo_worker() -> Optional[HexoWorker]:
+    """HEXO_WORKER=0 或环境里没有 node / hexo 时返回 None"""
+    global _worker
+    if (os.getenv("HEXO_WORKER") or "1").strip().lower() in ("0", "false", "no"):
+        return None
+    with _worker_lock:
+        if _worker is None:
+            worker = HexoWorker(
+                WORKER_SCRIPT,
+                BASE_DIR,
+                startup_timeout=float(os.getenv("HEXO_WORKER_STARTUP_TIMEOUT") or 120),
+                health_interval=float(os.getenv("HEXO_WORKER_HEALTH_INTERVAL") or 30),
+            )
+            if not worker.available():
+                return None
+            _worker = worker
+            atexit.register(worker.stop)
+        _worker.start()
+        return _worker
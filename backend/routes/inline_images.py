@@ -0,0 +1,123 @@
+"""
+把 Markdown 里内嵌的 base64 图片（data:image/...;base64,...）抽成 source/img/content/ 下的文件。
+
+编辑器里直接粘贴的图片会以 data URI 留在 .md 里，一张图就是几百 KB 到几 MB 文本：
+/api/posts/get 响应变大、Hexo 渲染变慢，RAG 入库时还会被切块、当成正文送去 embedding。这里：
+- 一次 finditer 扫描全文，非图片部分按切片收集、最后只 join 一次，不反复复制整篇文档
+- 图片按内容 sha256 命名（内容寻址），同一张图无论出现几次、在几篇文章里都只存一份
+- Markdown 改写为短链接 /img/content/<hash>.<ext>；<img src="data:..."> 同样处理
+- 不认识的图片类型、解码失败的数据保持原样
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# ![alt](data:image/png;base64,....  "title")  或  <img ... src="data:image/png;base64,....">
+_INLINE_IMAGE_RE = re.compile(
+    r'(?P<md>!\[(?P<alt>[^\]]*)\]\(\s*)data:image/(?P<mtype>[a-zA-Z0-9.+-]+);base64,(?P<mdata>[A-Za-z0-9+/=\s]+)(?P<mtail>\s+"[^"]*")?\s*\)'
+    r'|(?P<html><img\b[^>]*?\bsrc\s*=\s*)(?P<q>["\'])data:image/(?P<htype>[a-zA-Z0-9.+-]+);base64,(?P<hdata>[A-Za-z0-9+/=\s]+)(?P=q)',
+    re.IGNORECASE,
+)
+_HAS_DATA_URI = re.compile(r"data:image/", re.IGNORECASE)
+# MIME 子类型 -> 扩展名（与 posts.ALLOWED_EXTENSIONS 一致）
+_EXTENSIONS = {
+    "png": "png",
+    "jpeg": "jpg",
+    "jpg": "jpg",
+    "pjpeg": "jpg",
+    "gif": "gif",
+    "webp": "webp",
+    "svg+xml": "svg",
+}
+# 文件名取 sha256 前 32 位（128 bit，足够避免碰撞）
+_HASH_LEN = 32
+
+_write_lock = threading.Lock()
+
+
+def _store(data: bytes, ext: str, target_dir: Path, dry_run: bool = False) -> Tuple[str, bool]:
+    """按内容寻址写入；返回 (文件名, 是否新写入)。dry_run 时只计算不写"""
+    name = f"{hashlib.sha256(data).hexdigest()[:_HASH_LEN]}.{ext}"
+    path = target_dir / name
+    with _write_lock:
+        if path.exists() and path.stat().st_size == len(data):
+            return name, False
+        if dry_run:
+            return name, True
+        target_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return name, True
+
+
+def extract_inline_images(
+    content: str,
+    target_dir: Path,
+    url_prefix: str = "/img/content/",
+    dry_run: bool = False,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    返回 (改写后的 Markdown, 统计)。
+    统计：images 找到的内嵌图片数、written 新写入的文件数、deduped 已存在的文件数、
+    skipped 保持原样的数量、chars_removed 文档减少的字符数。
+    """
+    report = {"images": 0, "written": 0, "deduped": 0, "skipped": 0, "chars_removed": 0, "files": []}
+    if not content or not _HAS_DATA_URI.search(content):
+        return content, report
+
+    parts: List[str] = []
+    pos = 0
+    for m in _INLINE_IMAGE_RE.finditer(content):
+        report["images"] += 1
+        is_md = m.group("md") is not None
+        mtype = (m.group("mtype") if is_md else m.group("htype")).lower()
+        ext = _EXTENSIONS.get(mtype)
+        if ext is None:
+            report["skipped"] += 1
+            continue
+        try:
+            # 数据里可能有换行/空格（编辑器自动折行），b64decode 默认会忽略非 base64 字符
+            data = base64.b64decode(m.group("mdata") if is_md else m.group("hdata"))
+        except (binascii.Error, ValueError):
+            report["skipped"] += 1
+            continue
+        if not data:
+            report["skipped"] += 1
+            continue
+        name, written = _store(data, ext, target_dir, dry_run)
+        report["written" if written else "deduped"] += 1
+        report["files"].append(name)
+        url = url_prefix + name
+        parts.append(content[pos:m.start()])
+        if is_md:
+            parts.append(f"{m.group('md')}{url}{m.group('mtail') or ''})")
+        else:
+            q = m.group("q")
+            parts.append(f"{m.group('html')}{q}{url}{q}")
+        pos = m.end()
+    if not parts:
+        return content, report
+    parts.append(content[pos:])
+    out = "".join(parts)
+    report["chars_removed"] = len(content) - len(out)
+    report["files"] = sorted(set(report["files"]))
+    return out, report
+
+
+def strip_inline_images(text: str) -> str:
+    """去掉残留的 data URI（只保留 alt），供 RAG 切块前使用：base64 不该被当成正文 embedding"""
+    if not text or not _HAS_DATA_URI.search(text):
+        return text
+    def blank(m: "re.Match[str]") -> str:
+        if m.group("md") is not None:
+            return f"![{m.group('alt')}]()"
+        return f"{m.group('html')}{m.group('q')}{m.group('q')}"
+
+    return _INLINE_IMAGE_RE.sub(blank, text)
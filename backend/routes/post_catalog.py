@@ -0,0 +1,399 @@
+"""
+文章目录（内存）：source/_posts 下每篇文章的标题、日期、标签、分类、封面、大小、字数。
+
+以前 /api/posts/list 每次都 glob 全部 Markdown、整篇读入再用正则解析 front-matter，
+开销与全部文章的字节数成正比。这里：
+- 每次使用前只 scandir + stat，按 (mtime_ns, size) 判断哪些文件变了
+- 变化的文件只读 front-matter 前缀解析元数据；字数按行流式统计，不整篇留在内存
+- 已经整篇读过文件的地方（get_post、发文/更新、RAG 入库）直接把内容交给 observe()，不再重复读
+- query() 提供服务端排序、过滤与游标分页
+- content_hashes() 给保存流程判断这次修改是否需要重新构建 / 重新入库
+同一个目录全进程共享一个实例（get_catalog），文章接口与 RAG 增量入库共用。
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+# front-matter 最多读这么多字节；超过仍未闭合视为没有 front-matter
+_MAX_FRONT_MATTER = 64 * 1024
+_READ_BLOCK = 4096
+# 字数：中日韩字符每个算一个字，其余按连续的字母/数字算一个词
+_WORD_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿]|[A-Za-z0-9_]+(?:['’-][A-Za-z0-9_]+)*")
+
+SORT_FIELDS = ("date", "title", "size", "words", "mtime", "filename")
+
+
+def count_words(text: str) -> int:
+    return len(_WORD_RE.findall(text or ""))
+
+
+def _split_front_matter(text: str) -> Tuple[Optional[str], int]:
+    """返回 (front-matter 原文, 正文起始位置)；没有 front-matter 时为 (None, 0)"""
+    if not text.startswith("---"):
+        return None, 0
+    m = re.search(r"\r?\n---[ \t]*(?:\r?\n|$)", text[3:])
+    if not m:
+        return None, 0
+    return text[3:3 + m.start()], 3 + m.end()
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        out: List[str] = []
+        for v in value:
+            # 多级分类写成嵌套列表：[a, [b, c]]
+            out.extend(_as_list(v) if isinstance(v, (list, tuple)) else [str(v).strip()])
+        return [v for v in out if v]
+    s = str(value).strip()
+    return [s] if s else []
+
+
+def _date_str(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    return str(value or "").strip()
+
+
+def _date_key(value: str) -> str:
+    """排序用：统一成 YYYY-MM-DD HH:MM:SS，解析不了的排在最后（空串）"""
+    s = (value or "").strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%Y/%m/%d %H:%M:%S", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(s, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(s).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return ""
+
+
+def _unquote(value: str) -> str:
+    v = value.strip()
+    if len(v) >= 2 and v[0] == v[-1] and v[0] in "\"'":
+        if v[0] == "'":
+            return v[1:-1].replace("''", "'")
+        try:
+            loaded = yaml.safe_load(v)
+            if isinstance(loaded, str):
+                return loaded
+        except Exception:
+            pass
+        return v[1:-1]
+    return v
+
+
+def _field_list(front_matter: str, key: str) -> List[str]:
+    block = re.search(rf"^{key}:[ \t]*\n((?:[ \t]*-[ \t]*.+\n?)+)", front_matter, re.M)
+    if block:
+        return [_unquote(m.group(1)) for m in re.finditer(r"-[ \t]*(.+)", block.group(1)) if _unquote(m.group(1))]
+    line = re.search(rf"^{key}:[ \t]*(.+)$", front_matter, re.M)
+    if not line:
+        return []
+    value = line.group(1).strip()
+    if value.startswith("["):
+        # 行内列表：tags: [a, b]
+        try:
+            return _as_list(yaml.safe_load(value))
+        except Exception:
+            return [_unquote(v) for v in value.strip("[]").split(",") if _unquote(v)]
+    return [_unquote(value)] if _unquote(value) else []
+
+
+def parse_front_matter_fields(front_matter: Optional[str]) -> Dict[str, Any]:
+    """
+    逐行解析 title / date / cover / tags / categories。
+    不整体走 YAML：旧文章的标题没加引号，`A: b` 会让 YAML 解析失败，`Foo #2` 会被当成注释截断；
+    这里标量按原文保留，带引号的才去掉引号。
+    """
+    fm = front_matter or ""
+
+    def scalar(key: str) -> str:
+        m = re.search(rf"^{key}:[ \t]*(.+)$", fm, re.M)
+        return _unquote(m.group(1)) if m else ""
+
+    return {
+        "title": scalar("title"),
+        "date": scalar("date"),
+        "tags": _field_list(fm, "tags"),
+        "categories": _field_list(fm, "categories"),
+        "cover": scalar("cover"),
+    }
+
+
+def parse_meta(front_matter: Optional[str], stem: str) -> Dict[str, Any]:
+    meta = parse_front_matter_fields(front_matter)
+    meta["title"] = meta["title"] or stem
+    return meta
+
+
+# 影响 RAG 检索内容的 front-matter 字段（见 rag_store._build_post_chunks / _build_post_url）
+_RAG_FIELDS = ("title", "date", "tags", "categories", "permalink")
+
+
+def _canonical_value(key: str, value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return _date_str(value)
+    if key == "tags":
+        # 标签顺序不影响页面与检索
+        return sorted(_as_list(value))
+    if key == "categories":
+        # 分类有层级，顺序保留
+        return _as_list(value)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def content_hashes(raw: str) -> Dict[str, str]:
+    """
+    文章的规范化 hash：{"build": 影响静态页面的内容, "rag": 影响检索的内容}。
+    规范化：统一换行、只含空白的行视为空行、去掉首尾空白、标签排序；
+    front-matter 按解析后的值比较（缩进、引号、键顺序不同视为相同）。
+    """
+    text = (raw or "").replace("\r\n", "\n").replace("\r", "\n")
+    front_matter, body_start = _split_front_matter(text)
+    meta: Dict[str, Any] = {}
+    if front_matter:
+        try:
+            loaded = yaml.safe_load(front_matter)
+            if isinstance(loaded, dict):
+                meta = loaded
+        except Exception:
+            meta = {"_raw": front_matter.strip()}
+    meta = {str(k): _canonical_value(str(k), v) for k, v in meta.items()}
+    body = "\n".join("" if not line.strip() else line for line in text[body_start:].split("\n")).strip()
+
+    def digest(m: Dict[str, Any]) -> str:
+        payload = json.dumps(m, ensure_ascii=False, sort_keys=True, default=str) + "\n---\n" + body
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    return {"build": digest(meta), "rag": digest({k: v for k, v in meta.items() if k in _RAG_FIELDS})}
+
+
+def _read_prefix_and_count(path: Path) -> Tuple[Optional[str], int]:
+    """只读 front-matter 前缀解析元数据，正文按行流式统计字数"""
+    with open(path, "rb") as f:
+        head = b""
+        front_matter: Optional[str] = None
+        body_start = 0
+        while len(head) < _MAX_FRONT_MATTER:
+            block = f.read(_READ_BLOCK)
+            if not block:
+                break
+            head += block
+            if not head.startswith(b"---"[: len(head)]):
+                break
+            text = head.decode("utf-8", errors="ignore")
+            front_matter, body_start = _split_front_matter(text)
+            if front_matter is not None:
+                body_start = len(text[:body_start].encode("utf-8"))
+                break
+        # 前缀里已读到的正文可能截在一行中间，与后续内容凑成整行再数
+        carry = head[body_start:]
+        words = 0
+        for line in f:
+            carry += line
+            if carry.endswith(b"\n"):
+                words += count_words(carry.decode("utf-8", errors="ignore"))
+                carry = b""
+        words += count_words(carry.decode("utf-8", errors="ignore"))
+    return front_matter, words
+
+
+class PostCatalog:
+    def __init__(self, posts_dir: Path) -> None:
+        self.posts_dir = Path(posts_dir)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.refreshes = 0
+        self.parsed = 0
+
+    # ---- 维护 ----
+
+    def _rel(self, path: Path) -> str:
+        try:
+            return str(Path(path).relative_to(self.posts_dir)).replace("\\", "/")
+        except ValueError:
+            return Path(path).name
+
+    def _scan(self) -> Dict[str, os.stat_result]:
+        found: Dict[str, os.stat_result] = {}
+        stack = [self.posts_dir]
+        while stack:
+            d = stack.pop()
+            try:
+                it = os.scandir(d)
+            except FileNotFoundError:
+                continue
+            with it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(Path(e.path))
+                    elif e.name.endswith(".md") and e.is_file():
+                        found[self._rel(Path(e.path))] = e.stat()
+        return found
+
+    def _entry(self, rel: str, st: os.stat_result, front_matter: Optional[str], words: int) -> Dict[str, Any]:
+        path = self.posts_dir / rel
+        entry = parse_meta(front_matter, path.stem)
+        entry.update({
+            "filename": rel,
+            "size": st.st_size,
+            "words": words,
+            "mtime": st.st_mtime,
+            "_sig": (st.st_mtime_ns, st.st_size),
+            "_date_key": _date_key(entry["date"]),
+        })
+        return entry
+
+    def refresh(self) -> None:
+        """stat 所有文章，只重新解析 mtime/大小有变化的文件"""
+        with self._lock:
+            found = self._scan()
+            for rel in [r for r in self._entries if r not in found]:
+                del self._entries[rel]
+            for rel, st in found.items():
+                old = self._entries.get(rel)
+                if old is not None and old["_sig"] == (st.st_mtime_ns, st.st_size):
+                    continue
+                try:
+                    front_matter, words = _read_prefix_and_count(self.posts_dir / rel)
+                except OSError:
+                    continue
+                self._entries[rel] = self._entry(rel, st, front_matter, words)
+                self.parsed += 1
+            self.refreshes += 1
+
+    def observe(self, path: Path, raw: str, st: Optional[os.stat_result] = None) -> Dict[str, Any]:
+        """调用方已经整篇读过（或刚写入）文件：直接用内容更新条目"""
+        path = Path(path)
+        st = st or path.stat()
+        front_matter, body_start = _split_front_matter(raw)
+        entry = self._entry(self._rel(path), st, front_matter, count_words(raw[body_start:]))
+        with self._lock:
+            self._entries[entry["filename"]] = entry
+        return _public(entry)
+
+    def forget(self, path: Path) -> None:
+        with self._lock:
+            self._entries.pop(self._rel(Path(path)), None)
+
+    # ---- 读取 ----
+
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        """单篇条目（只 stat 这一个文件）；文件不存在时返回 None"""
+        path = self.posts_dir / filename
+        try:
+            st = path.stat()
+        except OSError:
+            self.forget(path)
+            return None
+        rel = self._rel(path)
+        with self._lock:
+            entry = self._entries.get(rel)
+        if entry is not None and entry["_sig"] == (st.st_mtime_ns, st.st_size):
+            return _public(entry)
+        front_matter, words = _read_prefix_and_count(path)
+        entry = self._entry(rel, st, front_matter, words)
+        with self._lock:
+            self._entries[rel] = entry
+            self.parsed += 1
+        return _public(entry)
+
+    def entries(self, recursive: bool = True) -> List[Dict[str, Any]]:
+        """按文件名排序的全部条目（refresh 后的快照）"""
+        self.refresh()
+        with self._lock:
+            items = [e for rel, e in self._entries.items() if recursive or "/" not in rel]
+        return [_public(e) for e in sorted(items, key=lambda e: e["filename"])]
+
+    def query(
+        self,
+        sort: str = "date",
+        order: str = "desc",
+        q: str = "",
+        tag: str = "",
+        category: str = "",
+        limit: int = 0,
+        cursor: str = "",
+        recursive: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        排序 + 过滤 + 游标分页。
+        游标记录上一页最后一条的 (排序值, 文件名)，翻页期间有文章增删也不会重复或漏掉。
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"sort 只支持: {', '.join(SORT_FIELDS)}")
+        reverse = order != "asc"
+        self.refresh()
+        ql, tl, cl = q.strip().lower(), tag.strip().lower(), category.strip().lower()
+        with self._lock:
+            items = [
+                e for rel, e in self._entries.items()
+                if (recursive or "/" not in rel)
+                and (not ql or ql in e["title"].lower() or ql in rel.lower())
+                and (not tl or tl in (t.lower() for t in e["tags"]))
+                and (not cl or cl in (c.lower() for c in e["categories"]))
+            ]
+
+        def key(e: Dict[str, Any]) -> Tuple[Any, str]:
+            if sort == "date":
+                return e["_date_key"], e["filename"]
+            if sort == "title":
+                return e["title"].lower(), e["filename"]
+            return e[sort], e["filename"]
+
+        items.sort(key=key, reverse=reverse)
+        total = len(items)
+        if cursor:
+            after = _decode_cursor(cursor, sort)
+            items = [e for e in items if (key(e) < after if reverse else key(e) > after)]
+        page = items[:limit] if limit > 0 else items
+        next_cursor = _encode_cursor(sort, key(page[-1])) if limit > 0 and len(items) > limit else None
+        return {"items": [_public(e) for e in page], "total": total, "next_cursor": next_cursor}
+
+
+def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in entry.items() if not k.startswith("_")}
+
+
+def _encode_cursor(sort: str, key: Tuple[Any, str]) -> str:
+    raw = json.dumps([sort, key[0], key[1]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        s, value, filename = json.loads(raw.decode("utf-8"))
+    except Exception:
+        raise ValueError("cursor 无效")
+    if s != sort:
+        raise ValueError("cursor 与排序字段不一致")
+    return value, filename
+
+
+_catalogs: Dict[str, PostCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(posts_dir: Path) -> PostCatalog:
+    key = str(Path(posts_dir).resolve())
+    with _catalogs_lock:
+        cat = _catalogs.get(key)
+        if cat is None:
+            cat = _catalogs[key] = PostCatalog(Path(posts_dir))
+        return cat
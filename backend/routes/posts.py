@@ -1,12 +1,15 @@
 from flask import Blueprint, request, jsonify, current_app
 from pathlib import Path
 from datetime import datetime
+import json
 import os
 import re
-import subprocess
 import threading
 from werkzeug.utils import secure_filename
 
+from .build import get_build_queue
+from .inline_images import extract_inline_images
+from .post_catalog import content_hashes, get_catalog, parse_front_matter_fields
 from .rag_bot.rag_store import upsert_post
 
 bp = Blueprint('posts', __name__)
@@ -18,54 +21,67 @@ IMAGES_DIR = BASE_DIR / "source" / "img"
 COVERS_DIR = IMAGES_DIR / "covers"  # 封面图片目录
 CONTENT_IMAGES_DIR = IMAGES_DIR / "content"  # 内容图片目录
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
+POSTS_PAGE_MAX = 200  # /posts/list 单页最多条数
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def atomic_write_text(path, text):
+    """先写同目录下的临时文件再 rename：Hexo / RAG 入库不会读到写了一半的文章"""
+    path = Path(path)
+    # 以 . 开头且不是 .md 后缀：Hexo 和文章目录都不会把它当成文章
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+
+def _yaml_str(value):
+    """front-matter 里的字符串一律加双引号（JSON 字符串也是合法的 YAML 双引号字符串）：
+    标题里的冒号、#、引号等不会让 YAML 解析失败或被截断"""
+    return json.dumps(str(value), ensure_ascii=False)
+
 def generate_front_matter(title, date, tags, categories, cover=None):
     """生成 Hexo front-matter"""
     front_matter = "---\n"
-    front_matter += f"title: {title}\n"
+    front_matter += f"title: {_yaml_str(title)}\n"
     front_matter += f"date: {date}\n"
     
     if cover:
-        front_matter += f"cover: {cover}\n"
+        front_matter += f"cover: {_yaml_str(cover)}\n"
     
     if tags:
         front_matter += "tags:\n"
         for tag in tags:
-            front_matter += f"  - {tag}\n"
+            front_matter += f"  - {_yaml_str(tag)}\n"
     
     if categories:
         front_matter += "categories:\n"
         for cat in categories:
-            front_matter += f"  - {cat}\n"
+            front_matter += f"  - {_yaml_str(cat)}\n"
     
     front_matter += "---"
     return front_matter
 
 def process_images_in_markdown(content):
     """处理 markdown 中的图片
-    支持 base64 图片自动转换和上传
+    内嵌的 base64 图片抽成 /img/content/ 下按内容 hash 命名的文件（重复的图只存一份），
+    Markdown 改写为短链接。返回 (content, 统计)
     """
-    # 匹配 base64 图片: ![alt](data:image/...;base64,...)
-    base64_pattern = r'!\[([^\]]*)\]\(data:image/([^;]+);base64,([^\)]+)\)'
-    
-    def replace_base64(match):
-        alt_text = match.group(1)
-        image_type = match.group(2)
-        base64_data = match.group(3)
-        
-        # 这里可以添加 base64 转文件的功能
-        # 暂时保留原样，或者可以保存为文件
-        # 为了简化，先返回原格式
-        return match.group(0)
-    
-    # 暂时不处理 base64，直接返回
-    # content = re.sub(base64_pattern, replace_base64, content)
-    
-    return content
+    content, report = extract_inline_images(content, CONTENT_IMAGES_DIR)
+    if report['images']:
+        print(f"内嵌图片: {report['images']} 张，新写入 {report['written']}，复用 {report['deduped']}，"
+              f"保留 {report['skipped']}，正文减少 {report['chars_removed']} 字符")
+    return content, report
 
 def parse_front_matter(content):
     """解析 front-matter，返回元数据和正文内容"""
@@ -81,41 +97,9 @@ def parse_front_matter(content):
     if content.strip().startswith('---'):
         parts = content.split('---', 2)
         if len(parts) >= 3:
-            front_matter = parts[1]
             body = parts[2].strip()
-            
-            # 提取标题
-            title_match = re.search(r'title:\s*(.+)', front_matter)
-            if title_match:
-                meta['title'] = title_match.group(1).strip()
-            
-            # 提取日期
-            date_match = re.search(r'date:\s*(.+)', front_matter)
-            if date_match:
-                meta['date'] = date_match.group(1).strip()
-            
-            # 提取封面
-            cover_match = re.search(r'cover:\s*(.+)', front_matter)
-            if cover_match:
-                meta['cover'] = cover_match.group(1).strip()
-            
-            # 提取标签
-            tags_section = re.search(r'tags:\s*\n((?:\s*-\s*.+\n?)+)', front_matter)
-            if tags_section:
-                tag_lines = tags_section.group(1).strip().split('\n')
-                for line in tag_lines:
-                    tag_match = re.search(r'-\s*(.+)', line)
-                    if tag_match:
-                        meta['tags'].append(tag_match.group(1).strip())
-            
-            # 提取分类
-            categories_section = re.search(r'categories:\s*\n((?:\s*-\s*.+\n?)+)', front_matter)
-            if categories_section:
-                cat_lines = categories_section.group(1).strip().split('\n')
-                for line in cat_lines:
-                    cat_match = re.search(r'-\s*(.+)', line)
-                    if cat_match:
-                        meta['categories'].append(cat_match.group(1).strip())
+            # 逐行解析（标题里的冒号、# 等原样保留；带引号的值去掉引号）
+            meta = parse_front_matter_fields(parts[1])
     
     return meta, body
 
@@ -154,7 +138,7 @@ def submit_post():
         
         # 处理 markdown 中的图片引用
         # 如果内容中有 base64 图片，需要先处理
-        content = process_images_in_markdown(content)
+        content, image_report = process_images_in_markdown(content)
         
         # 生成 front-matter
         front_matter = generate_front_matter(title, date, tags, categories, cover)
@@ -172,8 +156,8 @@ def submit_post():
         # 确保目录存在
         POSTS_DIR.mkdir(parents=True, exist_ok=True)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(post_content)
+        atomic_write_text(filepath, post_content)
+        get_catalog(POSTS_DIR).observe(filepath, post_content)
 
         response_data = {
             'errno': 0,
@@ -183,40 +167,12 @@ def submit_post():
             }
         }
 
-        # 异步生成静态文件（后台线程，不阻塞提交）
-        def _generate_job():
-            try:
-                import platform
-                if platform.system() == 'Windows':
-                    cmd = 'npx hexo generate'
-                else:
-                    cmd = ['npx', 'hexo', 'generate']
-
-                result = subprocess.run(
-                    cmd,
-                    check=False,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',  # 显式指定 utf-8
-                    errors='replace',  # 忽略解码错误
-                    shell=(platform.system() == 'Windows'),
-                    timeout=120,
-                    cwd=str(BASE_DIR)
-                )
-
-                if result.returncode != 0:
-                    error_msg = result.stderr if result.stderr else result.stdout
-                    print(f"生成静态文件失败: {error_msg[:200] if error_msg else '未知错误'}")
-                else:
-                    print("静态文件生成成功")
-            except subprocess.TimeoutExpired:
-                print("生成静态文件超时")
-            except Exception as e:
-                print(f"生成静态文件失败: {str(e)[:200]}")
+        if image_report['images']:
+            response_data['data']['images'] = image_report
 
+        # 静态文件生成交给构建队列（不阻塞提交）：同一时间只跑一个构建，期间的请求合并为一次后续构建
         try:
-            threading.Thread(target=_generate_job, daemon=True).start()
-            response_data['data']['generate_status'] = 'queued'
+            response_data['data']['generate_status'] = get_build_queue().request(f'submit:{filename}')
         except Exception as e:
             response_data['data']['generate_status'] = f'failed_to_queue: {str(e)[:120]}'
 
@@ -248,35 +204,35 @@ def submit_post():
 
 @bp.route('/posts/list', methods=['GET'])
 def list_posts():
-    """获取文章列表"""
+    """获取文章列表
+    参数（均可选）：
+    - sort: date（默认）/ title / size / words / mtime / filename；order: desc（默认）/ asc
+    - q: 标题或文件名包含；tag / category: 精确匹配（不区分大小写）
+    - limit: 每页条数（不传返回全部）；cursor: 上一页返回的 next_cursor
+    """
     try:
-        posts = []
-        if POSTS_DIR.exists():
-            for file in POSTS_DIR.glob('*.md'):
-                with open(file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # 简单解析 front-matter
-                    if content.startswith('---'):
-                        parts = content.split('---', 2)
-                        if len(parts) >= 3:
-                            front_matter = parts[1]
-                            # 提取标题
-                            title_match = re.search(r'title:\s*(.+)', front_matter)
-                            title = title_match.group(1).strip() if title_match else file.stem
-                            
-                            # 提取日期
-                            date_match = re.search(r'date:\s*(.+)', front_matter)
-                            date = date_match.group(1).strip() if date_match else ''
-                            
-                            posts.append({
-                                'filename': file.name,
-                                'title': title,
-                                'date': date,
-                                'size': file.stat().st_size
-                            })
-        
-        posts.sort(key=lambda x: x['date'], reverse=True)
-        return jsonify({'errno': 0, 'data': posts})
+        try:
+            limit = int(request.args.get('limit') or 0)
+        except ValueError:
+            return jsonify({'errno': 1, 'errmsg': 'limit 必须是整数'}), 400
+        try:
+            result = get_catalog(POSTS_DIR).query(
+                sort=request.args.get('sort') or 'date',
+                order=request.args.get('order') or 'desc',
+                q=request.args.get('q') or '',
+                tag=request.args.get('tag') or '',
+                category=request.args.get('category') or '',
+                limit=min(max(limit, 0), POSTS_PAGE_MAX),
+                cursor=request.args.get('cursor') or '',
+            )
+        except ValueError as e:
+            return jsonify({'errno': 1, 'errmsg': str(e)}), 400
+        return jsonify({
+            'errno': 0,
+            'data': result['items'],
+            'total': result['total'],
+            'next_cursor': result['next_cursor'],
+        })
     except Exception as e:
         return jsonify({'errno': 1, 'errmsg': f'获取列表失败: {str(e)}'}), 500
 
@@ -392,13 +348,18 @@ def get_post():
             return jsonify({'errno': 1, 'errmsg': '无效的文件名格式'}), 400
         
         filepath = POSTS_DIR / filename
-        if not filepath.exists():
+        catalog = get_catalog(POSTS_DIR)
+        # 只 stat 判断存在与否；catalog.get 遇到过期条目会把整篇再流式读一遍
+        if not filepath.is_file():
+            catalog.forget(filepath)
             return jsonify({'errno': 1, 'errmsg': '文章不存在'}), 404
         
         with open(filepath, 'r', encoding='utf-8') as f:
             content = f.read()
         
         meta, body = parse_front_matter(content)
+        # 整篇已经读出来了：顺手刷新文章目录
+        catalog.observe(filepath, content)
         
         return jsonify({
             'errno': 0,
@@ -479,14 +440,13 @@ def update_post():
         if not date:
             try:
                 with open(filepath, 'r', encoding='utf-8') as f:
-                    old_content = f.read()
-                old_meta, _ = parse_front_matter(old_content)
-                date = old_meta.get('date', datetime.now().strftime('%Y-%m-%d'))
+                    old_meta, _ = parse_front_matter(f.read())
+                date = old_meta.get('date') or datetime.now().strftime('%Y-%m-%d')
             except:
                 date = datetime.now().strftime('%Y-%m-%d')
         
         # 处理 markdown 中的图片引用
-        content = process_images_in_markdown(content)
+        content, image_report = process_images_in_markdown(content)
         
         # 生成 front-matter
         front_matter = generate_front_matter(title, date, tags, categories, cover)
@@ -494,54 +454,46 @@ def update_post():
         # 生成完整的文章内容
         post_content = front_matter + "\n\n" + content
         
-        # 保存文章文件
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(post_content)
-
+        # 与磁盘上的版本比较规范化 hash（空白、换行、标签顺序不算变化）：
+        # 页面相关内容变了才构建，检索相关内容变了才重新入库，都没变就都跳过
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+            old_content = f.read()
+        old_hashes, new_hashes = content_hashes(old_content), content_hashes(post_content)
+        need_build = old_hashes['build'] != new_hashes['build']
+        need_index = old_hashes['rag'] != new_hashes['rag']
+
+        # 保存文章文件（内容完全相同时不写，保留 mtime）
+        if post_content != old_content:
+            atomic_write_text(filepath, post_content)
+            get_catalog(POSTS_DIR).observe(filepath, post_content)
+
+        skipped = []
+        if need_build:
+            message = '文章更新成功，正在后台生成静态文件...'
+        elif post_content != old_content:
+            message = '文章更新成功（仅空白/格式变化，无需重新生成）'
+        else:
+            message = '文章内容未变化，无需重新生成'
         response_data = {
             'errno': 0,
             'data': {
                 'filename': filename,
-                'message': '文章更新成功，正在后台生成静态文件...'
+                'message': message
             }
         }
 
-        # 异步生成静态文件（后台线程，不阻塞更新）
-        def _generate_job():
+        if image_report['images']:
+            response_data['data']['images'] = image_report
+
+        # 静态文件生成交给构建队列（不阻塞更新）：同一时间只跑一个构建，期间的请求合并为一次后续构建
+        if not need_build:
+            skipped.append('generate')
+            response_data['data']['generate_status'] = 'skipped'
+        else:
             try:
-                import platform
-                if platform.system() == 'Windows':
-                    cmd = 'npx hexo generate'
-                else:
-                    cmd = ['npx', 'hexo', 'generate']
-
-                result = subprocess.run(
-                    cmd,
-                    check=False,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',  # 显式指定 utf-8
-                    errors='replace',  # 忽略解码错误
-                    shell=(platform.system() == 'Windows'),
-                    timeout=120,
-                    cwd=str(BASE_DIR)
-                )
-
-                if result.returncode != 0:
-                    error_msg = result.stderr if result.stderr else result.stdout
-                    print(f"生成静态文件失败: {error_msg[:200] if error_msg else '未知错误'}")
-                else:
-                    print("静态文件生成成功")
-            except subprocess.TimeoutExpired:
-                print("生成静态文件超时")
+                response_data['data']['generate_status'] = get_build_queue().request(f'update:{filename}')
             except Exception as e:
-                print(f"生成静态文件失败: {str(e)[:200]}")
-
-        try:
-            threading.Thread(target=_generate_job, daemon=True).start()
-            response_data['data']['generate_status'] = 'queued'
-        except Exception as e:
-            response_data['data']['generate_status'] = f'failed_to_queue: {str(e)[:120]}'
+                response_data['data']['generate_status'] = f'failed_to_queue: {str(e)[:120]}'
 
         # 增量入库：单篇文章 embedding + 写入 Chroma（后台线程，不阻塞提交）
         def _index_job(path_str: str):
@@ -550,12 +502,17 @@ def update_post():
             except Exception as e:
                 print(f"RAG 增量入库失败: {e}")
 
-        try:
-            threading.Thread(target=_index_job, args=(str(filepath),), daemon=True).start()
-            response_data['data']['rag_index'] = 'queued'
-        except Exception as e:
-            response_data['data']['rag_index'] = f'failed_to_queue: {str(e)[:120]}'
+        if not need_index:
+            skipped.append('rag_index')
+            response_data['data']['rag_index'] = 'skipped'
+        else:
+            try:
+                threading.Thread(target=_index_job, args=(str(filepath),), daemon=True).start()
+                response_data['data']['rag_index'] = 'queued'
+            except Exception as e:
+                response_data['data']['rag_index'] = f'failed_to_queue: {str(e)[:120]}'
 
+        response_data['data']['skipped'] = skipped
         return jsonify(response_data)
         
     except Exception as e:
@@ -568,6 +525,56 @@ def update_post():
             'detail': error_detail if current_app.config.get('DEBUG') else None
         }), 500
 
+@bp.route('/posts/migrate-images', methods=['POST'])
+def migrate_inline_images():
+    """批量迁移：把已有文章里的内嵌 base64 图片抽成文件（{"dry_run": true} 只统计不写）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run'))
+        catalog = get_catalog(POSTS_DIR)
+        report = {'dry_run': dry_run, 'posts_scanned': 0, 'posts_changed': [], 'errors': [],
+                  'images': 0, 'written': 0, 'deduped': 0, 'skipped': 0, 'chars_removed': 0}
+        for entry in catalog.entries(recursive=True):
+            filepath = POSTS_DIR / entry['filename']
+            report['posts_scanned'] += 1
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    raw = f.read()
+                content, rep = extract_inline_images(raw, CONTENT_IMAGES_DIR, dry_run=dry_run)
+            except Exception as e:
+                report['errors'].append(f"{entry['filename']}: {str(e)[:120]}")
+                continue
+            for key in ('images', 'written', 'deduped', 'skipped', 'chars_removed'):
+                report[key] += rep[key]
+            if content == raw:
+                continue
+            report['posts_changed'].append(entry['filename'])
+            if not dry_run:
+                atomic_write_text(filepath, content)
+                catalog.observe(filepath, content)
+
+        if report['posts_changed'] and not dry_run:
+            try:
+                report['generate_status'] = get_build_queue().request('migrate-images')
+            except Exception as e:
+                report['generate_status'] = f'failed_to_queue: {str(e)[:120]}'
+
+            # 改写过的文章重新入库（base64 不再被当成正文 embedding）
+            def _index_job(paths):
+                for path_str in paths:
+                    try:
+                        upsert_post(path_str)
+                    except Exception as e:
+                        print(f"RAG 增量入库失败: {e}")
+
+            paths = [str(POSTS_DIR / name) for name in report['posts_changed']]
+            threading.Thread(target=_index_job, args=(paths,), daemon=True).start()
+            report['rag_index'] = 'queued'
+
+        return jsonify({'errno': 0, 'data': report})
+    except Exception as e:
+        return jsonify({'errno': 1, 'errmsg': f'迁移失败: {str(e)}'}), 500
+
 @bp.route('/posts/delete', methods=['DELETE', 'POST'])
 def delete_post():
     """删除文章"""
@@ -598,6 +605,7 @@ def delete_post():
         
         # 删除文件
         filepath.unlink()
+        get_catalog(POSTS_DIR).forget(filepath)
 
         response_data = {
             'errno': 0,
@@ -606,40 +614,9 @@ def delete_post():
             }
         }
 
-        # 异步生成静态文件（后台线程，不阻塞删除）
-        def _generate_job():
-            try:
-                import platform
-                if platform.system() == 'Windows':
-                    cmd = 'npx hexo generate'
-                else:
-                    cmd = ['npx', 'hexo', 'generate']
-
-                result = subprocess.run(
-                    cmd,
-                    check=False,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',  # 显式指定 utf-8
-                    errors='replace',  # 忽略解码错误
-                    shell=(platform.system() == 'Windows'),
-                    timeout=120,
-                    cwd=str(BASE_DIR)
-                )
-
-                if result.returncode != 0:
-                    error_msg = result.stderr if result.stderr else result.stdout
-                    print(f"生成静态文件失败: {error_msg[:200] if error_msg else '未知错误'}")
-                else:
-                    print("静态文件生成成功")
-            except subprocess.TimeoutExpired:
-                print("生成静态文件超时")
-            except Exception as e:
-                print(f"生成静态文件失败: {str(e)[:200]}")
-
+        # 静态文件生成交给构建队列（不阻塞删除）：同一时间只跑一个构建，期间的请求合并为一次后续构建
         try:
-            threading.Thread(target=_generate_job, daemon=True).start()
-            response_data['data']['generate_status'] = 'queued'
+            response_data['data']['generate_status'] = get_build_queue().request(f'delete:{filename}')
         except Exception as e:
             response_data['data']['generate_status'] = f'failed_to_queue: {str(e)[:120]}'
 
@@ -1,134 +1,329 @@
-import json
+import hashlib
+import itertools
+import time
 import traceback
 from datetime import datetime
 
 from flask import Blueprint, jsonify, request, Response
 
-from .rag_store import load_rag_config, reindex_posts, retrieve, upsert_post, get_citation_detail
+from .answer_cache import citation_key
+from .context_pack import pack_context, pack_stats
+from .embed_cache import normalize_query
+from .jobs import reindex_jobs
+from .llm_client import chat_clients
+from .rag_store import retrieve, retrieve_with_vector, upsert_post, get_citation_detail, get_citation_details
+from .runtime import get_runtime
+from .singleflight import FlightGroup
+from .sse import TokenCoalescer, coalesce_stats, sse_frame
+from .timing import begin_trace, chat_logger, configure_chat_logging, end_trace, server_timing, stage_stats
 
 bp = Blueprint('rag_bot', __name__)
 
+# 进行中的问答（按归一化问题合并并发请求）
+chat_flights = FlightGroup()
 
-def stream_mascot_chat(data):
-    """看板娘聊天流式生成器（RAG：向量检索 + 引用来源）"""
-    print('[AI Chat Stream] 函数被调用')
 
+@bp.record_once
+def _warm_chat_client(state):
+    """应用启动时在后台预热大模型连接（TLS 握手不落在第一个访客头上）"""
     try:
-        question = (data.get('question') or '').strip()
-        print(f'[AI Chat Stream] 问题: {question[:50]}...' if len(question) > 50 else f'[AI Chat Stream] 问题: {question}')
-
-        if not question:
-            yield 'data: {"type": "error", "message": "question 不能为空"}\n\n'
-            return
-
-        cfg = load_rag_config()
-        top_k = max(1, int(cfg.retrieve_k))
-        cand_k = max(top_k, int(cfg.retrieve_candidate_k))
-
-        # 检索
-        hits = retrieve(
-            cfg,
-            question,
-            k=top_k,
-            candidate_k=cand_k,
-            max_distance=cfg.retrieve_max_distance,
-            per_post_max=cfg.retrieve_per_post_max,
+        cfg = get_runtime().config()
+        if cfg.chat_warmup:
+            chat_clients.warm_async(cfg)
+    except Exception as e:
+        chat_logger.warning('启动预热跳过: %s', e)
+
+
+def _chat_client(cfg):
+    """返回 (client, 错误信息)；未配置密钥时 client 为 None。客户端进程内共享，复用连接池"""
+    return chat_clients.get(cfg)
+
+
+def _chat_messages(cfg, question, numbered_context):
+    user = (
+        f"问题：{question}\n\n"
+        f"引用资料（可引用编号）：\n\n" + "\n\n".join(numbered_context)
+    )
+    return [
+        {"role": "system", "content": cfg.chat_system_prompt},
+        {"role": "user", "content": user},
+    ]
+
+
+def _answer_cache_key(cfg, citations):
+    # 模型 / 系统提示词变了，缓存的回答也不能再用
+    variant = f"{cfg.chat_provider}|{cfg.chat_model}|{hashlib.sha256(cfg.chat_system_prompt.encode('utf-8')).hexdigest()[:12]}"
+    return citation_key(citations, variant)
+
+
+def _prepare_chat(question, trace):
+    """检索 + 拼上下文 + 查回答缓存（同步执行；线程生产者与异步网关共用）"""
+    with trace.span("config"):
+        rt = get_runtime()
+        cfg = rt.config()
+        configure_chat_logging(cfg.log_level)
+        stage_stats.resize(cfg.timing_window)
+    top_k = max(1, int(cfg.retrieve_k))
+    cand_k = max(top_k, int(cfg.retrieve_candidate_k))
+
+    # 检索（embed / vector / lexical 子阶段在 retrieve 内部计时）
+    hits, question_vec = retrieve_with_vector(
+        cfg,
+        question,
+        k=top_k,
+        candidate_k=cand_k,
+        max_distance=cfg.retrieve_max_distance,
+        per_post_max=cfg.retrieve_per_post_max,
+    )
+    with trace.span("context"):
+        citations, numbered_context, packing = pack_context(
+            hits, cfg.max_context_tokens, cfg.max_chunk_tokens, overlap=cfg.chunk_overlap
         )
-
-        citations = []
-        numbered_context = []
-        total_ctx = 0
-        idx = 0
-        for h in hits:
-            url = (h.get("url") or "").strip()
-            post_id = (h.get("post_id") or "").strip()
-            chunk = h.get("chunk")
-
-            content = (h.get("content") or "").strip()
-            if cfg.max_chunk_chars and len(content) > cfg.max_chunk_chars:
-                content = content[: cfg.max_chunk_chars].rstrip() + "…"
-
-            next_id = idx + 1
-            block = f"[{next_id}] {h.get('title') or ''}\nURL: {url}\n内容：{content}"
-            if cfg.max_context_chars and (total_ctx + len(block)) > cfg.max_context_chars:
-                break
-
-            idx = next_id
-            citations.append({
-                "id": idx,
-                "title": h.get("title") or "",
-                "url": url,
-                "post_id": post_id,
-                "chunk": chunk,
-                "distance": h.get("distance"),
-            })
-            numbered_context.append(block)
-            total_ctx += len(block)
-
-        # 先发送引用来源
-        if citations:
-            citations_data = json.dumps({"type": "citations", "citations": citations})
-            print(f'[AI Chat Stream] 发送 citations: {len(citations)} 条')
-            yield f'data: {citations_data}\n\n'
-        else:
-            print('[AI Chat Stream] 没有引用来源')
+        pack_stats.record(packing)
+
+    # 语义回答缓存：相似问题 + 相同引用，直接回放上一次的回答（问题向量取 retrieve 算好的那一个）
+    with trace.span("cache"):
+        answer_cache = rt.answer_cache()
+        cache_key = _answer_cache_key(cfg, citations)
+        # 检索无结果时直接给固定回答，不查缓存
+        cached = answer_cache.get(question_vec, cache_key) if hits else None
+    return {
+        "cfg": cfg,
+        "hits": hits,
+        "citations": citations,
+        "packing": packing,
+        "messages": _chat_messages(cfg, question, numbered_context),
+        "answer_cache": answer_cache,
+        "question_vec": question_vec,
+        "cache_key": cache_key,
+        "cached": cached,
+        # 调用大模型前的失效代数：生成期间文章被改动，这一轮的回答不写缓存
+        "epoch": answer_cache.epoch(),
+    }
+
+
+def _no_hit_answer():
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return f"我没在你的博客文章里检索到相关内容（时间：{now}）。你可以换个问法，或先调用API 重建索引。"
+
+
+def _answered(prep):
+    """检索后已能给出回答（检索无结果 / 命中回答缓存），不必再调用大模型"""
+    return not prep["hits"] or prep["cached"] is not None
+
+
+def _head_events(prep, trace):
+    """检索完成后的事件：retrieved / citations；检索无结果或命中回答缓存时直接带上回答与 done"""
+    # 检索阶段的耗时随 retrieved 带出：流式接口据此生成 Server-Timing 响应头
+    events = [{"type": "retrieved", "hits": len(prep["hits"]), "timing": trace.snapshot(total=False)}]
+    if not prep["hits"]:
+        events.append({"type": "content", "text": _no_hit_answer()})
+        events.append(_timing_event(trace, prep["packing"]))
+        events.append({"type": "done", "no_hits": True})
+        return events
+    # 先发送引用来源
+    if prep["citations"]:
+        events.append({"type": "citations", "citations": prep["citations"]})
+    cached = prep["cached"]
+    if cached is not None:
+        chat_logger.info('命中回答缓存（相似度 %s）', cached["similarity"])
+        events.append({"type": "content", "text": cached["answer"]})
+        events.append(_timing_event(trace, prep["packing"]))
+        events.append({"type": "done", "cached": True})
+    return events
+
+
+class _ChunkCounter:
+    """统计上游 chunk：首 token 耗时 / 抽样日志 / 拼接完整回答"""
+
+    def __init__(self, cfg, trace):
+        self.trace = trace
+        self.sample_every = max(0, int(cfg.log_chunk_every))
+        self.count = 0
+        self.parts = []
+        self.t_start = time.perf_counter()
+        self.t_first = None
+
+    def feed(self, chunk):
+        self.count += 1
+        content = (chunk.choices[0].delta.content or "") if chunk.choices else ""
+        if self.sample_every and self.count % self.sample_every == 0:
+            chat_logger.debug('收到 chunk %d: "%s"', self.count, content[:50])
+        if content:
+            if self.t_first is None:
+                self.t_first = time.perf_counter()
+                self.trace.add("ttft", (self.t_first - self.t_start) * 1000)
+            self.parts.append(content)
+            return {"type": "content", "text": content}
+        return None
+
+    def finish(self):
+        self.trace.add("stream", (time.perf_counter() - (self.t_first or self.t_start)) * 1000)
+
+
+def _tail_events(prep, trace, counter):
+    """生成完成：写回答缓存，给出 timing / done"""
+    cfg = prep["cfg"]
+    counter.finish()
+    # 只缓存完整生成的回答
+    prep["answer_cache"].put(
+        prep["question_vec"], prep["cache_key"], "".join(counter.parts).strip(), prep["citations"], epoch=prep["epoch"]
+    )
+    timing = _timing_event(trace, prep["packing"])
+    chat_logger.info(
+        '完成：%d 个 chunks，model=%s，上下文 %d token（省 %d），%s',
+        counter.count, cfg.chat_model, prep["packing"]["tokens"], prep["packing"]["tokens_saved"], server_timing(timing["spans"]),
+    )
+    # 发送结束信号
+    return [timing, {"type": "done"}]
+
+
+def _chat_events(question):
+    """
+    一次问答的事件序列（dict）：
+    retrieved（内部事件，不下发）/ citations / content / timing / done / error。
+    在 chat_flights 的生产者线程里执行，相同问题的并发请求共享同一份事件。
+    """
+    trace = begin_trace()
+    try:
+        prep = _prepare_chat(question, trace)
+        yield from _head_events(prep, trace)
+        if _answered(prep):
+            return
 
         # 生成回答（DeepSeek / OpenAI，均为 OpenAI SDK 调用方式）
-        from openai import OpenAI
-
-        if cfg.chat_provider == "deepseek":
-            if not cfg.deepseek_api_key:
-                yield 'data: {"type": "error", "message": "未配置 DEEPSEEK_API_KEY。请在 backend/.env 中设置 DEEPSEEK_API_KEY=xxx"}\n\n'
-                return
-            client = OpenAI(api_key=cfg.deepseek_api_key, base_url=cfg.chat_base_url)
-        else:
-            if not cfg.openai_api_key:
-                yield 'data: {"type": "error", "message": "RAG_CHAT_PROVIDER=openai 但未配置 OPENAI_API_KEY。"}\n\n'
-                return
-            client = OpenAI(api_key=cfg.openai_api_key)
-        system = cfg.chat_system_prompt
-        user = (
-            f"问题：{question}\n\n"
-            f"引用资料（可引用编号）：\n\n" + "\n\n".join(numbered_context)
-        )
-
-        print(f'[AI Chat Stream] 开始调用 AI，model: {cfg.chat_model}')
+        cfg = prep["cfg"]
+        client, err = _chat_client(cfg)
+        if client is None:
+            yield {"type": "error", "message": err}
+            return
 
-        # 流式调用
+        # 流式调用（非流式请求同样消费这条流，再拼成完整回答）
+        counter = _ChunkCounter(cfg, trace)
         resp = client.chat.completions.create(
             model=cfg.chat_model,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+            messages=prep["messages"],
             temperature=0.2,
             stream=True,
         )
+        try:
+            for chunk in resp:
+                event = counter.feed(chunk)
+                if event is not None:
+                    yield event
+        finally:
+            # 所有订阅者都断开时生产者会关闭本生成器：同时关闭上游连接，不再消耗 token
+            close = getattr(resp, "close", None)
+            if close is not None:
+                close()
+        yield from _tail_events(prep, trace, counter)
 
-        chunk_count = 0
-        for chunk in resp:
-            chunk_count += 1
-            content = chunk.choices[0].delta.content or ""
-            print(f'[AI Chat Stream] 收到 chunk {chunk_count}: "{content[:50]}..."' if len(content) > 50 else f'[AI Chat Stream] 收到 chunk {chunk_count}: "{content}"')
-            if content:
-                data = json.dumps({"type": "content", "text": content})
-                yield f'data: {data}\n\n'
+    except Exception as e:
+        chat_logger.error('AI 服务异常\n%s', traceback.format_exc())
+        yield {"type": "error", "message": f"AI 服务异常: {str(e)}"}
+    finally:
+        end_trace()
 
-        print(f'[AI Chat Stream] 完成，共 {chunk_count} 个 chunks')
-        # 发送结束信号
-        yield 'data: {"type": "done"}\n\n'
 
-    except Exception as e:
-        error_msg = str(e)
-        print(f'[AI Chat Stream Error] {traceback.format_exc()}')
-        yield f'data: {{"type": "error", "message": "AI 服务异常: {error_msg}"}}\n\n'
+def _timing_event(trace, packing=None):
+    """各阶段耗时（毫秒），附带上下文打包统计；同时计入滚动分位数统计"""
+    spans = trace.snapshot()
+    stage_stats.record(spans)
+    event = {"type": "timing", "spans": spans}
+    if packing is not None:
+        event["context"] = packing
+    return event
+
+
+def _coalesced_chat_events(question, coalescer=None):
+    """相同（归一化后）问题的并发请求合并为一次检索 + 一次上游调用；coalescer 合并相邻 token"""
+    return chat_flights.subscribe(normalize_query(question), lambda: _chat_events(question), coalescer)
+
+
+def _token_coalescer(cfg):
+    return TokenCoalescer(cfg.sse_flush_ms, cfg.sse_flush_bytes)
+
+
+def stream_mascot_chat(data, events=None, coalescer=None):
+    """看板娘聊天流式生成器（RAG：向量检索 + 引用来源）；events 为已开始消费的事件流"""
+    question = (data.get('question') or '').strip()
+    if not question:
+        yield 'data: {"type": "error", "message": "question 不能为空"}\n\n'
+        return
+
+    cfg = get_runtime().config()
+    show_timing = bool(data.get('timing')) or cfg.timing_event
+    if events is None:
+        coalescer = _token_coalescer(cfg)
+        events = _coalesced_chat_events(question, coalescer)
+    try:
+        for event in events:
+            frame = _sse_output(event, show_timing, coalescer)
+            if frame is not None:
+                yield frame
+    finally:
+        _record_coalesce(coalescer)
+
+
+def _sse_output(event, show_timing, coalescer):
+    """事件 -> SSE 帧；内部事件（retrieved）与未开启的 timing 返回 None"""
+    if event["type"] == "retrieved" or (event["type"] == "timing" and not show_timing):
+        return None
+    if event["type"] == "timing" and coalescer is not None:
+        event = {**event, "sse": coalescer.report()}
+    return sse_frame(event)
+
+
+def _record_coalesce(coalescer):
+    if coalescer is not None:
+        report = coalescer.report()
+        coalesce_stats.record(report)
+        chat_logger.debug('SSE 合并：%s', report)
+
+
+def _answer_result(events, want_timing=False):
+    """
+    非流式：把事件流拼成完整回答，返回 (HTTP 状态码, 响应体, 各阶段耗时)。
+    检索无结果时直接给出固定回答，不等大模型。
+    """
+    citations = []
+    parts = []
+    cached = False
+    timing = {}
+    for event in events:
+        etype = event["type"]
+        if etype == "retrieved":
+            timing = event["timing"]
+            if not event["hits"]:
+                return 200, {'errno': 0, 'data': {'answer': _no_hit_answer(), 'citations': []}}, timing
+        elif etype == "citations":
+            citations = event["citations"]
+        elif etype == "content":
+            parts.append(event["text"])
+        elif etype == "timing":
+            timing = event["spans"]
+        elif etype == "done":
+            cached = bool(event.get("cached"))
+        elif etype == "error":
+            return 500, {'errno': 1, 'errmsg': event["message"]}, timing
+    answer = "".join(parts).strip()
+
+    payload = {'answer': answer or '（没有返回内容）', 'citations': citations}
+    if cached:
+        payload['cached'] = True
+    if want_timing:
+        payload['timing'] = timing
+    return 200, {'errno': 0, 'data': payload}, timing
+
+
+def _answer_ends(event):
+    """非流式拼接到此为止（与 _answer_result 的提前返回条件一致）"""
+    return event["type"] in ("error", "done") or (event["type"] == "retrieved" and not event["hits"])
 
 
 @bp.route('/ai/mascot/chat', methods=['POST'])
 def mascot_chat():
     """看板娘聊天（RAG：向量检索 + 引用来源）"""
-    print('[AI Chat] mascot_chat 被调用')
-
     try:
         if not request.is_json:
             return jsonify({'errno': 1, 'errmsg': '请求必须是 JSON 格式'}), 400
@@ -136,114 +331,44 @@ def mascot_chat():
         # 获取请求数据
         data = request.get_json(silent=True) or {}
         stream = data.get('stream', False)
-        print(f'[AI Chat] stream={stream}, question={data.get("question", "")[:50]}...' if len(data.get("question", "")) > 50 else f'[AI Chat] stream={stream}, question={data.get("question", "")}')
+        question = (data.get('question') or '').strip()
+        chat_logger.debug('mascot_chat stream=%s, question=%s', stream, question[:50])
 
         if stream:
+            headers = {
+                'Cache-Control': 'no-cache',
+                # 注意：Connection 和 X-Accel-Buffering 是 hop-by-hop 头
+                # 由代理服务器（Nginx）处理，WSGI 应用程序不应设置
+            }
+            events = coalescer = None
+            if question:
+                # 先消费到检索完成：检索各阶段耗时放进 Server-Timing 头（生成阶段的耗时见 timing 事件）
+                coalescer = _token_coalescer(get_runtime().config())
+                events = _coalesced_chat_events(question, coalescer)
+                head = []
+                for event in events:
+                    head.append(event)
+                    if event["type"] in ("retrieved", "error", "done"):
+                        break
+                if head and head[-1]["type"] == "retrieved":
+                    headers['Server-Timing'] = server_timing(head[-1]["timing"])
+                events = itertools.chain(head, events)
             # 返回流式响应
-            print('[AI Chat] 返回流式响应')
             return Response(
-                stream_mascot_chat(data),
+                stream_mascot_chat(data, events, coalescer),
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    # 注意：Connection 和 X-Accel-Buffering 是 hop-by-hop 头
-                    # 由代理服务器（Nginx）处理，WSGI 应用程序不应设置
-                }
+                headers=headers,
             )
 
-        # 非流式模式（兼容旧版）
-        question = (data.get('question') or '').strip()
+        # 非流式模式（兼容旧版）：订阅同一条事件流，拼成完整回答
         if not question:
             return jsonify({'errno': 1, 'errmsg': 'question 不能为空'}), 400
 
-        cfg = load_rag_config()
-        top_k = max(1, int(cfg.retrieve_k))
-        cand_k = max(top_k, int(cfg.retrieve_candidate_k))
-
-        # 检索
-        hits = retrieve(
-            cfg,
-            question,
-            k=top_k,
-            candidate_k=cand_k,
-            max_distance=cfg.retrieve_max_distance,
-            per_post_max=cfg.retrieve_per_post_max,
-        )
-        if not hits:
-            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            answer = f"我没在你的博客文章里检索到相关内容（时间：{now}）。你可以换个问法，或先调用API 重建索引。"
-            return jsonify({'errno': 0, 'data': {'answer': answer, 'citations': []}})
-
-        citations = []
-        numbered_context = []
-        total_ctx = 0
-        idx = 0
-        for h in hits:
-            url = (h.get("url") or "").strip()
-            post_id = (h.get("post_id") or "").strip()
-            chunk = h.get("chunk")
-
-            content = (h.get("content") or "").strip()
-            if cfg.max_chunk_chars and len(content) > cfg.max_chunk_chars:
-                content = content[: cfg.max_chunk_chars].rstrip() + "…"
-
-            next_id = idx + 1
-            block = f"[{next_id}] {h.get('title') or ''}\nURL: {url}\n内容：{content}"
-            if cfg.max_context_chars and (total_ctx + len(block)) > cfg.max_context_chars:
-                break
-
-            idx = next_id
-            citations.append({
-                "id": idx,
-                "title": h.get("title") or "",
-                "url": url,
-                "post_id": post_id,
-                "chunk": chunk,
-                "distance": h.get("distance"),
-            })
-            numbered_context.append(block)
-            total_ctx += len(block)
-
-        # 生成回答（DeepSeek / OpenAI，均为 OpenAI SDK 调用方式）
-        from openai import OpenAI
-
-        if cfg.chat_provider == "deepseek":
-            if not cfg.deepseek_api_key:
-                return jsonify({
-                    'errno': 1,
-                    'errmsg': '未配置 DEEPSEEK_API_KEY。请在 backend/.env 中设置 DEEPSEEK_API_KEY=xxx'
-                }), 500
-            client = OpenAI(api_key=cfg.deepseek_api_key, base_url=cfg.chat_base_url)
-        else:
-            if not cfg.openai_api_key:
-                return jsonify({
-                    'errno': 1,
-                    'errmsg': 'RAG_CHAT_PROVIDER=openai 但未配置 OPENAI_API_KEY。'
-                }), 500
-            client = OpenAI(api_key=cfg.openai_api_key)
-        system = cfg.chat_system_prompt
-        user = (
-            f"问题：{question}\n\n"
-            f"引用资料（可引用编号）：\n\n" + "\n\n".join(numbered_context)
-        )
-
-        resp = client.chat.completions.create(
-            model=cfg.chat_model,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
-            temperature=0.2,
-        )
-        answer = (resp.choices[0].message.content or "").strip()
-
-        return jsonify({
-            'errno': 0,
-            'data': {
-                'answer': answer or '（没有返回内容）',
-                'citations': citations
-            }
-        })
+        status, body, timing = _answer_result(_coalesced_chat_events(question), bool(data.get('timing')))
+        resp = jsonify(body)
+        if timing:
+            resp.headers['Server-Timing'] = server_timing(timing)
+        return resp, status
     except Exception as e:
         return jsonify({'errno': 1, 'errmsg': f'AI 服务异常: {str(e)}'}), 500
 
@@ -258,7 +383,7 @@ def mascot_debug_retrieve():
         query = (data.get('query') or '').strip()
         if not query:
             return jsonify({'errno': 1, 'errmsg': 'query 不能为空'}), 400
-        cfg = load_rag_config()
+        cfg = get_runtime().config()
         k = int(data.get("k") or cfg.retrieve_k)
         cand_k = int(data.get("candidate_k") or cfg.retrieve_candidate_k)
         hits = retrieve(
@@ -276,6 +401,7 @@ def mascot_debug_retrieve():
             "post_id": h.get("post_id"),
             "chunk": h.get("chunk"),
             "distance": h.get("distance"),
+            "match": h.get("match"),
             "snippet": h.get("snippet"),
         } for h in hits]
         return jsonify({'errno': 0, 'data': {'query': query, 'hits': slim}})
@@ -285,15 +411,41 @@ def mascot_debug_retrieve():
 
 @bp.route('/ai/mascot/reindex', methods=['POST'])
 def mascot_reindex():
-    """重建向量索引（从 source/_posts 全量入库到 Chroma）"""
+    """
+    提交后台重建任务（默认按内容 hash 差量同步 source/_posts；{"full": true} 强制全量重建）。
+    立即返回 job_id，进度用 /ai/mascot/reindex/status 查询。
+    """
     try:
-        cfg = load_rag_config()
-        info = reindex_posts(cfg)
-        return jsonify({'errno': 0, 'data': info})
+        data = request.get_json(silent=True) or {}
+        cfg = get_runtime().config()
+        job, created = reindex_jobs.start(cfg, full=bool(data.get("full")))
+        return jsonify({'errno': 0, 'data': {**job.to_dict(), 'already_running': not created}})
     except Exception as e:
         return jsonify({'errno': 1, 'errmsg': f'建库失败: {str(e)}'}), 500
 
 
+@bp.route('/ai/mascot/reindex/status', methods=['GET'])
+def mascot_reindex_status():
+    """查询重建任务进度（不传 job_id 则返回最近一次任务）"""
+    job = reindex_jobs.get((request.args.get("job_id") or "").strip() or None)
+    if job is None:
+        return jsonify({'errno': 1, 'errmsg': '任务不存在'}), 404
+    return jsonify({'errno': 0, 'data': job.to_dict()})
+
+
+@bp.route('/ai/mascot/reindex/cancel', methods=['POST'])
+def mascot_reindex_cancel():
+    """取消重建任务（差量模式回滚：恢复被改动 chunk 的原状、删除本次新增的 chunk；全量模式丢弃未切换的影子 collection）"""
+    data = request.get_json(silent=True) or {}
+    job_id = (data.get("job_id") or request.args.get("job_id") or "").strip()
+    if not job_id:
+        return jsonify({'errno': 1, 'errmsg': 'job_id 不能为空'}), 400
+    job = reindex_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'errno': 1, 'errmsg': '任务不存在'}), 404
+    return jsonify({'errno': 0, 'data': job.to_dict()})
+
+
 @bp.route('/ai/mascot/index_post', methods=['POST'])
 def mascot_index_post():
     """增量入库单篇文章（供后台/管理端调用）"""
@@ -323,3 +475,51 @@ def mascot_citation_detail():
     except Exception as e:
         return jsonify({'errno': 1, 'errmsg': f'获取引用详情失败: {str(e)}'}), 500
 
+
+# 批量引用详情一次最多取这么多条
+_CITATION_BATCH_MAX = 50
+
+
+@bp.route('/ai/mascot/citation_details', methods=['POST'])
+def mascot_citation_details():
+    """批量获取引用详情：{"items": [{"post_id": ..., "chunk": 3} 或 {"post_id": ..., "chunks": [3, 4]}]}"""
+    try:
+        if not request.is_json:
+            return jsonify({'errno': 1, 'errmsg': '请求必须是 JSON 格式'}), 400
+        data = request.get_json() or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'errno': 1, 'errmsg': 'items 不能为空'}), 400
+        keys = []
+        for it in items:
+            if not isinstance(it, dict):
+                return jsonify({'errno': 1, 'errmsg': 'items 格式错误'}), 400
+            post_id = str(it.get('post_id') or '').strip()
+            chunks = it.get('chunks') if isinstance(it.get('chunks'), list) else [it.get('chunk')]
+            if not post_id or any(c is None for c in chunks):
+                return jsonify({'errno': 1, 'errmsg': 'post_id / chunk 不能为空'}), 400
+            try:
+                keys.extend((post_id, int(c)) for c in chunks)
+            except (TypeError, ValueError):
+                return jsonify({'errno': 1, 'errmsg': 'chunk 必须是整数'}), 400
+        if len(keys) > _CITATION_BATCH_MAX:
+            return jsonify({'errno': 1, 'errmsg': f'一次最多获取 {_CITATION_BATCH_MAX} 条引用'}), 400
+        return jsonify({'errno': 0, 'data': {'items': get_citation_details(keys)}})
+    except Exception as e:
+        return jsonify({'errno': 1, 'errmsg': f'获取引用详情失败: {str(e)}'}), 500
+
+
+@bp.route('/ai/mascot/stats', methods=['GET'])
+def mascot_stats():
+    """RAG 运行时统计（缓存命中率等）"""
+    try:
+        return jsonify({'errno': 0, 'data': {
+            **get_runtime().stats(),
+            'chat_flights': chat_flights.stats(),
+            'chat_clients': chat_clients.stats(),
+            'chat_timing': stage_stats.stats(),
+            'sse_coalesce': coalesce_stats.stats(),
+            'context_packing': pack_stats.stats(),
+        }})
+    except Exception as e:
+        return jsonify({'errno': 1, 'errmsg': f'获取统计失败: {str(e)}'}), 500
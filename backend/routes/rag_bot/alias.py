@@ -0,0 +1,94 @@
+"""
+collection 别名（蓝绿切换）。
+
+全量重建写入带版本号的影子 collection（hexo_posts__v<时间戳>），完成后原子地改写
+backend/.rag/active_collection.json 里的指针；retrieve() 通过 RagRuntime 读取这个指针。
+被替换下来的旧版本不会立刻删除：正在进行中的查询可能还拿着旧句柄，过了宽限期再回收。
+
+指针文件格式：
+{"active": "hexo_posts__v1760000000", "retired": [{"name": "...", "retired_at": 1760000000.0}]}
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class CollectionAlias:
+    def __init__(self, path: Path, default_name: str) -> None:
+        self.path = path
+        self.default_name = default_name  # 没有指针文件时（旧部署）沿用固定名字
+        self._lock = threading.Lock()
+        self._cache: Optional[Dict[str, Any]] = None
+        self._cache_mtime: Optional[float] = None
+
+    def _read_locked(self) -> Dict[str, Any]:
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return {"active": self.default_name, "retired": []}
+        if self._cache is None or mtime != self._cache_mtime:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8")) or {}
+            except Exception:
+                data = {}
+            self._cache = {
+                "active": str(data.get("active") or self.default_name),
+                "retired": list(data.get("retired") or []),
+            }
+            self._cache_mtime = mtime
+        return self._cache
+
+    def _write_locked(self, data: Dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        # os.replace 在同一文件系统上是原子的：读者要么看到旧指针，要么看到新指针
+        os.replace(tmp, self.path)
+        self._cache = None
+
+    def active_name(self) -> str:
+        with self._lock:
+            return self._read_locked()["active"]
+
+    def new_version_name(self) -> str:
+        return f"{self.default_name}__v{int(time.time() * 1000)}"
+
+    def swap(self, new_name: str) -> str:
+        """把指针切到 new_name，返回被替换下来的旧名字（记入 retired 等待回收）"""
+        with self._lock:
+            data = self._read_locked()
+            old = data["active"]
+            retired = [r for r in data["retired"] if r.get("name") not in (new_name, old)]
+            if old != new_name:
+                retired.append({"name": old, "retired_at": time.time()})
+            self._write_locked({"active": new_name, "retired": retired})
+            return old
+
+    def gc(self, client, grace_seconds: float) -> List[str]:
+        """删除退役超过宽限期的旧版本 collection，返回已删除的名字"""
+        now = time.time()
+        with self._lock:
+            data = self._read_locked()
+            keep, dropped = [], []
+            for r in data["retired"]:
+                if now - float(r.get("retired_at") or 0) >= grace_seconds:
+                    dropped.append(r["name"])
+                else:
+                    keep.append(r)
+            if not dropped:
+                return []
+            self._write_locked({"active": data["active"], "retired": keep})
+        for name in dropped:
+            try:
+                client.delete_collection(name)
+            except Exception:
+                pass  # 已被手动删除等情况
+        return dropped
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = self._read_locked()
+            return {"active": data["active"], "retired": list(data["retired"])}
@@ -0,0 +1,171 @@
+"""
+语义回答缓存：相似问题 + 相同引用 -> 直接回放上一次的回答。
+
+访客的问题高度重复（"博主是谁""这个主题怎么配置"……），每一次都要完整跑一遍 DeepSeek。
+检索本身已经有向量缓存，代价很低；真正贵的是生成。这里在检索之后、调用大模型之前查缓存：
+- 命中条件：问题向量 cosine 相似度 >= 阈值，且本次检索出的引用 chunk 集合（及模型/提示词）完全一致
+- 命中后按原 SSE 事件顺序（citations -> content -> done）一次性回放
+- upsert_post / reindex_posts 改动了某篇文章时，引用过该文章的缓存条目全部失效
+- 支持 TTL 与条数上限（LRU），并统计命中率
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class _Entry:
+    __slots__ = ("id", "key", "vec", "answer", "citations", "post_ids", "created", "hits")
+
+    def __init__(self, entry_id: int, key: Tuple, vec: np.ndarray, answer: str, citations: List[Dict[str, Any]]) -> None:
+        self.id = entry_id
+        self.key = key
+        self.vec = vec
+        self.answer = answer
+        self.citations = citations
+        self.post_ids = {str(c.get("post_id") or "") for c in citations if c.get("post_id")}
+        self.created = time.time()
+        self.hits = 0
+
+
+def citation_key(citations: Sequence[Dict[str, Any]], variant: str = "") -> Tuple:
+    """引用集合的 key：(variant, ((post_id, chunk), ...))；variant 区分模型 / 系统提示词；合并块按其包含的全部 chunk 计"""
+    return (variant, tuple(sorted(
+        (str(c.get("post_id") or ""), int(ch or 0))
+        for c in citations
+        for ch in (c.get("chunks") or [c.get("chunk")])
+    )))
+
+
+class AnswerCache:
+    def __init__(self, max_items: int = 256, ttl_seconds: int = 86400, threshold: float = 0.95) -> None:
+        self.max_items = max(0, int(max_items))
+        self.ttl_seconds = max(0, int(ttl_seconds))
+        self.threshold = float(threshold)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._by_key: Dict[Tuple, List[int]] = {}
+        self._by_post: Dict[str, set] = {}
+        self._next_id = 0
+        self._epoch = 0  # 每次失效 +1：生成期间文章被改动时，这一轮的回答不再写入
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidated = 0
+
+    @staticmethod
+    def _unit(vec: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def _drop_locked(self, entry_id: int) -> None:
+        e = self._entries.pop(entry_id, None)
+        if e is None:
+            return
+        ids = self._by_key.get(e.key)
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._by_key[e.key]
+        for pid in e.post_ids:
+            s = self._by_post.get(pid)
+            if s is not None:
+                s.discard(entry_id)
+                if not s:
+                    del self._by_post[pid]
+
+    def _expired(self, e: _Entry, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - e.created > self.ttl_seconds
+
+    def get(self, question_vec: Optional[Sequence[float]], key: Tuple) -> Optional[Dict[str, Any]]:
+        """返回 {"answer", "citations"}；未命中返回 None"""
+        if not self.max_items or question_vec is None:
+            return None
+        q = self._unit(question_vec)
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            best, best_sim = None, self.threshold
+            for entry_id in list(self._by_key.get(key, ())):
+                e = self._entries[entry_id]
+                if self._expired(e, now):
+                    self._drop_locked(entry_id)
+                    continue
+                sim = float(e.vec @ q)
+                if sim >= best_sim:
+                    best, best_sim = e, sim
+            if best is None:
+                return None
+            self.hits += 1
+            best.hits += 1
+            self._entries.move_to_end(best.id)
+            return {"answer": best.answer, "citations": best.citations, "similarity": round(best_sim, 4)}
+
+    def epoch(self) -> int:
+        return self._epoch
+
+    def put(
+        self,
+        question_vec: Optional[Sequence[float]],
+        key: Tuple,
+        answer: str,
+        citations: List[Dict[str, Any]],
+        epoch: Optional[int] = None,
+    ) -> None:
+        """epoch：调用大模型前取的 epoch()；期间发生过失效则放弃写入"""
+        if not self.max_items or question_vec is None or not answer:
+            return
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            self._next_id += 1
+            e = _Entry(self._next_id, key, self._unit(question_vec), answer, list(citations))
+            self._entries[e.id] = e
+            self._by_key.setdefault(key, []).append(e.id)
+            for pid in e.post_ids:
+                self._by_post.setdefault(pid, set()).add(e.id)
+            self.stores += 1
+            while len(self._entries) > self.max_items:
+                self._drop_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_posts(self, post_ids: Iterable[str]) -> int:
+        """文章被改动：删除所有引用过这些文章的条目，返回删除条数"""
+        post_ids = {str(pid) for pid in post_ids}
+        if not post_ids:
+            return 0
+        n = 0
+        with self._lock:
+            self._epoch += 1
+            for pid in post_ids:
+                for entry_id in list(self._by_post.get(pid, ())):
+                    self._drop_locked(entry_id)
+                    n += 1
+            self.invalidated += n
+        return n
+
+    def clear(self) -> int:
+        with self._lock:
+            self._epoch += 1
+            n = len(self._entries)
+            self._entries.clear()
+            self._by_key.clear()
+            self._by_post.clear()
+            self.invalidated += n
+            return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_ratio": round(self.hits / self.lookups, 4) if self.lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidated": self.invalidated,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,130 @@
+"""
+问题向量微批：把一个小时间窗内并发到达的问题合并成一次 embedding 请求。
+
+智谱 embedding 接口一次最多接受 64 条输入，但 retrieve() 每个问题单独发一次 HTTP 请求；
+并发高时大量往返都花在连接与排队上。这里：
+- 第一个到达的请求成为 leader，等待 RAG_EMBED_BATCH_WINDOW_MS 毫秒（或凑满 RAG_EMBED_BATCH_MAX 条）
+- leader 用一次请求拿回整批向量（相同文本只算一次），再分发给各个等待中的请求
+- leader 取走一批后立即交出 leader 身份，后到的请求开启下一批，批与批之间可以并行
+- 统计批大小直方图与节省的往返次数
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _bucket(n: int) -> str:
+    lo = 1
+    for hi in _BUCKETS:
+        if n <= hi:
+            return str(hi) if lo == hi else f"{lo}-{hi}"
+        lo = hi + 1
+    return f">{_BUCKETS[-1]}"
+
+
+class _Item:
+    __slots__ = ("text", "taken", "result", "error")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.taken = False
+        self.result: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+
+class QueryBatcher:
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+        window_ms: float = 5.0,
+        max_batch: int = 64,
+    ) -> None:
+        self.embed_fn = embed_fn
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._cond = threading.Condition()
+        self._pending: List[_Item] = []
+        self._leader_active = False
+        self.batches = 0
+        self.queries = 0
+        self.histogram: Dict[str, int] = {}
+        self.wait_ms_total = 0.0
+
+    def _collect_locked(self) -> List[_Item]:
+        deadline = time.monotonic() + self.window
+        while len(self._pending) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = self._pending[: self.max_batch]
+        del self._pending[: self.max_batch]
+        for item in batch:
+            item.taken = True
+        return batch
+
+    def _run(self, batch: List[_Item]) -> None:
+        uniq = list(dict.fromkeys(item.text for item in batch))
+        try:
+            vecs = self.embed_fn(uniq)
+            if len(vecs) != len(uniq):
+                raise RuntimeError(f"embedding 返回条数异常：期望 {len(uniq)}，实际 {len(vecs)}")
+            by_text = {t: [float(x) for x in v] for t, v in zip(uniq, vecs)}
+            error = None
+        except BaseException as e:  # noqa: B902 - 异常要转交给同一批里的每个请求
+            by_text, error = {}, e
+        with self._cond:
+            for item in batch:
+                if error is None:
+                    item.result = by_text[item.text]
+                else:
+                    item.error = error
+            self.batches += 1
+            self.queries += len(batch)
+            key = _bucket(len(batch))
+            self.histogram[key] = self.histogram.get(key, 0) + 1
+            self._cond.notify_all()
+
+    def embed(self, text: str) -> List[float]:
+        if self.window <= 0:
+            return [float(x) for x in self.embed_fn([text])[0]]
+        item = _Item(text)
+        started = time.monotonic()
+        with self._cond:
+            self._pending.append(item)
+            self._cond.notify_all()  # 唤醒等待凑批的 leader（可能已凑满）
+            while item.result is None and item.error is None:
+                if not item.taken and not self._leader_active:
+                    self._leader_active = True
+                    try:
+                        batch = self._collect_locked()
+                    finally:
+                        # 取走一批就交出 leader：后到的请求可以立刻开始下一批
+                        self._leader_active = False
+                        self._cond.notify_all()
+                    self._cond.release()
+                    try:
+                        self._run(batch)
+                    finally:
+                        self._cond.acquire()
+                    continue
+                self._cond.wait(1.0)
+            self.wait_ms_total += (time.monotonic() - started) * 1000
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "window_ms": round(self.window * 1000, 2),
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "queries": self.queries,
+                "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else None,
+                "round_trips_saved": self.queries - self.batches,
+                "avg_wait_ms": round(self.wait_ms_total / self.queries, 2) if self.queries else None,
+                "batch_size_histogram": {k: self.histogram[k] for k in sorted(self.histogram, key=lambda b: int(b.split("-")[0].lstrip(">")))},
+            }
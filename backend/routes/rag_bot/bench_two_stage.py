@@ -0,0 +1,195 @@
+"""
+两阶段（Matryoshka）检索的召回率 / 延迟对照表，用于挑选 RAG_STAGE1_DIM / RAG_STAGE1_QUANT / RAG_STAGE1_K。
+
+对当前生效的 collection：
+- 查询向量优先取查询向量缓存（query_cache.sqlite3，真实用户问题），不够时用随机抽取的 chunk 向量补足
+- 基准：全维度精确 cosine top-k
+- 每组 (维度, 量化, 粗排候选数) 统计 recall@k、单次检索 p50/p95（粗排 + 精排）与粗排索引大小
+- 常驻内存：在独立子进程里按线上路径（单阶段 col.query / 两阶段 粗排 + 按 id 取向量精排）检索一遍后量 RSS；
+  父进程为了算 recall 基准持有整份全精度矩阵，它的内存不代表线上
+
+用法（在 backend 目录下）：
+    python -m routes.rag_bot.bench_two_stage --queries 200 --dims 128,256,512 --stage1 20,50,100,200
+"""
+import argparse
+import json
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .bench_vector import _rss_mb
+from .coarse import CoarseIndex, rescore
+from .rag_store import embed_namespace
+from .runtime import get_runtime
+from .vector_store import iter_embeddings
+
+_BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+def _cached_queries(db_path, namespace: str, limit: int) -> List[np.ndarray]:
+    if not db_path.exists():
+        return []
+    db = sqlite3.connect(str(db_path))
+    try:
+        rows = db.execute(
+            "SELECT vec FROM query_embeddings WHERE key LIKE ? ORDER BY last_used DESC LIMIT ?",
+            (f"{namespace}|%", limit),
+        ).fetchall()
+    except sqlite3.Error:
+        rows = []
+    finally:
+        db.close()
+    return [np.frombuffer(blob, dtype=np.float32) for (blob,) in rows]
+
+
+def _percentile(sorted_vals: List[float], p: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, max(0, int(round(len(sorted_vals) * p)) - 1))]
+
+
+def _child(args: argparse.Namespace) -> None:
+    """在干净的子进程里按线上路径检索一遍，量常驻内存，结果以 JSON 打到 stdout"""
+    qs = np.load(args.queries_file)
+    rt = get_runtime()
+    rss_before = _rss_mb()
+    col = rt.collection()
+    if args.probe == "exact":
+        for q in qs:
+            col.query(query_embeddings=[q.tolist()], n_results=args.k)
+    else:
+        dim, quant = args.probe.split(":")
+        index = CoarseIndex(dim=int(dim), quant=quant)
+        index.build_batches(iter_embeddings(col))
+        for q in qs:
+            cands = [cid for cid, _ in index.search(q, max(args.k, args.stage1_max))]
+            got = col.get(ids=cands, include=["embeddings"])
+            rescore(q, list(got.get("ids") or []), got.get("embeddings"))
+    print(json.dumps({"rss_mb_before": rss_before, "rss_mb": _rss_mb()}))
+
+
+def _probe(probe: str, qfile: Path, k: int, stage1_max: int) -> Optional[float]:
+    proc = subprocess.run(
+        [sys.executable, "-m", "routes.rag_bot.bench_two_stage", "--child", "--probe", probe,
+         "--queries-file", str(qfile), "--k", str(k), "--stage1-max", str(stage1_max)],
+        cwd=str(_BACKEND_DIR), capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(f"[bench] RSS 子进程失败 ({probe}): {proc.stderr.strip()[-500:]}")
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])["rss_mb"]
+
+
+def _two_stage_rows(args, ids, full, queries, exact, k, stage1_list, qfile) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    pos = {cid: i for i, cid in enumerate(ids)}
+    for dim in [int(x) for x in args.dims.split(",") if x.strip()]:
+        for quant in [x.strip() for x in args.quant.split(",") if x.strip()]:
+            index = CoarseIndex(dim=dim, quant=quant)
+            index.build(ids, full)
+            rss = _probe(f"{dim}:{quant}", qfile, k, max(stage1_list))
+            for s1 in stage1_list:
+                lat, recall = [], []
+                for q, ref in zip(queries, exact):
+                    t0 = time.perf_counter()
+                    cands = [cid for cid, _ in index.search(q, max(k, s1))]
+                    # 精排向量取自内存矩阵：只衡量算法本身，线上还要加一次向量库按 id 读取
+                    ranked = rescore(q, cands, full[[pos[c] for c in cands]])[:k]
+                    lat.append((time.perf_counter() - t0) * 1000)
+                    recall.append(len({cid for cid, _ in ranked} & ref) / max(1, len(ref)))
+                lat.sort()
+                st = index.stats()
+                rows.append({
+                    "dim": dim,
+                    "quant": quant,
+                    "stage1_k": s1,
+                    "recall_at_k": round(statistics.fmean(recall), 4),
+                    "p50_ms": round(_percentile(lat, 0.5), 3),
+                    "p95_ms": round(_percentile(lat, 0.95), 3),
+                    "index_kb": round(st["index_bytes"] / 1024, 1),
+                    "rss_mb": rss,
+                })
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="两阶段检索 recall / 延迟 / 内存对照")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=0, help="召回条数（默认 RAG_CANDIDATE_K）")
+    ap.add_argument("--dims", default="128,256,512")
+    ap.add_argument("--quant", default="none,int8")
+    ap.add_argument("--stage1", default="20,50,100,200", help="粗排候选数")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--probe", help=argparse.SUPPRESS)
+    ap.add_argument("--queries-file", help=argparse.SUPPRESS)
+    ap.add_argument("--stage1-max", type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        _child(args)
+        return
+
+    rt = get_runtime()
+    cfg = rt.config()
+    k = args.k or cfg.retrieve_candidate_k
+    ids: List[str] = []
+    parts: List[np.ndarray] = []
+    for part_ids, vecs in iter_embeddings(rt.collection()):
+        ids += part_ids
+        parts.append(vecs)
+    if not ids:
+        raise SystemExit("当前 collection 为空，请先 reindex")
+    full = np.concatenate(parts)
+    full /= np.maximum(np.linalg.norm(full, axis=1, keepdims=True), 1e-12)
+
+    queries = _cached_queries(cfg.persist_dir.parent / "query_cache.sqlite3", embed_namespace(cfg), args.queries)
+    source = {"cached": len(queries), "sampled_chunks": 0}
+    if len(queries) < args.queries:
+        rng = np.random.default_rng(7)
+        picks = rng.choice(len(ids), size=min(len(ids), args.queries - len(queries)), replace=False)
+        queries += [full[i] for i in picks]
+        source["sampled_chunks"] = len(picks)
+    queries = [q for q in queries if q.shape[0] == full.shape[1]]
+
+    # 基准：全维度精确检索
+    exact, base_lat = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        scores = full @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        top = np.argpartition(-scores, min(k, len(ids)) - 1)[:k]
+        base_lat.append((time.perf_counter() - t0) * 1000)
+        exact.append({ids[i] for i in top})
+    base_lat.sort()
+
+    stage1_list = [int(x) for x in args.stage1.split(",") if x.strip()]
+    tmp = Path(tempfile.mkdtemp(prefix="rag-bench-"))
+    try:
+        qfile = tmp / "queries.npy"
+        np.save(qfile, np.asarray(queries, dtype=np.float32))
+        exact_rss = _probe("exact", qfile, k, 0)
+        rows = _two_stage_rows(args, ids, full, queries, exact, k, stage1_list, qfile)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(
+        f"collection={rt.collection().name} chunks={len(ids)} full_dim={full.shape[1]} k={k} "
+        f"queries={len(queries)} (cached={source['cached']}, sampled={source['sampled_chunks']})"
+    )
+    print(
+        f"exact full-dim: p50={_percentile(base_lat, 0.5):.3f}ms p95={_percentile(base_lat, 0.95):.3f}ms "
+        f"vectors={full.nbytes / 1024:.1f}KB rss={exact_rss}MB"
+    )
+    cols = ["dim", "quant", "stage1_k", "recall_at_k", "p50_ms", "p95_ms", "index_kb", "rss_mb"]
+    print("".join(f"{c:>12}" for c in cols))
+    for r in rows:
+        print("".join(f"{str(r[c]):>12}" for c in cols))
+    print(json.dumps({"k": k, "chunks": len(ids), "queries": source, "exact_rss_mb": exact_rss, "rows": rows}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
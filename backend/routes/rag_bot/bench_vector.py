@@ -0,0 +1,191 @@
+"""
+向量后端基准：Chroma vs NumPy 平铺矩阵（vector_store.FlatVectorCollection）。
+
+用随机单位向量构造同样规模的两个库，然后在独立子进程里分别测：
+- 启动：import 耗时 + 打开 collection 并完成首个查询的耗时
+- 查询延迟：p50 / p95 / 平均（top-k，cosine）
+- 常驻内存：查询结束后的 RSS
+- Chroma 的 recall@k（HNSW 近似检索相对精确结果）
+
+用法（在 backend 目录下）：
+    python -m routes.rag_bot.bench_vector --n 5000 --dim 1024 --queries 200
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+_VECTOR_STORE_PY = Path(__file__).with_name("vector_store.py")
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import psutil  # Windows 上需要额外安装
+
+        return round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    except Exception:
+        return None
+
+
+def _load_vector_store():
+    # 直接按文件加载，避免 import routes.rag_bot 时顺带导入 Flask / openai 影响启动耗时
+    spec = importlib.util.spec_from_file_location("_bench_vector_store", _VECTOR_STORE_PY)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def _dataset(n: int, dim: int, queries: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    docs = rng.standard_normal((n, dim)).astype(np.float32)
+    docs /= np.linalg.norm(docs, axis=1, keepdims=True)
+    # 查询取文档向量加噪声，更接近真实"问题与某段正文相近"的分布
+    picks = rng.integers(0, n, size=queries)
+    qs = docs[picks] + 0.5 * rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim) * 4
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+    return docs, qs
+
+
+def _build(backend: str, root: Path, docs: np.ndarray, dtype: str, batch: int = 1000) -> float:
+    t0 = time.perf_counter()
+    ids = [f"c{i}" for i in range(docs.shape[0])]
+    metas = [{"post_id": f"p{i // 5}", "chunk": i % 5} for i in range(docs.shape[0])]
+    texts = [f"chunk {i}" for i in range(docs.shape[0])]
+    if backend == "numpy":
+        col = _load_vector_store().FlatVectorClient(root, dtype=dtype).get_or_create_collection("bench")
+    else:
+        import chromadb
+
+        col = chromadb.PersistentClient(path=str(root)).get_or_create_collection(
+            "bench", embedding_function=None, metadata={"hnsw:space": "cosine"}
+        )
+    for i in range(0, len(ids), batch):
+        col.upsert(ids=ids[i : i + batch], embeddings=docs[i : i + batch].tolist(), documents=texts[i : i + batch], metadatas=metas[i : i + batch])
+    return time.perf_counter() - t0
+
+
+def _child(args: argparse.Namespace) -> None:
+    """在干净的子进程里测启动 / 查询 / 内存，结果以 JSON 打到 stdout"""
+    qs = np.load(args.queries_file)
+    rss_before = _rss_mb()
+    t0 = time.perf_counter()
+    if args.backend == "numpy":
+        mod = _load_vector_store()
+        t_import = time.perf_counter() - t0
+        col = mod.FlatVectorClient(Path(args.root), dtype=args.dtype).get_or_create_collection("bench")
+    else:
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+        import chromadb
+
+        t_import = time.perf_counter() - t0
+        col = chromadb.PersistentClient(path=args.root).get_collection("bench", embedding_function=None)
+    col.query(query_embeddings=[qs[0].tolist()], n_results=args.k)
+    t_ready = time.perf_counter() - t0
+
+    lat = []
+    results = []
+    for q in qs:
+        t1 = time.perf_counter()
+        res = col.query(query_embeddings=[q.tolist()], n_results=args.k)
+        lat.append((time.perf_counter() - t1) * 1000)
+        results.append(res["ids"][0])
+    lat.sort()
+    print(json.dumps({
+        "import_ms": round(t_import * 1000, 1),
+        "ready_ms": round(t_ready * 1000, 1),
+        "query_p50_ms": round(statistics.median(lat), 3),
+        "query_p95_ms": round(lat[int(len(lat) * 0.95) - 1], 3),
+        "query_mean_ms": round(statistics.fmean(lat), 3),
+        "rss_mb_before": rss_before,
+        "rss_mb": _rss_mb(),
+        "results": results,
+    }))
+
+
+def _dir_mb(root: Path) -> float:
+    return round(sum(p.stat().st_size for p in root.rglob("*") if p.is_file()) / 1024 / 1024, 2)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Chroma vs NumPy 向量后端基准")
+    ap.add_argument("--n", type=int, default=5000, help="chunk 数")
+    ap.add_argument("--dim", type=int, default=1024, help="向量维度")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="numpy 后端精度")
+    ap.add_argument("--backends", default="numpy,chroma")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--backend", help=argparse.SUPPRESS)
+    ap.add_argument("--root", help=argparse.SUPPRESS)
+    ap.add_argument("--queries-file", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        _child(args)
+        return
+
+    tmp = Path(tempfile.mkdtemp(prefix="rag-bench-"))
+    try:
+        docs, qs = _dataset(args.n, args.dim, args.queries)
+        qfile = tmp / "queries.npy"
+        np.save(qfile, qs)
+        # 精确 top-k 作为 recall 基准
+        exact = [[f"c{i}" for i in np.argsort(-(docs @ q))[: args.k]] for q in qs]
+
+        report: Dict[str, Any] = {"n": args.n, "dim": args.dim, "queries": args.queries, "k": args.k, "backends": {}}
+        for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            root = tmp / backend
+            try:
+                build_s = _build(backend, root, docs, args.dtype)
+            except ImportError as e:
+                report["backends"][backend] = {"error": f"未安装：{e}"}
+                continue
+            proc = subprocess.run(
+                # 按文件路径运行：子进程不导入 routes 包，只加载被测后端本身
+                [sys.executable, str(Path(__file__).resolve()), "--child", "--backend", backend,
+                 "--root", str(root), "--queries-file", str(qfile), "--k", str(args.k), "--dtype", args.dtype],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                report["backends"][backend] = {"error": proc.stderr.strip()[-500:]}
+                continue
+            out = json.loads(proc.stdout.strip().splitlines()[-1])
+            results = out.pop("results")
+            out["recall_at_k"] = round(
+                statistics.fmean(len(set(r) & set(e)) / len(e) for r, e in zip(results, exact)), 4
+            )
+            out["build_s"] = round(build_s, 2)
+            out["disk_mb"] = _dir_mb(root)
+            report["backends"][backend] = out
+
+        cols = ["import_ms", "ready_ms", "query_p50_ms", "query_p95_ms", "rss_mb", "disk_mb", "build_s", "recall_at_k"]
+        print(f"n={args.n} dim={args.dim} queries={args.queries} k={args.k} numpy dtype={args.dtype}")
+        print(f"{'backend':<8}" + "".join(f"{c:>14}" for c in cols))
+        for name, row in report["backends"].items():
+            if "error" in row:
+                print(f"{name:<8}  {row['error']}")
+            else:
+                print(f"{name:<8}" + "".join(f"{str(row.get(c)):>14}" for c in cols))
+        print(json.dumps(report, ensure_ascii=False))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+引用详情 LRU。
+
+看板娘界面上点开引用时会同时请求多条详情；chunk id 是确定的（f"{post_id}:::{i}"），
+没必要每次都用 where 过滤扫 metadata。这里按 (collection, post_id, chunk) 缓存详情：
+- 全量重建切换 collection 后旧 key 自然不再命中（并由 reindex 清空）
+- upsert_post / 差量 reindex 改动某篇文章时，按 post_id 失效
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Tuple
+
+CitationKey = Tuple[str, str, int]  # (collection, post_id, chunk)
+
+
+class CitationCache:
+    def __init__(self, max_items: int = 2048) -> None:
+        self.max_items = max(0, int(max_items))
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[CitationKey, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get_many(self, keys: Iterable[CitationKey]) -> Dict[CitationKey, Dict[str, Any]]:
+        found: Dict[CitationKey, Dict[str, Any]] = {}
+        with self._lock:
+            for key in keys:
+                item = self._items.get(key)
+                if item is None:
+                    self.misses += 1
+                    continue
+                self._items.move_to_end(key)
+                self.hits += 1
+                found[key] = item
+        return found
+
+    def put_many(self, items: Dict[CitationKey, Dict[str, Any]]) -> None:
+        if not self.max_items:
+            return
+        with self._lock:
+            for key, item in items.items():
+                self._items[key] = item
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def invalidate_posts(self, post_ids: Iterable[str]) -> int:
+        post_ids = {str(pid) for pid in post_ids}
+        if not post_ids:
+            return 0
+        with self._lock:
+            drop = [k for k in self._items if k[1] in post_ids]
+            for k in drop:
+                del self._items[k]
+            self.invalidated += len(drop)
+            return len(drop)
+
+    def clear(self) -> int:
+        with self._lock:
+            n = len(self._items)
+            self._items.clear()
+            self.invalidated += n
+            return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._items),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "invalidated": self.invalidated,
+            }
@@ -0,0 +1,159 @@
+"""
+两阶段（Matryoshka）检索的第一阶段：紧凑的截断向量索引。
+
+embedding-3 / text-embedding-3 这类 Matryoshka 模型的向量前 N 维本身就是一个可用的低维表示。
+这里把库里每个 chunk 的向量截到前 RAG_STAGE1_DIM 维（默认 256）并重新单位化，可选再做 int8 量化，
+常驻内存做一次暴力扫描取出 RAG_STAGE1_K 个候选；第二阶段再用库里存的全精度向量对候选重新打分。
+1024 维截到 256 维，每次检索的扫描量约降为 1/4（int8 再降为 1/4）。
+
+内存是否随之下降取决于向量后端：
+- numpy 后端：全精度向量以 mmap 留在磁盘上，构建时按批读取（临时映射，读完解除），精排只读候选行；
+  常驻的向量数据只有这份粗排矩阵（外加尚未合并的增量段），约为全精度矩阵的 1/4（int8 为 1/16）
+- Chroma 后端：HNSW 索引仍由 Chroma 常驻，粗排矩阵是额外的一份，只省扫描成本、不省内存
+实际常驻内存用 bench_two_stage 在子进程里量 RSS。
+"""
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _truncate(vecs: np.ndarray, dim: int) -> np.ndarray:
+    out = np.ascontiguousarray(vecs[:, :dim], dtype=np.float32)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return out / norms
+
+
+class CoarseIndex:
+    def __init__(self, dim: int = 256, quant: str = "none") -> None:
+        self.dim = max(1, int(dim))
+        self.quant = "int8" if quant == "int8" else "none"
+        self._lock = threading.Lock()
+        # 整体替换的快照：(ids, id -> 行号, 矩阵, int8 的逐行缩放系数)
+        self._snap: Tuple[List[str], Dict[str, int], Optional[np.ndarray], Optional[np.ndarray]] = ([], {}, None, None)
+        self.full_dim: Optional[int] = None
+        self.build_seconds = 0.0
+        self.built_at: Optional[float] = None
+
+    def _encode(self, vecs: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        t = _truncate(vecs, self.dim)
+        if self.quant != "int8":
+            return t, None
+        scale = np.abs(t).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        return np.round(t / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+    def _publish(self, ids: List[str], mat: Optional[np.ndarray], scale: Optional[np.ndarray]) -> None:
+        self._snap = (ids, {cid: i for i, cid in enumerate(ids)}, mat, scale)
+
+    def build(self, ids: Sequence[str], embeddings: Iterable[Sequence[float]]) -> None:
+        ids = list(ids)
+        if not isinstance(embeddings, np.ndarray):
+            embeddings = list(embeddings)
+        self.build_batches([(ids, embeddings)] if ids else [])
+
+    def build_batches(self, batches: Iterable[Tuple[Sequence[str], Any]]) -> None:
+        """逐批截断 / 量化后拼接：构建期间全精度向量只在内存里停留一批"""
+        started = time.perf_counter()
+        with self._lock:
+            ids: List[str] = []
+            mats: List[np.ndarray] = []
+            scales: List[np.ndarray] = []
+            for part_ids, embeddings in batches:
+                part_ids = list(part_ids)
+                if not part_ids:
+                    continue
+                full = np.asarray(embeddings, dtype=np.float32).reshape(len(part_ids), -1)
+                self.full_dim = int(full.shape[1])
+                mat, scale = self._encode(full)
+                ids += part_ids
+                mats.append(mat)
+                if scale is not None:
+                    scales.append(scale)
+            if ids:
+                self._publish(ids, np.concatenate(mats), np.concatenate(scales) if scales else None)
+            else:
+                self._publish([], None, None)
+            self.build_seconds = time.perf_counter() - started
+            self.built_at = time.time()
+
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        ids = list(ids)
+        if not ids:
+            return
+        full = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        new_mat, new_scale = self._encode(full)
+        with self._lock:
+            old_ids, pos, mat, scale = self._snap
+            self.full_dim = self.full_dim or int(full.shape[1])
+            replaced = set(ids)
+            keep = [i for i, cid in enumerate(old_ids) if cid not in replaced]
+            out_ids = [old_ids[i] for i in keep] + ids
+            out_mat = new_mat if mat is None else np.concatenate([mat[keep], new_mat])
+            out_scale = None if new_scale is None else (new_scale if scale is None else np.concatenate([scale[keep], new_scale]))
+            self._publish(out_ids, out_mat, out_scale)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        drop = set(ids)
+        if not drop:
+            return
+        with self._lock:
+            old_ids, _, mat, scale = self._snap
+            keep = [i for i, cid in enumerate(old_ids) if cid not in drop]
+            if len(keep) == len(old_ids):
+                return
+            self._publish(
+                [old_ids[i] for i in keep],
+                mat[keep] if keep else None,
+                scale[keep] if (scale is not None and keep) else None,
+            )
+
+    def search(self, query_vec: Sequence[float], k: int) -> List[Tuple[str, float]]:
+        """返回 [(id, 近似 cosine)]，按分数降序"""
+        ids, _, mat, scale = self._snap
+        if mat is None or not ids:
+            return []
+        q = _truncate(np.asarray(query_vec, dtype=np.float32).reshape(1, -1), self.dim)[0]
+        if scale is None:
+            scores = mat @ q
+        else:
+            # int8 @ float32 会先把整个矩阵转成 float32：分块转换，临时内存不随库大小增长
+            scores = np.empty(mat.shape[0], dtype=np.float32)
+            step = 8192
+            for start in range(0, mat.shape[0], step):
+                scores[start : start + step] = mat[start : start + step].astype(np.float32) @ q
+            scores *= scale
+        n = min(max(1, int(k)), scores.shape[0])
+        part = np.argpartition(-scores, n - 1)[:n] if n < scores.shape[0] else np.arange(scores.shape[0])
+        order = part[np.argsort(-scores[part])]
+        return [(ids[int(i)], float(scores[i])) for i in order]
+
+    def stats(self) -> Dict[str, Any]:
+        ids, _, mat, scale = self._snap
+        index_bytes = (mat.nbytes if mat is not None else 0) + (scale.nbytes if scale is not None else 0)
+        return {
+            "docs": len(ids),
+            "dim": self.dim,
+            "full_dim": self.full_dim,
+            "quant": self.quant,
+            "index_bytes": index_bytes,
+            "build_ms": round(self.build_seconds * 1000, 1),
+            "built_at": self.built_at,
+        }
+
+
+def rescore(
+    query_vec: Sequence[float], ids: Sequence[str], embeddings: Sequence[Sequence[float]]
+) -> List[Tuple[str, float]]:
+    """第二阶段：用全精度向量对候选重新打分，返回 [(id, cosine distance)] 升序"""
+    if not len(ids):
+        return []
+    full = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+    full = full / np.maximum(np.linalg.norm(full, axis=1, keepdims=True), 1e-12)
+    q = np.asarray(query_vec, dtype=np.float32)
+    q = q / max(float(np.linalg.norm(q)), 1e-12)
+    dist = 1.0 - full @ q
+    order = np.argsort(dist)
+    return [(ids[int(i)], float(dist[i])) for i in order]
@@ -0,0 +1,189 @@
+"""
+上下文打包：把检索结果整理成给大模型的编号引用资料，按估算 token 数控制预算。
+
+以前按字符数拼接，每个 chunk 单独成块：
+- 同一篇文章相邻的 chunk（例如 3 和 4）各发一次，_chunk_text 的重叠部分重复发送
+- 每个 chunk 都带着入库时注入的「标题/标签/分类」头
+这里：
+- 同一 post_id、chunk 编号连续的命中合并成一个引用块，去掉相邻 chunk 的重叠部分
+- 去掉正文前重复的标题/标签/分类头，每个引用块只写一次
+- 预算按估算 token 计（RAG_MAX_CONTEXT_TOKENS / RAG_MAX_CHUNK_TOKENS）
+- 统计按旧方式拼接需要的 token 与实际 token，报告节省量
+"""
+import threading
+from typing import Any, Dict, List, Tuple
+
+# DeepSeek 官方给出的估算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+_CJK_TOKENS = 0.6
+_OTHER_TOKENS = 0.3
+# 相邻 chunk 的重叠至少这么长才认定为重复（太短容易误删正常文字）
+_MIN_OVERLAP = 8
+
+
+def _is_wide(ch: str) -> bool:
+    return ch >= "⺀"
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    wide = sum(1 for ch in text if _is_wide(ch))
+    return int(wide * _CJK_TOKENS + (len(text) - wide) * _OTHER_TOKENS + 0.999)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """按估算 token 截断，超出时以「…」结尾"""
+    if not max_tokens or estimate_tokens(text) <= max_tokens:
+        return text
+    budget = float(max_tokens)
+    for i, ch in enumerate(text):
+        budget -= _CJK_TOKENS if _is_wide(ch) else _OTHER_TOKENS
+        if budget < 0:
+            return text[:i].rstrip() + "…"
+    return text
+
+
+def _chunk_header(hit: Dict[str, Any]) -> str:
+    """与 rag_store._build_post_chunks 注入的头保持一致"""
+    lines = [f"标题：{hit.get('title') or ''}"]
+    if hit.get("tags"):
+        lines.append(f"标签：{hit['tags']}")
+    if hit.get("categories"):
+        lines.append(f"分类：{hit['categories']}")
+    return "\n".join(lines) + "\n\n"
+
+
+def strip_header(hit: Dict[str, Any]) -> str:
+    content = (hit.get("content") or "").strip()
+    header = _chunk_header(hit)
+    if content.startswith(header):
+        content = content[len(header):]
+    return content.strip()
+
+
+def strip_overlap(prev: str, cur: str, max_overlap: int) -> str:
+    """cur 开头与 prev 结尾重复的部分（_chunk_text 的 overlap）去掉"""
+    limit = min(len(prev), len(cur), max(max_overlap, _MIN_OVERLAP) * 2)
+    for k in range(limit, _MIN_OVERLAP - 1, -1):
+        if prev.endswith(cur[:k]):
+            return cur[k:].lstrip()
+    return cur
+
+
+def _legacy_block(n: int, hit: Dict[str, Any], max_chunk_tokens: int) -> str:
+    """旧的拼接方式（每个 chunk 一块、带完整文档头），只用于统计节省量"""
+    content = truncate_tokens((hit.get("content") or "").strip(), max_chunk_tokens)
+    return f"[{n}] {hit.get('title') or ''}\nURL: {(hit.get('url') or '').strip()}\n内容：{content}"
+
+
+def _group_hits(hits: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """同一文章、chunk 编号连续的命中合并；组的顺序取组内最靠前的命中"""
+    groups: List[List[Dict[str, Any]]] = []
+    by_post: Dict[str, List[List[Dict[str, Any]]]] = {}
+    for h in hits:
+        pid = str(h.get("post_id") or "")
+        chunk = h.get("chunk")
+        placed = False
+        if pid and isinstance(chunk, int):
+            for g in by_post.get(pid, []):
+                idx = [x["chunk"] for x in g]
+                if chunk == min(idx) - 1 or chunk == max(idx) + 1:
+                    g.append(h)
+                    g.sort(key=lambda x: x["chunk"])
+                    placed = True
+                    break
+        if not placed:
+            g = [h]
+            groups.append(g)
+            if pid and isinstance(chunk, int):
+                by_post.setdefault(pid, []).append(g)
+    return groups
+
+
+def pack_context(
+    hits: List[Dict[str, Any]],
+    max_tokens: int,
+    max_chunk_tokens: int,
+    overlap: int = 120,
+) -> Tuple[List[Dict[str, Any]], List[str], Dict[str, Any]]:
+    """返回 (引用列表, 编号上下文块列表, 统计)"""
+    citations: List[Dict[str, Any]] = []
+    blocks: List[str] = []
+    used = 0
+    for group in _group_hits(hits):
+        parts: List[str] = []
+        prev = ""
+        for h in group:
+            body = strip_header(h)
+            if prev:
+                body = strip_overlap(prev, body, overlap)
+            prev = strip_header(h)
+            if body:
+                parts.append(truncate_tokens(body, max_chunk_tokens))
+        first = group[0]
+        n = len(citations) + 1
+        header_lines = [f"[{n}] {first.get('title') or ''}", f"URL: {(first.get('url') or '').strip()}"]
+        if first.get("tags"):
+            header_lines.append(f"标签：{first['tags']}")
+        if first.get("categories"):
+            header_lines.append(f"分类：{first['categories']}")
+        block = "\n".join(header_lines) + "\n内容：" + "\n".join(parts)
+        cost = estimate_tokens(block)
+        if max_tokens and used + cost > max_tokens:
+            break
+        used += cost
+        dists = [h.get("distance") for h in group if h.get("distance") is not None]
+        citations.append({
+            "id": n,
+            "title": first.get("title") or "",
+            "url": (first.get("url") or "").strip(),
+            "post_id": (first.get("post_id") or "").strip(),
+            "chunk": first.get("chunk"),
+            "chunks": [h.get("chunk") for h in group],
+            "distance": min(dists) if dists else None,
+        })
+        blocks.append(block)
+
+    # 旧方式发送同样这些 chunk 需要的 token
+    sent = [h for group in _group_hits(hits)[: len(citations)] for h in group]
+    legacy = sum(estimate_tokens(_legacy_block(i + 1, h, max_chunk_tokens)) for i, h in enumerate(sent))
+    report = {
+        "hits": len(hits),
+        "chunks_sent": len(sent),
+        "blocks": len(blocks),
+        "merged": len(sent) - len(blocks),
+        "tokens": used,
+        "tokens_legacy": legacy,
+        "tokens_saved": max(0, legacy - used),
+    }
+    return citations, blocks, report
+
+
+class PackStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.tokens_saved = 0
+        self.merged = 0
+
+    def record(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.tokens += report["tokens"]
+            self.tokens_saved += report["tokens_saved"]
+            self.merged += report["merged"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.tokens + self.tokens_saved
+            return {
+                "requests": self.requests,
+                "avg_context_tokens": round(self.tokens / self.requests, 1) if self.requests else None,
+                "tokens_saved": self.tokens_saved,
+                "saved_ratio": round(self.tokens_saved / total, 4) if total else None,
+                "merged_chunks": self.merged,
+            }
+
+
+pack_stats = PackStats()
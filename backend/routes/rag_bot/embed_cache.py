@@ -0,0 +1,163 @@
+"""
+查询向量缓存（两级）：进程内 LRU + backend/.rag/ 下的 SQLite。
+
+看板娘每天会收到大量重复的 FAQ 式问题，每个问题原本都要同步请求一次 embedding 接口。
+缓存 key = (provider:model:dimensions, 归一化问题文本的 sha256)：
+- 内存层：OrderedDict LRU，条数上限 + TTL
+- 磁盘层：SQLite（float32 BLOB），进程重启后仍可命中；超过行数上限时按最近使用时间淘汰
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def normalize_query(text: str) -> str:
+    """全角/半角、大小写、多余空白不影响命中"""
+    t = unicodedata.normalize("NFKC", text or "")
+    t = re.sub(r"\s+", " ", t).strip()
+    return t.lower()
+
+
+def _pack(vec: List[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        db_path: Optional[Path],
+        max_items: int = 512,
+        ttl_seconds: int = 7 * 24 * 3600,
+        disk_max_items: int = 20000,
+    ) -> None:
+        self.max_items = max(0, int(max_items))
+        self.ttl_seconds = max(0, int(ttl_seconds))
+        self.disk_max_items = max(0, int(disk_max_items))
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._puts_since_evict = 0
+        self.mem_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path is not None and self.disk_max_items > 0:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            # 多线程共享一个连接，所有访问都在 self._lock 内
+            self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                " key TEXT PRIMARY KEY, vec BLOB NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_query(text).encode("utf-8")).hexdigest()
+        return f"{namespace}|{digest}"
+
+    def _expired(self, created: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and (now - created) > self.ttl_seconds
+
+    def _mem_put_locked(self, key: str, created: float, vec: List[float]) -> None:
+        if not self.max_items:
+            return
+        self._mem[key] = (created, vec)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, namespace: str, text: str) -> Optional[List[float]]:
+        key = self.make_key(namespace, text)
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if not self._expired(hit[0], now):
+                    self._mem.move_to_end(key)
+                    self.mem_hits += 1
+                    return hit[1]
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vec, created FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._db.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        vec = _unpack(row[0])
+                        self._mem_put_locked(key, row[1], vec)
+                        self.disk_hits += 1
+                        return vec
+                    self._db.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, namespace: str, text: str, vec: List[float]) -> None:
+        key = self.make_key(namespace, text)
+        now = time.time()
+        with self._lock:
+            self._mem_put_locked(key, now, list(vec))
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings(key, vec, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, _pack(vec), now, now),
+            )
+            self._puts_since_evict += 1
+            # 每 64 次写入检查一次行数，避免每次都 COUNT(*)
+            if self._puts_since_evict >= 64:
+                self._puts_since_evict = 0
+                self._evict_disk_locked(now)
+            self._db.commit()
+
+    def _evict_disk_locked(self, now: float) -> None:
+        if self.ttl_seconds:
+            cur = self._db.execute("DELETE FROM query_embeddings WHERE created < ?", (now - self.ttl_seconds,))
+            self.evictions += max(0, cur.rowcount)
+        total = self._db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        over = total - self.disk_max_items
+        if over > 0:
+            self._db.execute(
+                "DELETE FROM query_embeddings WHERE key IN ("
+                " SELECT key FROM query_embeddings ORDER BY last_used ASC LIMIT ?)",
+                (over,),
+            )
+            self.evictions += over
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.mem_hits + self.disk_hits + self.misses
+            disk_items = None
+            if self._db is not None:
+                disk_items = self._db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            return {
+                "mem_items": len(self._mem),
+                "disk_items": disk_items,
+                "mem_hits": self.mem_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.mem_hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,115 @@
+"""
+文档向量持久化仓库（内容寻址）：text -> vector。
+
+collection 被重置（embedding function 冲突、全量重建、切分参数变化）时，Chroma 里的向量会全部丢弃；
+但绝大多数 chunk 文本其实没变。这里以 (provider:model:dimensions, sha256(文档文本)) 为 key，
+把向量以 float16 存进 backend/.rag/embeddings.sqlite3，reindex_posts / upsert_post 在调用
+智谱 / OpenAI 之前先查这里，只有真正的新文本才会请求 embedding 接口。
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def _text_key(namespace: str, text: str) -> str:
+    return f"{namespace}|{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingStore:
+    def __init__(self, db_path: Path, max_items: int = 200000) -> None:
+        self.max_items = max(0, int(max_items))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 多线程共享一个连接，所有访问都在 self._lock 内
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS doc_embeddings ("
+            " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_doc_embeddings_last_used ON doc_embeddings(last_used)")
+        self._db.commit()
+
+    def get_many(self, namespace: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        keys = [_text_key(namespace, t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            uniq = list(dict.fromkeys(keys))
+            # SQLite 默认最多 999 个绑定参数，分批查询
+            for start in range(0, len(uniq), 500):
+                part = uniq[start : start + 500]
+                marks = ",".join("?" * len(part))
+                for key, blob in self._db.execute(
+                    f"SELECT key, vec FROM doc_embeddings WHERE key IN ({marks})", part
+                ):
+                    found[key] = np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE doc_embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._db.commit()
+            out = [found.get(k) for k in keys]
+            hit = sum(1 for v in out if v is not None)
+            self.hits += hit
+            self.misses += len(out) - hit
+            return out
+
+    def put_many(self, namespace: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        rows = []
+        for t, v in zip(texts, vectors):
+            arr = np.asarray(v, dtype=np.float16)
+            rows.append((_text_key(namespace, t), int(arr.shape[0]), arr.tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO doc_embeddings(key, dim, vec, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            if self.max_items:
+                total = self._db.execute("SELECT COUNT(*) FROM doc_embeddings").fetchone()[0]
+                over = total - self.max_items
+                if over > 0:
+                    self._db.execute(
+                        "DELETE FROM doc_embeddings WHERE key IN ("
+                        " SELECT key FROM doc_embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (over,),
+                    )
+            self._db.commit()
+
+    def embed(
+        self,
+        namespace: str,
+        texts: Sequence[str],
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+    ) -> List[List[float]]:
+        """先查仓库，只把未命中的（去重后）文本交给 embed_fn，结果回写仓库"""
+        vecs = self.get_many(namespace, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vecs) if v is None))
+        if missing:
+            fresh = [[float(x) for x in v] for v in embed_fn(missing)]
+            if len(fresh) != len(missing):
+                raise RuntimeError(f"embedding 返回条数异常：期望 {len(missing)}，实际 {len(fresh)}")
+            self.put_many(namespace, missing, fresh)
+            by_text = dict(zip(missing, fresh))
+            vecs = [v if v is not None else by_text[t] for t, v in zip(texts, vecs)]
+        return vecs
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = self._db.execute("SELECT COUNT(*) FROM doc_embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "items": items,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,307 @@
+"""
+看板娘聊天的异步流式网关（ASGI）。
+
+waitress 是线程池模型：每条 /api/ai/mascot/chat 流式回答在整个生成期间占住一个工作线程，
+几个访客同时聊天，评论、文章、图片接口就排不上队了。这里：
+- ChatGateway 是一个 ASGI 应用：聊天接口（流式 / 非流式）在 asyncio 事件循环里处理，
+  上游用 AsyncOpenAI（httpx.AsyncClient 连接池）流式读取，等待 token 时不占线程，单进程可挂数百条流
+- 相同问题的并发请求用 AsyncFlightGroup 合并，SSE 合并 / timing / 回答缓存与 Flask 路径完全一致
+- 检索（embedding、向量库）仍是同步代码，放到专用线程池里执行，耗时很短
+- 其余所有请求转交给 fallback（backend/asgi.py 里包装成 ASGI 的 Flask 应用），行为不变
+- 同时在线的流数超过 RAG_GATEWAY_MAX_STREAMS 时返回 503，保护进程
+
+启动（backend 目录）：
+    python -m uvicorn asgi:app --host 127.0.0.1 --port 5000
+"""
+import asyncio
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from flask_cors.core import get_cors_headers
+from werkzeug.datastructures import Headers
+
+from . import (
+    _answer_ends,
+    _answer_result,
+    _answered,
+    _ChunkCounter,
+    _head_events,
+    _prepare_chat,
+    _record_coalesce,
+    _sse_output,
+    _tail_events,
+    _token_coalescer,
+)
+from .context_pack import pack_stats
+from .embed_cache import normalize_query
+from .llm_client import chat_clients
+from .runtime import get_runtime
+from .singleflight import AsyncFlightGroup
+from .sse import coalesce_stats
+from .timing import begin_trace, chat_logger, end_trace, server_timing, stage_stats
+
+CHAT_PATH = "/api/ai/mascot/chat"
+STATS_PATH = "/api/ai/mascot/gateway/stats"
+_MAX_BODY = 1024 * 1024
+
+
+async def _chat_events_async(question: str) -> AsyncIterator[Dict[str, Any]]:
+    """_chat_events 的异步版本：检索放线程池，生成走 AsyncOpenAI"""
+    trace = begin_trace()
+    try:
+        # to_thread 会复制当前 context：retrieve 里的子阶段照样记到这个 trace 上
+        prep = await asyncio.to_thread(_prepare_chat, question, trace)
+        for event in _head_events(prep, trace):
+            yield event
+        if _answered(prep):
+            return
+
+        cfg = prep["cfg"]
+        client, err = chat_clients.get_async(cfg)
+        if client is None:
+            yield {"type": "error", "message": err}
+            return
+
+        counter = _ChunkCounter(cfg, trace)
+        resp = await client.chat.completions.create(
+            model=cfg.chat_model,
+            messages=prep["messages"],
+            temperature=0.2,
+            stream=True,
+        )
+        try:
+            async for chunk in resp:
+                event = counter.feed(chunk)
+                if event is not None:
+                    yield event
+        finally:
+            # 所有订阅者都断开时生产者会关闭本生成器：同时关闭上游连接，不再消耗 token
+            await resp.close()
+        for event in _tail_events(prep, trace, counter):
+            yield event
+
+    except Exception as e:
+        chat_logger.error('AI 服务异常\n%s', traceback.format_exc())
+        yield {"type": "error", "message": f"AI 服务异常: {str(e)}"}
+    finally:
+        end_trace()
+
+
+async def _chain(head: List[Dict[str, Any]], events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    try:
+        for event in head:
+            yield event
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+
+class ChatGateway:
+    def __init__(self, fallback=None, cors: Optional[Dict[str, Any]] = None) -> None:
+        """cors：Flask-CORS 的选项（flask_cors.core.get_cors_options），网关自己的响应按同样规则加 CORS 头"""
+        self.fallback = fallback
+        self.cors = cors
+        self.flights = AsyncFlightGroup()
+        self.active_streams = 0
+        self.total_requests = 0
+        self.rejected = 0
+        self.disconnects = 0
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(scope, receive, send)
+            return
+        if scope["type"] == "http":
+            path, method = scope["path"], scope["method"]
+            if path in (CHAT_PATH, STATS_PATH):
+                send = self._with_cors(scope, send)
+            if path == CHAT_PATH:
+                if method == "OPTIONS":
+                    await self._send(send, 200, b"", [])
+                    return
+                if method == "POST":
+                    await self._chat(scope, receive, send)
+                    return
+            elif path == STATS_PATH and method == "GET":
+                await self._send_json(send, 200, {'errno': 0, 'data': self.stats()})
+                return
+        if self.fallback is None:
+            if scope["type"] == "http":
+                await self._send_json(send, 404, {'errno': 1, 'errmsg': 'API 接口不存在'})
+            return
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, scope, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                cfg = get_runtime().config()
+                # 检索（同步）用的线程池；to_thread 走事件循环的默认线程池
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=max(1, cfg.gateway_retrieve_workers), thread_name_prefix="chat-retrieve")
+                )
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await chat_clients.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # ---- HTTP 辅助 ----
+
+    def _with_cors(self, scope, send):
+        """包装 send：响应头里加上 CORS 头（由 Flask-CORS 的 get_cors_headers 按请求的 Origin 等计算）"""
+        if self.cors is None:
+            return send
+        request_headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope.get("headers") or []])
+        cors = [
+            (k.lower().encode("latin-1"), str(v).encode("latin-1"))
+            for k, v in get_cors_headers(self.cors, request_headers, scope["method"]).items(multi=True)
+        ]
+
+        async def send_with_cors(message) -> None:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers") or []) + cors}
+            await send(message)
+
+        return send_with_cors
+
+    @staticmethod
+    async def _send(send, status: int, body: bytes, headers: List, more_body: bool = False) -> None:
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _send_json(self, send, status: int, payload: Dict[str, Any], headers: Optional[List] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        await self._send(send, status, body, [(b"content-type", b"application/json")] + (headers or []))
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body = message.get("body", b"")
+            size += len(body)
+            if size > _MAX_BODY:
+                return None
+            chunks.append(body)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    @staticmethod
+    async def _wait_disconnect(receive) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # ---- 聊天 ----
+
+    async def _chat(self, scope, receive, send) -> None:
+        self.total_requests += 1
+        headers = dict(scope.get("headers") or [])
+        mimetype = headers.get(b"content-type", b"").split(b";")[0].strip().lower()
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        # 与 Flask 的 request.is_json 一致
+        if not (mimetype == b"application/json" or (mimetype.startswith(b"application/") and mimetype.endswith(b"+json"))):
+            await self._send_json(send, 400, {'errno': 1, 'errmsg': '请求必须是 JSON 格式'})
+            return
+        try:
+            data = json.loads(body or b"{}") or {}
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        question = str(data.get('question') or '').strip()
+        cfg = get_runtime().config()
+
+        if not data.get('stream', False):
+            if not question:
+                await self._send_json(send, 400, {'errno': 1, 'errmsg': 'question 不能为空'})
+                return
+            # 非流式：拼到 _answer_result 会提前返回的事件为止
+            events = []
+            sub = self.flights.subscribe(normalize_query(question), lambda: _chat_events_async(question))
+            try:
+                async for event in sub:
+                    events.append(event)
+                    if _answer_ends(event):
+                        break
+            finally:
+                await sub.aclose()
+            status, payload, timing = _answer_result(events, bool(data.get('timing')))
+            extra = [(b"server-timing", server_timing(timing).encode("ascii"))] if timing else []
+            await self._send_json(send, status, payload, extra)
+            return
+
+        sse_headers = [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")]
+        if not question:
+            await self._send(send, 200, 'data: {"type": "error", "message": "question 不能为空"}\n\n'.encode("utf-8"), sse_headers)
+            return
+        if self.active_streams >= cfg.gateway_max_streams:
+            self.rejected += 1
+            await self._send_json(send, 503, {'errno': 1, 'errmsg': '当前对话的人太多啦，请稍后再试'})
+            return
+
+        self.active_streams += 1
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        coalescer = _token_coalescer(cfg)
+        show_timing = bool(data.get('timing')) or cfg.timing_event
+        events = self.flights.subscribe(normalize_query(question), lambda: _chat_events_async(question), coalescer)
+        try:
+            # 先消费到检索完成：检索各阶段耗时放进 Server-Timing 头（生成阶段的耗时见 timing 事件）
+            head = []
+            async for event in events:
+                head.append(event)
+                if event["type"] in ("retrieved", "error", "done"):
+                    break
+            if head and head[-1]["type"] == "retrieved":
+                sse_headers.append((b"server-timing", server_timing(head[-1]["timing"]).encode("ascii")))
+            await send({"type": "http.response.start", "status": 200, "headers": sse_headers})
+            await self._pump(send, _chain(head, events), disconnect, show_timing, coalescer)
+        finally:
+            self.active_streams -= 1
+            disconnect.cancel()
+            _record_coalesce(coalescer)
+
+    async def _pump(self, send, events: AsyncIterator[Dict[str, Any]], disconnect: asyncio.Future, show_timing: bool, coalescer) -> None:
+        """逐帧下发；客户端断开时立即停止（不必等到下一个 token）"""
+        try:
+            while True:
+                nxt = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait({nxt, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not nxt.done():
+                    self.disconnects += 1
+                    nxt.cancel()
+                    try:
+                        await nxt
+                    except BaseException:
+                        pass
+                    return
+                try:
+                    event = nxt.result()
+                except StopAsyncIteration:
+                    break
+                frame = _sse_output(event, show_timing, coalescer)
+                if frame is not None:
+                    await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await events.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_streams": self.active_streams,
+            "total_requests": self.total_requests,
+            "rejected": self.rejected,
+            "disconnects": self.disconnects,
+            "chat_flights": self.flights.stats(),
+            "chat_clients": chat_clients.stats(),
+            "chat_timing": stage_stats.stats(),
+            "sse_coalesce": coalesce_stats.stats(),
+            "context_packing": pack_stats.stats(),
+        }
@@ -0,0 +1,118 @@
+"""
+后台 reindex 任务。
+
+POST /api/ai/mascot/reindex 以前在请求线程里同步执行 reindex_posts：deploy.ps1 最长等一小时，
+期间一直占着一个 waitress 工作线程，连接一断就算失败。现在改为：
+- 提交后立即返回 job_id，任务在后台线程执行
+- 同一时间只允许一个 reindex；重复提交返回正在运行的任务
+- 状态接口报告已处理文章/chunk 数、ETA、错误；支持取消（全量模式丢弃影子 collection，差量模式回滚已写入的 chunk）
+"""
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .pipeline import ReindexCancelled
+from .rag_store import RagConfig, reindex_posts
+
+_FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class ReindexJob:
+    def __init__(self, full: bool) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.full = full
+        self.status = "queued"  # queued | running | succeeded | failed | cancelled
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.posts_total = 0
+        self.posts_done = 0
+        self.chunks_written = 0
+        self.errors: List[str] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.cancel_event = threading.Event()
+
+    def on_progress(self, event: str, n: int) -> None:
+        if event == "total":
+            self.posts_total = n
+        elif event == "read":
+            self.posts_done += n
+        elif event == "written":
+            self.chunks_written += n
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.status != "running" or not self.started_at or not self.posts_done or not self.posts_total:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = max(0, self.posts_total - self.posts_done)
+        return round(elapsed / self.posts_done * remaining, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "mode": "full" if self.full else "incremental",
+            "status": self.status,
+            "posts_total": self.posts_total,
+            "posts_done": self.posts_done,
+            "chunks_written": self.chunks_written,
+            "eta_seconds": self.eta_seconds(),
+            "elapsed_seconds": round(end - self.started_at, 1) if self.started_at else 0,
+            "errors": self.errors,
+            "result": self.result,
+        }
+
+
+class ReindexJobManager:
+    def __init__(self, history: int = 10) -> None:
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, ReindexJob]" = OrderedDict()
+        self._history = history
+        self._running: Optional[ReindexJob] = None
+
+    def start(self, cfg: RagConfig, full: bool = False) -> Tuple[ReindexJob, bool]:
+        """返回 (job, created)；已有任务在运行时返回该任务且 created=False"""
+        with self._lock:
+            if self._running is not None and self._running.status not in _FINISHED:
+                return self._running, False
+            job = ReindexJob(full)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+            self._running = job
+        threading.Thread(target=self._run, args=(job, cfg), name=f"reindex-{job.id}", daemon=True).start()
+        return job, True
+
+    def _run(self, job: ReindexJob, cfg: RagConfig) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = reindex_posts(cfg, full=job.full, on_progress=job.on_progress, cancel_event=job.cancel_event)
+            job.errors.extend(job.result.get("errors") or [])
+            job.status = "succeeded"
+        except ReindexCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            print(f"[RAG reindex] 任务 {job.id} 失败: {traceback.format_exc()}")
+            job.errors.append(str(e))
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: Optional[str] = None) -> Optional[ReindexJob]:
+        with self._lock:
+            if job_id:
+                return self._jobs.get(job_id)
+            return next(reversed(self._jobs.values()), None)
+
+    def cancel(self, job_id: str) -> Optional[ReindexJob]:
+        job = self.get(job_id)
+        if job is not None and job.status not in _FINISHED:
+            job.cancel_event.set()
+        return job
+
+
+reindex_jobs = ReindexJobManager()
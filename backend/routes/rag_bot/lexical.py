@@ -0,0 +1,132 @@
+"""
+进程内 BM25 倒排索引（与 Chroma 中的 chunks 一一对应）。
+
+纯向量检索对"标签名 / 代码标识符 / 文章标题"这类精确词不敏感，需要把 RAG_CANDIDATE_K 调很大才能召回。
+这里对同一批 chunk 建一个紧凑的倒排索引：
+- 分词：英文/数字按词（小写），中日韩文字按相邻字符二元组（bigram）
+- 打分：BM25（k1=1.2, b=0.75）
+- retrieve() 里与向量结果做 RRF 融合；embedding 接口慢/不可用时可单独兜底
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9_+#]*(?:[.\-][a-z0-9_+#]+)*")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+
+
+def tokenize(text: str) -> List[str]:
+    t = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = _WORD_RE.findall(t)
+    for run in _CJK_RE.findall(t):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class Bm25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._docs: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._total_len = 0
+        self.build_seconds = 0.0
+        self.built_at: Optional[float] = None
+
+    def _remove_locked(self, doc_id: str) -> None:
+        if doc_id not in self._doc_len:
+            return
+        text, _ = self._docs.pop(doc_id)
+        for term in set(tokenize(text)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+
+    def _add_locked(self, doc_id: str, text: str, meta: Dict[str, Any]) -> None:
+        self._remove_locked(doc_id)
+        tokens = tokenize(text)
+        for term, tf in Counter(tokens).items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        self._doc_len[doc_id] = len(tokens)
+        self._total_len += len(tokens)
+        self._docs[doc_id] = (text, meta or {})
+
+    def build(self, items: Iterable[Tuple[str, str, Dict[str, Any]]]) -> None:
+        started = time.perf_counter()
+        with self._lock:
+            self._postings.clear()
+            self._doc_len.clear()
+            self._docs.clear()
+            self._total_len = 0
+            for doc_id, text, meta in items:
+                self._add_locked(doc_id, text, meta)
+            self.build_seconds = time.perf_counter() - started
+            self.built_at = time.time()
+
+    def upsert(self, items: Iterable[Tuple[str, str, Dict[str, Any]]]) -> None:
+        with self._lock:
+            for doc_id, text, meta in items:
+                self._add_locked(doc_id, text, meta)
+
+    def update_meta(self, ids: Iterable[str], metas: Iterable[Dict[str, Any]]) -> None:
+        with self._lock:
+            for doc_id, meta in zip(ids, metas):
+                if doc_id in self._docs:
+                    self._docs[doc_id] = (self._docs[doc_id][0], meta or {})
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float, str, Dict[str, Any]]]:
+        """返回 [(doc_id, score, text, meta)]，按 BM25 分数降序"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._doc_len)
+            if not n or not terms:
+                return []
+            avgdl = self._total_len / n or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[: max(1, k)]
+            return [(doc_id, score, *self._docs[doc_id]) for doc_id, score in top]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            postings = sum(len(p) for p in self._postings.values())
+            return {
+                "docs": len(self._doc_len),
+                "terms": len(self._postings),
+                "postings": postings,
+                "build_ms": round(self.build_seconds * 1000, 1),
+                "built_at": self.built_at,
+            }
+
+
+def rrf_fuse(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Reciprocal Rank Fusion：score(d) = Σ 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,224 @@
+"""
+进程级共享的大模型（OpenAI SDK 兼容）客户端。
+
+以前每次聊天都 `from openai import OpenAI` 并新建客户端：每个请求都要重新构建 SDK 对象、
+重新与 api.deepseek.com 做 TCP + TLS 握手，首 token 前白白多出几百毫秒。现在：
+- 按 (provider, base_url, api_key) 缓存客户端，线程安全，所有请求共享一个 httpx 连接池（keep-alive）
+- 启动时在后台预热连接，之后每隔 RAG_CHAT_WARMUP_INTERVAL 秒再探测一次，保证空闲时连接不被对端回收
+- 统计请求数 / 预热次数与耗时 / 连接池中活跃与空闲连接数
+- get_async：异步网关（gateway.py）用的 AsyncOpenAI，基于 httpx.AsyncClient，连接池上限按网关并发流数放大
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+_DEFAULT_BASE_URLS = {"openai": "https://api.openai.com/v1"}
+
+
+class _PooledClient:
+    def __init__(self, provider: str, base_url: str, api_key: str, cfg) -> None:
+        from openai import OpenAI
+
+        self.provider = provider
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.created_at = time.time()
+        self.requests = 0  # 经过连接池的全部 HTTP 请求（含预热）
+        self.last_request_at = 0.0
+        self.warmups = 0
+        self.warmup_failures = 0
+        self.last_warmup_at: Optional[float] = None
+        self.last_warmup_ms: Optional[float] = None
+        self.http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=cfg.chat_pool_size,
+                max_keepalive_connections=cfg.chat_pool_size,
+                keepalive_expiry=cfg.chat_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(cfg.chat_read_timeout, connect=cfg.chat_connect_timeout),
+            event_hooks={"request": [self._on_request]},
+        )
+        self.client = OpenAI(api_key=api_key, base_url=self.base_url, http_client=self.http)
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self.requests += 1
+        self.last_request_at = time.time()
+
+    def warm(self) -> bool:
+        """发一个轻量请求（GET /models），建立/保持 TLS 连接；任何 HTTP 响应都算成功"""
+        t0 = time.perf_counter()
+        try:
+            self.http.get(f"{self.base_url}/models", headers={"Authorization": f"Bearer {self.api_key}"})
+            ok = True
+        except httpx.HTTPError as e:
+            print(f"[LLM] 连接预热失败（{self.provider} {self.base_url}）: {e}")
+            self.warmup_failures += 1
+            ok = False
+        self.warmups += 1
+        self.last_warmup_at = time.time()
+        self.last_warmup_ms = round((time.perf_counter() - t0) * 1000, 1)
+        return ok
+
+    def pool_stats(self) -> Dict[str, Any]:
+        # httpx 没有公开连接池状态，这里读 httpcore 的连接列表（读不到时只返回计数器）
+        total = idle = None
+        try:
+            conns = list(self.http._transport._pool.connections)
+            total = len(conns)
+            idle = sum(1 for c in conns if c.is_idle())
+        except Exception:
+            pass
+        return {
+            "provider": self.provider,
+            "base_url": self.base_url,
+            "chat_requests": self.requests - self.warmups,
+            "warmups": self.warmups,
+            "warmup_failures": self.warmup_failures,
+            "last_warmup_ms": self.last_warmup_ms,
+            "last_warmup_at": self.last_warmup_at,
+            "connections": total,
+            "idle_connections": idle,
+        }
+
+
+class _AsyncPooledClient:
+    """异步客户端只在创建它的事件循环里使用（网关进程只有一个事件循环）"""
+
+    def __init__(self, provider: str, base_url: str, api_key: str, cfg) -> None:
+        from openai import AsyncOpenAI
+
+        self.provider = provider
+        self.base_url = base_url.rstrip("/")
+        self.requests = 0
+        pool_size = max(cfg.chat_pool_size, cfg.gateway_max_streams)
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=cfg.chat_pool_size,
+                keepalive_expiry=cfg.chat_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(cfg.chat_read_timeout, connect=cfg.chat_connect_timeout),
+            event_hooks={"request": [self._on_request]},
+        )
+        self.client = AsyncOpenAI(api_key=api_key, base_url=self.base_url, http_client=self.http)
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        self.requests += 1
+
+    def pool_stats(self) -> Dict[str, Any]:
+        total = idle = None
+        try:
+            conns = list(self.http._transport._pool.connections)
+            total = len(conns)
+            idle = sum(1 for c in conns if c.is_idle())
+        except Exception:
+            pass
+        return {
+            "provider": self.provider,
+            "base_url": self.base_url,
+            "async": True,
+            "chat_requests": self.requests,
+            "connections": total,
+            "idle_connections": idle,
+        }
+
+
+class ChatClientRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str, str], _PooledClient] = {}
+        self._async_clients: Dict[Tuple[str, str, str], _AsyncPooledClient] = {}
+        self._warmer: Optional[threading.Thread] = None
+        self._warm_interval = 0.0
+
+    @staticmethod
+    def resolve(cfg) -> Tuple[Optional[Tuple[str, str, str]], Optional[str]]:
+        """按配置得到 (provider, base_url, api_key)；未配置密钥时返回错误信息"""
+        if cfg.chat_provider == "deepseek":
+            if not cfg.deepseek_api_key:
+                return None, "未配置 DEEPSEEK_API_KEY。请在 backend/.env 中设置 DEEPSEEK_API_KEY=xxx"
+            return ("deepseek", cfg.chat_base_url, cfg.deepseek_api_key), None
+        if not cfg.openai_api_key:
+            return None, "RAG_CHAT_PROVIDER=openai 但未配置 OPENAI_API_KEY。"
+        return ("openai", _DEFAULT_BASE_URLS["openai"], cfg.openai_api_key), None
+
+    def _get(self, cfg) -> Tuple[Optional[_PooledClient], Optional[str]]:
+        key, err = self.resolve(cfg)
+        if key is None:
+            return None, err
+        with self._lock:
+            pooled = self._clients.get(key)
+            if pooled is None:
+                pooled = _PooledClient(key[0], key[1], key[2], cfg)
+                self._clients[key] = pooled
+            self._ensure_warmer_locked(cfg.chat_warmup_interval)
+        return pooled, None
+
+    def get(self, cfg):
+        """返回 (OpenAI 客户端, 错误信息)"""
+        pooled, err = self._get(cfg)
+        return (pooled.client if pooled is not None else None), err
+
+    def get_async(self, cfg):
+        """返回 (AsyncOpenAI 客户端, 错误信息)；只在网关的事件循环里调用"""
+        key, err = self.resolve(cfg)
+        if key is None:
+            return None, err
+        with self._lock:
+            pooled = self._async_clients.get(key)
+            if pooled is None:
+                pooled = _AsyncPooledClient(key[0], key[1], key[2], cfg)
+                self._async_clients[key] = pooled
+        return pooled.client, None
+
+    async def aclose(self) -> None:
+        with self._lock:
+            clients = list(self._async_clients.values())
+            self._async_clients.clear()
+        for pooled in clients:
+            await pooled.http.aclose()
+
+    def warm(self, cfg) -> bool:
+        pooled, err = self._get(cfg)
+        if pooled is None:
+            print(f"[LLM] 跳过连接预热: {err}")
+            return False
+        return pooled.warm()
+
+    def warm_async(self, cfg) -> None:
+        threading.Thread(target=self.warm, args=(cfg,), name="llm-warmup", daemon=True).start()
+
+    def _ensure_warmer_locked(self, interval: float) -> None:
+        self._warm_interval = float(interval or 0)
+        if self._warm_interval <= 0 or (self._warmer is not None and self._warmer.is_alive()):
+            return
+        self._warmer = threading.Thread(target=self._warm_loop, name="llm-keepwarm", daemon=True)
+        self._warmer.start()
+
+    def _warm_loop(self) -> None:
+        while self._warm_interval > 0:
+            time.sleep(self._warm_interval)
+            with self._lock:
+                clients = list(self._clients.values())
+            for pooled in clients:
+                # 一个周期内有过请求，连接本来就是热的，不必再探测
+                if time.time() - pooled.last_request_at < self._warm_interval:
+                    continue
+                pooled.warm()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = list(self._clients.items()) + list(self._async_clients.items())
+        return {
+            "clients": [
+                {"key": hashlib.sha256("|".join(k).encode("utf-8")).hexdigest()[:8], **c.pool_stats()}
+                for k, c in items
+            ],
+            "warm_interval": self._warm_interval,
+        }
+
+
+chat_clients = ChatClientRegistry()
@@ -0,0 +1,319 @@
+"""
+reindex 流水线：读取 -> 切块 -> 批量 embedding -> 批量写入 Chroma。
+
+各阶段各占一个线程，阶段之间用有界队列衔接：文章再多，内存里同时存在的也只有
+"队列容量 × 单篇/单批" 的数据，峰值内存不随 source/_posts 规模增长；
+embedding 与写库按固定批次进行，并统计每个阶段的处理量与耗时（吞吐）。
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+_DONE = object()
+
+
+class _PipelineAborted(Exception):
+    pass
+
+
+class ReindexCancelled(Exception):
+    """reindex 任务被取消"""
+
+
+class StageStats:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items / self.busy_seconds, 2) if self.busy_seconds > 0 else None,
+        }
+
+
+class WriteJournal:
+    """
+    包装写入目标 collection，记录本次写入前的原状，失败/取消时回滚（差量 reindex 用）。
+    每个 chunk id 第一次被写时读出旧的向量/文本/metadata；原来不存在的 id 回滚时删除。
+    只记录被改动的 chunk，开销与变化量成正比，不随库的规模增长。
+    """
+
+    def __init__(self, col) -> None:
+        self.col = col
+        self.name = col.name
+        self._old: Dict[str, Optional[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, ids: List[str]) -> None:
+        with self._lock:
+            todo = [cid for cid in dict.fromkeys(ids) if cid not in self._old]
+        if not todo:
+            return
+        got = self.col.get(ids=todo, include=["embeddings", "documents", "metadatas"])
+        embs = got.get("embeddings")
+        rows = {
+            cid: (emb, doc, meta)
+            for cid, emb, doc, meta in zip(
+                got.get("ids") or [],
+                embs if embs is not None else [],
+                got.get("documents") or [],
+                got.get("metadatas") or [],
+            )
+        }
+        with self._lock:
+            for cid in todo:
+                self._old.setdefault(cid, rows.get(cid))
+
+    def upsert(self, ids, embeddings, documents, metadatas) -> None:
+        self._record(list(ids))
+        self.col.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update(self, ids, metadatas) -> None:
+        self._record(list(ids))
+        self.col.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids) -> None:
+        self._record(list(ids))
+        self.col.delete(ids=ids)
+
+    def touched(self) -> int:
+        return len(self._old)
+
+    def rollback(self, batch: int = 256) -> int:
+        """恢复到第一次写入前的状态，返回恢复的 chunk 数"""
+        with self._lock:
+            old, self._old = self._old, {}
+        added = [cid for cid, row in old.items() if row is None]
+        restore = [(cid, row) for cid, row in old.items() if row is not None]
+        if added:
+            self.col.delete(ids=added)
+        for i in range(0, len(restore), max(1, batch)):
+            part = restore[i : i + batch]
+            self.col.upsert(
+                ids=[cid for cid, _ in part],
+                embeddings=[row[0] for _, row in part],
+                documents=[row[1] for _, row in part],
+                metadatas=[row[2] for _, row in part],
+            )
+        return len(old)
+
+
+class ReindexPipeline:
+    """
+    read_post(md_path) -> 读到的文章 dict（需含 md_path；返回 None 表示走快路径跳过）
+    chunk_post(item) -> _diff_post 的结果（待 embedding / 待删 / 仅更新 metadata）
+    embed_documents(texts) -> vectors
+    col：写入目标 collection
+    on_progress(event, n)：进度回调，event 为 "read"（处理完 n 篇）/ "written"（写入 n 个 chunk）
+    cancel_event：置位后各阶段尽快退出，run() 抛出 ReindexCancelled
+    单篇文章读取/切块失败只记入 errors 并跳过；embedding / 写库失败则中止整个流水线。
+    """
+
+    def __init__(
+        self,
+        col,
+        read_post: Callable[[Path], Optional[Dict[str, Any]]],
+        chunk_post: Callable[[Dict[str, Any]], Dict[str, Any]],
+        embed_documents: Callable[[List[str]], List[List[float]]],
+        *,
+        embed_batch: int = 128,
+        write_batch: int = 256,
+        queue_size: int = 8,
+        on_progress: Optional[Callable[[str, int], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> None:
+        self.col = col
+        self.read_post = read_post
+        self.chunk_post = chunk_post
+        self.embed_documents = embed_documents
+        self.embed_batch = max(1, int(embed_batch))
+        self.write_batch = max(1, int(write_batch))
+        self.queue_size = max(1, int(queue_size))
+        self.stages = {name: StageStats(name) for name in ("read", "chunk", "embed", "write")}
+        self.report = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0, "posts_changed": 0}
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.errors: List[str] = []
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._report_lock = threading.Lock()
+
+    # ---------- 队列工具：下游出错时上游不能永久阻塞在 put 上 ----------
+    def _check_stop(self) -> None:
+        if self.cancel_event is not None and self.cancel_event.is_set() and not self._stop.is_set():
+            if self._error is None:
+                self._error = ReindexCancelled("reindex 已取消")
+            self._stop.set()
+        if self._stop.is_set():
+            raise _PipelineAborted()
+
+    def _put(self, q: "queue.Queue", item: Any) -> None:
+        while True:
+            self._check_stop()
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: "queue.Queue") -> Any:
+        while True:
+            self._check_stop()
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+    def _add_report(self, **kw: int) -> None:
+        with self._report_lock:
+            for k, v in kw.items():
+                self.report[k] += v
+
+    def _progress(self, event: str, n: int) -> None:
+        if self.on_progress is not None and n:
+            self.on_progress(event, n)
+
+    def _run_stage(self, fn: Callable[[], None]) -> None:
+        try:
+            fn()
+        except _PipelineAborted:
+            pass
+        except BaseException as e:  # noqa: B902 - 线程内异常需要带回主线程
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+
+    # ---------- 各阶段 ----------
+    def _stage_read(self, md_files: Iterable[Path], out_q: "queue.Queue") -> None:
+        st = self.stages["read"]
+        for md_path in md_files:
+            self._check_stop()
+            t0 = time.perf_counter()
+            try:
+                item = self.read_post(md_path)
+            except Exception as e:
+                self.errors.append(f"{md_path.name}: {e}")
+                item = None
+            st.busy_seconds += time.perf_counter() - t0
+            st.items += 1
+            if item is None:
+                self._progress("read", 1)
+                continue
+            self._put(out_q, item)
+        self._put(out_q, _DONE)
+
+    def _stage_chunk(self, in_q: "queue.Queue", out_q: "queue.Queue") -> None:
+        st = self.stages["chunk"]
+        while True:
+            item = self._get(in_q)
+            if item is _DONE:
+                break
+            t0 = time.perf_counter()
+            try:
+                diff = self.chunk_post(item)
+            except Exception as e:
+                self.errors.append(f"{item['md_path'].name}: {e}")
+                self._progress("read", 1)
+                continue
+            st.busy_seconds += time.perf_counter() - t0
+            st.items += 1
+            self._progress("read", 1)
+            self._add_report(
+                added=diff["added"],
+                updated=diff["updated"],
+                deleted=diff["deleted"],
+                skipped=diff["skipped"],
+                posts_changed=1 if (diff["embed_ids"] or diff["delete_ids"]) else 0,
+            )
+            self._put(out_q, diff)
+        self._put(out_q, _DONE)
+
+    def _stage_embed(self, in_q: "queue.Queue", out_q: "queue.Queue") -> None:
+        st = self.stages["embed"]
+        ids: List[str] = []
+        docs: List[str] = []
+        metas: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            if not ids:
+                return
+            t0 = time.perf_counter()
+            vecs = self.embed_documents(list(docs))
+            st.busy_seconds += time.perf_counter() - t0
+            st.items += len(docs)
+            self._put(out_q, ("upsert", list(ids), vecs, list(docs), list(metas)))
+            ids.clear()
+            docs.clear()
+            metas.clear()
+
+        while True:
+            diff = self._get(in_q)
+            if diff is _DONE:
+                break
+            # 删除 / 仅更新 metadata 不需要 embedding，直接交给写入阶段
+            if diff["delete_ids"]:
+                self._put(out_q, ("delete", diff["delete_ids"]))
+            if diff["meta_ids"]:
+                self._put(out_q, ("update", diff["meta_ids"], diff["meta_metas"]))
+            ids.extend(diff["embed_ids"])
+            docs.extend(diff["embed_docs"])
+            metas.extend(diff["embed_metas"])
+            if len(ids) >= self.embed_batch:
+                flush()
+        flush()
+        self._put(out_q, _DONE)
+
+    def _stage_write(self, in_q: "queue.Queue") -> None:
+        st = self.stages["write"]
+        while True:
+            op = self._get(in_q)
+            if op is _DONE:
+                break
+            t0 = time.perf_counter()
+            kind = op[0]
+            if kind == "delete":
+                self.col.delete(ids=op[1])
+                n = len(op[1])
+            elif kind == "update":
+                for i in range(0, len(op[1]), self.write_batch):
+                    self.col.update(ids=op[1][i : i + self.write_batch], metadatas=op[2][i : i + self.write_batch])
+                n = len(op[1])
+            else:
+                _, ids, vecs, docs, metas = op
+                for i in range(0, len(ids), self.write_batch):
+                    j = i + self.write_batch
+                    self.col.upsert(ids=ids[i:j], embeddings=vecs[i:j], documents=docs[i:j], metadatas=metas[i:j])
+                n = len(ids)
+            st.busy_seconds += time.perf_counter() - t0
+            st.items += n
+            self._progress("written", n)
+
+    def run(self, md_files: Iterable[Path]) -> Dict[str, Any]:
+        q_read: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        q_chunk: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        q_write: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self._run_stage, args=(lambda: self._stage_read(md_files, q_read),), name="reindex-read"),
+            threading.Thread(target=self._run_stage, args=(lambda: self._stage_chunk(q_read, q_chunk),), name="reindex-chunk"),
+            threading.Thread(target=self._run_stage, args=(lambda: self._stage_embed(q_chunk, q_write),), name="reindex-embed"),
+            threading.Thread(target=self._run_stage, args=(lambda: self._stage_write(q_write),), name="reindex-write"),
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        if self._error is not None:
+            raise self._error
+        return {
+            **self.report,
+            "errors": list(self.errors),
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+            "stages": {name: st.to_dict() for name, st in self.stages.items()},
+        }
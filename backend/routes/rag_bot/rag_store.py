@@ -1,22 +1,33 @@
+import hashlib
 import os
+import random
 import re
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import requests
+import requests.adapters
 import yaml
 from dotenv import load_dotenv
 
 # 关闭 Chroma 匿名遥测：云端常见因依赖不一致导致 telemetry 报错刷屏
-# 必须在 import chromadb 之前设置
+# 必须在 import chromadb 之前设置（chromadb 按需导入，见 vector_store.open_vector_client）
 os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
 
-import chromadb
-from chromadb.utils import embedding_functions
-
+from ..inline_images import strip_inline_images
+from ..post_catalog import get_catalog
+from .coarse import rescore
+from .lexical import rrf_fuse
+from .pipeline import ReindexPipeline, WriteJournal
 from .prompt import get_system_prompt
+from .timing import span
+from .vector_store import open_vector_client
 
 
 @dataclass(frozen=True)
@@ -25,6 +36,8 @@ class RagConfig:
     posts_dir: Path
     persist_dir: Path
     collection_name: str
+    vector_backend: str  # chroma | numpy（NumPy 平铺矩阵，见 vector_store.py）
+    flat_dtype: str  # numpy 后端的向量精度：float32 | float16
     site_url: str
     permalink: str
     embed_provider: str  # zhipu | openai | local（不推荐）
@@ -42,21 +55,109 @@ class RagConfig:
     retrieve_per_post_max: int
     max_context_chars: int
     max_chunk_chars: int
+    # 上下文打包预算（估算 token，见 context_pack.py）；未配置时由上面两个字符数换算
+    max_context_tokens: int
+    max_chunk_tokens: int
+
+    # 混合检索（BM25 + 向量，RRF 融合）
+    hybrid_retrieval: bool
+    lexical_k: int
+    rrf_k: int
+    lexical_min_score: float
+    embed_query_timeout: float
+
+    # 两阶段（Matryoshka）检索：截断向量粗排 + 全精度精排
+    two_stage: bool
+    stage1_dim: int
+    stage1_quant: str  # none | int8
+    stage1_k: int
+
+    # 语义回答缓存（answer_cache.py）
+    answer_cache_size: int
+    answer_cache_ttl: int
+    answer_cache_threshold: float
+    # 引用详情 LRU 条数（citation_cache.py）
+    citation_cache_size: int
+
+    # 查询向量缓存（内存 LRU + 磁盘 SQLite）
+    query_cache_size: int
+    query_cache_ttl: int
+    query_cache_disk_max: int
+    # 文档向量仓库（text -> vector，float16 落盘）最大条数
+    embed_store_max: int
+    # reindex 流水线：每批 embedding 条数 / 每批写入条数 / 阶段间队列容量
+    reindex_embed_batch: int
+    reindex_write_batch: int
+    reindex_queue_size: int
+    # 全量重建蓝绿切换后，旧版本 collection 保留多久（秒）再删除
+    collection_gc_grace: int
 
     # 智谱 Embedding
     zhipu_api_key: str
     zhipu_embed_model: str
     zhipu_embed_dimensions: int
     zhipu_embed_base_url: str
+    # embedding 请求：并发 batch 数 / 客户端 QPS 上限（0=不限）/ 429、5xx 重试次数
+    embed_concurrency: int
+    embed_max_qps: float
+    embed_max_retries: int
+    embed_batch_window_ms: float
+    embed_batch_max: int
 
     openai_api_key: str
     openai_embed_model: str
     openai_embed_base_url: str
+    openai_embed_dimensions: Optional[int]  # None=模型默认维度
     chat_provider: str  # deepseek | openai
     chat_base_url: str
     deepseek_api_key: str
     chat_model: str
     chat_system_prompt: str
+    # 大模型 HTTP 连接池（llm_client.py）
+    chat_pool_size: int
+    chat_keepalive_expiry: float
+    chat_connect_timeout: float
+    chat_read_timeout: float
+    chat_warmup: bool
+    chat_warmup_interval: float
+    # 分阶段耗时（timing.py）：默认是否下发 timing SSE 事件 / 滚动分位数的样本窗口
+    timing_event: bool
+    timing_window: int
+    # 问答日志：级别 / 每隔多少个 token chunk 记一条 DEBUG 日志（0=不记）
+    log_level: str
+    log_chunk_every: int
+    # SSE 写出合并（sse.py）：相邻 token 攒批的时间窗（毫秒）/ 字节阈值，均为 0 时逐 token 下发
+    sse_flush_ms: float
+    sse_flush_bytes: int
+    # 异步聊天网关（gateway.py）：同时在线的流数上限 / 检索线程数 / 承载 Flask 的线程数
+    gateway_max_streams: int
+    gateway_retrieve_workers: int
+    gateway_wsgi_workers: int
+
+
+class _TokenBucket:
+    """客户端令牌桶：把对 embedding 接口的请求速率限制在 rate 次/秒以内（rate<=0 不限速）"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
 
 class ZhipuEmbeddingFunction:
@@ -65,8 +166,12 @@ class ZhipuEmbeddingFunction:
     文档： https://docs.bigmodel.cn/api-reference/模型-api/文本嵌入
     - input 支持 string / string[]；embedding-3 数组最大 64 条
     - dimensions 建议 1024/2048（不要用 2）
+    - 多个 batch 通过有界线程池并发发送（concurrency），共享 requests.Session 复用 keep-alive 连接
+    - 429/5xx/网络错误按指数退避重试（优先遵循 Retry-After），令牌桶限制 QPS
     """
 
+    _RETRY_STATUS = (429, 500, 502, 503, 504)
+
     def __init__(
         self,
         api_key: Optional[str] = None,
@@ -75,6 +180,9 @@ class ZhipuEmbeddingFunction:
         base_url: str = "https://open.bigmodel.cn/api/paas/v4/embeddings",
         timeout_seconds: int = 30,
         api_key_env_var: str = "ZHIPU_API_KEY",
+        concurrency: int = 4,
+        max_qps: float = 10,
+        max_retries: int = 4,
     ) -> None:
         self.api_key_env_var = (api_key_env_var or "ZHIPU_API_KEY").strip()
         self.api_key = (api_key or os.getenv(self.api_key_env_var) or "").strip()
@@ -82,12 +190,22 @@ class ZhipuEmbeddingFunction:
         self.dimensions = int(dimensions)
         self.base_url = (base_url or "").strip() or "https://open.bigmodel.cn/api/paas/v4/embeddings"
         self.timeout_seconds = int(timeout_seconds)
+        self.concurrency = max(1, int(concurrency))
+        self.max_qps = float(max_qps)
+        self.max_retries = max(0, int(max_retries))
 
         if not self.api_key:
             raise ValueError(f"未配置 {self.api_key_env_var}")
         if self.dimensions not in (256, 512, 1024, 2048):
             raise ValueError("zhipu embedding-3 的 dimensions 仅支持 256/512/1024/2048")
 
+        self._bucket = _TokenBucket(self.max_qps)
+        self._session: Optional[requests.Session] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._init_lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+
     @staticmethod
     def name() -> str:
         # 供 Chroma(>=1.x) 序列化/反序列化 embedding function 用
@@ -109,6 +227,9 @@ class ZhipuEmbeddingFunction:
             base_url=str(config.get("base_url") or "https://open.bigmodel.cn/api/paas/v4/embeddings"),
             timeout_seconds=int(config.get("timeout_seconds") or 30),
             api_key_env_var=str(config.get("api_key_env_var") or "ZHIPU_API_KEY"),
+            concurrency=int(config.get("concurrency") or 4),
+            max_qps=float(config.get("max_qps") or 10),
+            max_retries=int(config.get("max_retries") if config.get("max_retries") is not None else 4),
         )
 
     def get_config(self) -> Dict[str, Any]:
@@ -119,12 +240,86 @@ class ZhipuEmbeddingFunction:
             "dimensions": self.dimensions,
             "base_url": self.base_url,
             "timeout_seconds": self.timeout_seconds,
+            "concurrency": self.concurrency,
+            "max_qps": self.max_qps,
+            "max_retries": self.max_retries,
         }
 
     def embed_query(self, input: Any) -> List[List[float]]:
         # Chroma(>=1.x) query 路径会调用 embed_query
         return self.__call__(input)
 
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            with self._init_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.concurrency, max_retries=0
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update({
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json",
+                    })
+                    self._session = session
+        return self._session
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._init_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.concurrency, thread_name_prefix="zhipu-embed"
+                    )
+        return self._executor
+
+    def _retry_delay(self, attempt: int, resp: Optional[requests.Response]) -> float:
+        if resp is not None:
+            retry_after = (resp.headers.get("Retry-After") or "").strip()
+            if retry_after:
+                try:
+                    return min(60.0, max(0.0, float(retry_after)))
+                except ValueError:
+                    pass
+        # 指数退避 + 抖动：0.5s, 1s, 2s, 4s ...（上限 30s）
+        return min(30.0, 0.5 * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "input": batch if len(batch) > 1 else batch[0],
+            "dimensions": self.dimensions,
+        }
+        session = self._get_session()
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            resp = None
+            try:
+                self.requests_sent += 1
+                resp = session.post(self.base_url, json=payload, timeout=self.timeout_seconds)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise RuntimeError(f"智谱 embeddings 请求失败（网络错误，已重试 {attempt} 次）：{e}")
+            else:
+                if resp.status_code == 200:
+                    break
+                if resp.status_code not in self._RETRY_STATUS or attempt >= self.max_retries:
+                    raise RuntimeError(f"智谱 embeddings 请求失败（HTTP {resp.status_code}）：{resp.text[:400]}")
+            time.sleep(self._retry_delay(attempt, resp))
+            attempt += 1
+            self.retries += 1
+
+        data = resp.json()
+        items = data.get("data") or []
+        items = sorted(items, key=lambda x: int(x.get("index", 0)))
+        embeds = [it.get("embedding") for it in items]
+        if len(embeds) != len(batch):
+            raise RuntimeError(f"智谱 embeddings 返回条数异常：期望 {len(batch)}，实际 {len(embeds)}")
+        return embeds
+
     def __call__(self, input: Any) -> List[List[float]]:
         # 兼容 Chroma OneOrMany：可能传入 str 或 List[str]
         if input is None:
@@ -138,33 +333,16 @@ class ZhipuEmbeddingFunction:
         if not texts:
             return []
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
         batch_size = 64
-        out: List[List[float]] = []
-        for start in range(0, len(texts), batch_size):
-            batch = texts[start : start + batch_size]
-            payload: Dict[str, Any] = {
-                "model": self.model,
-                "input": batch if len(batch) > 1 else batch[0],
-                "dimensions": self.dimensions,
-            }
+        batches = [texts[start : start + batch_size] for start in range(0, len(texts), batch_size)]
+        if len(batches) == 1:
+            # 单个 batch（查询/单篇文章）直接在当前线程发送，不走线程池
+            return self._embed_batch(batches[0])
 
-            resp = requests.post(self.base_url, json=payload, headers=headers, timeout=self.timeout_seconds)
-            if resp.status_code != 200:
-                raise RuntimeError(f"智谱 embeddings 请求失败（HTTP {resp.status_code}）：{resp.text[:400]}")
-
-            data = resp.json()
-            items = data.get("data") or []
-            items = sorted(items, key=lambda x: int(x.get("index", 0)))
-            embeds = [it.get("embedding") for it in items]
-            if len(embeds) != len(batch):
-                raise RuntimeError(f"智谱 embeddings 返回条数异常：期望 {len(batch)}，实际 {len(embeds)}")
+        out: List[List[float]] = []
+        # map 保持 batch 顺序；任一 batch 重试耗尽会在这里抛出
+        for embeds in self._get_executor().map(self._embed_batch, batches):
             out.extend(embeds)
-
         return out
 
 
@@ -294,14 +472,34 @@ def _chunk_text(text: str, chunk_size: int = 900, overlap: int = 120) -> List[st
     return chunks
 
 
-def load_rag_config() -> RagConfig:
-    blog_root = Path(__file__).parent.parent.parent.parent  # backend/routes/rag_bot -> blog root
+def _blog_root() -> Path:
+    return Path(__file__).parent.parent.parent.parent  # backend/routes/rag_bot -> blog root
+
+
+def config_source_paths() -> List[Path]:
+    """load_rag_config 读取的配置文件（供运行时按 mtime 判断是否需要热重载）"""
+    blog_root = _blog_root()
+    return [blog_root / ".env", blog_root / "backend" / ".env", blog_root / "_config.yml"]
+
+
+def load_rag_config(override_env: bool = False) -> RagConfig:
+    """
+    从 .env / 环境变量 / Hexo _config.yml 构建 RagConfig。
+    override_env=True 时 .env 中的值覆盖进程里已有的环境变量（热重载时使用，否则改了 .env 也不生效）。
+    """
+    blog_root = _blog_root()
     # 允许使用 blog_root/.env 以及 backend/.env
-    load_dotenv(dotenv_path=blog_root / ".env")
-    load_dotenv(dotenv_path=blog_root / "backend" / ".env")
+    load_dotenv(dotenv_path=blog_root / ".env", override=override_env)
+    load_dotenv(dotenv_path=blog_root / "backend" / ".env", override=override_env)
     posts_dir = blog_root / "source" / "_posts"
     persist_dir = blog_root / "backend" / ".rag" / "chroma"
     persist_dir.mkdir(parents=True, exist_ok=True)
+    vector_backend = (os.getenv("RAG_VECTOR_BACKEND") or "chroma").strip().lower()
+    if vector_backend not in ("chroma", "numpy"):
+        vector_backend = "chroma"
+    flat_dtype = (os.getenv("RAG_FLAT_DTYPE") or "float32").strip().lower()
+    if flat_dtype not in ("float32", "float16"):
+        flat_dtype = "float32"
 
     hexo_cfg_path = blog_root / "_config.yml"
     site_url = ""
@@ -327,10 +525,17 @@ def load_rag_config() -> RagConfig:
     zhipu_embed_model = (os.getenv("RAG_ZHIPU_EMBED_MODEL") or "embedding-3").strip()
     zhipu_embed_dimensions = int(os.getenv("RAG_ZHIPU_EMBED_DIM") or 1024)
     zhipu_embed_base_url = (os.getenv("RAG_ZHIPU_EMBED_URL") or "https://open.bigmodel.cn/api/paas/v4/embeddings").strip()
+    embed_concurrency = int(os.getenv("RAG_EMBED_CONCURRENCY") or 4)
+    embed_max_qps = float(os.getenv("RAG_EMBED_QPS") or 10)
+    embed_max_retries = int(os.getenv("RAG_EMBED_MAX_RETRIES") or 4)
+    embed_batch_window_ms = float(os.getenv("RAG_EMBED_BATCH_WINDOW_MS") or 5)
+    embed_batch_max = int(os.getenv("RAG_EMBED_BATCH_MAX") or 64)
 
     openai_api_key = (os.getenv("OPENAI_API_KEY") or "").strip()
     openai_embed_model = (os.getenv("RAG_EMBED_MODEL") or "text-embedding-3-small").strip()
     openai_embed_base_url = (os.getenv("RAG_EMBED_BASE_URL") or "").strip()
+    openai_dim_raw = (os.getenv("RAG_OPENAI_EMBED_DIM") or "").strip()
+    openai_embed_dimensions = int(openai_dim_raw) if openai_dim_raw else None
 
     chat_provider = (os.getenv("RAG_CHAT_PROVIDER") or ("deepseek" if os.getenv("DEEPSEEK_API_KEY") else "openai")).strip().lower()
     if chat_provider not in ("deepseek", "openai"):
@@ -341,6 +546,21 @@ def load_rag_config() -> RagConfig:
     chat_model = (os.getenv("RAG_CHAT_MODEL") or ("deepseek-chat" if chat_provider == "deepseek" else "gpt-4o-mini")).strip()
     # 默认系统提示词从 prompt.py 读取；允许用环境变量覆盖（便于线上快速调参）
     chat_system_prompt = (os.getenv("RAG_CHAT_SYSTEM_PROMPT") or "").strip() or get_system_prompt()
+    chat_pool_size = int(os.getenv("RAG_CHAT_POOL_SIZE") or 20)
+    chat_keepalive_expiry = float(os.getenv("RAG_CHAT_KEEPALIVE_EXPIRY") or 300)
+    chat_connect_timeout = float(os.getenv("RAG_CHAT_CONNECT_TIMEOUT") or 5)
+    chat_read_timeout = float(os.getenv("RAG_CHAT_READ_TIMEOUT") or 120)
+    chat_warmup = str(os.getenv("RAG_CHAT_WARMUP") or "1").strip().lower() not in ("0", "false", "no")
+    chat_warmup_interval = float(os.getenv("RAG_CHAT_WARMUP_INTERVAL") or 240)
+    timing_event = str(os.getenv("RAG_TIMING_EVENT") or "0").strip().lower() in ("1", "true", "yes")
+    timing_window = int(os.getenv("RAG_TIMING_WINDOW") or 1000)
+    log_level = (os.getenv("RAG_LOG_LEVEL") or "INFO").strip().upper()
+    log_chunk_every = int(os.getenv("RAG_LOG_CHUNK_EVERY") or 0)
+    sse_flush_ms = float(os.getenv("RAG_SSE_FLUSH_MS") or 40)
+    sse_flush_bytes = int(os.getenv("RAG_SSE_FLUSH_BYTES") or 512)
+    gateway_max_streams = int(os.getenv("RAG_GATEWAY_MAX_STREAMS") or 500)
+    gateway_retrieve_workers = int(os.getenv("RAG_GATEWAY_RETRIEVE_WORKERS") or 16)
+    gateway_wsgi_workers = int(os.getenv("RAG_GATEWAY_WSGI_WORKERS") or 8)
 
     # 切分/检索参数
     chunk_size = int(os.getenv("RAG_CHUNK_SIZE") or 900)
@@ -355,12 +575,43 @@ def load_rag_config() -> RagConfig:
     retrieve_per_post_max = int(os.getenv("RAG_PER_POST_MAX") or 2)
     max_context_chars = int(os.getenv("RAG_MAX_CONTEXT_CHARS") or 6000)
     max_chunk_chars = int(os.getenv("RAG_MAX_CHUNK_CHARS") or 1400)
+    max_context_tokens = int(os.getenv("RAG_MAX_CONTEXT_TOKENS") or int(max_context_chars * 0.6))
+    max_chunk_tokens = int(os.getenv("RAG_MAX_CHUNK_TOKENS") or int(max_chunk_chars * 0.6))
+
+    hybrid_retrieval = str(os.getenv("RAG_HYBRID") or "1").strip().lower() not in ("0", "false", "no")
+    lexical_k = int(os.getenv("RAG_LEXICAL_K") or retrieve_candidate_k)
+    rrf_k = int(os.getenv("RAG_RRF_K") or 60)
+    lexical_min_score = float(os.getenv("RAG_LEXICAL_MIN_SCORE") or 1.0)
+    embed_query_timeout = float(os.getenv("RAG_EMBED_QUERY_TIMEOUT") or 3)
+
+    two_stage = str(os.getenv("RAG_TWO_STAGE") or "0").strip().lower() in ("1", "true", "yes")
+    stage1_dim = int(os.getenv("RAG_STAGE1_DIM") or 256)
+    stage1_quant = (os.getenv("RAG_STAGE1_QUANT") or "none").strip().lower()
+    if stage1_quant not in ("none", "int8"):
+        stage1_quant = "none"
+    stage1_k = int(os.getenv("RAG_STAGE1_K") or 100)
+
+    answer_cache_size = int(os.getenv("RAG_ANSWER_CACHE_SIZE") or 256)
+    answer_cache_ttl = int(os.getenv("RAG_ANSWER_CACHE_TTL") or 24 * 3600)
+    answer_cache_threshold = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD") or 0.95)
+    citation_cache_size = int(os.getenv("RAG_CITATION_CACHE_SIZE") or 2048)
+
+    query_cache_size = int(os.getenv("RAG_QUERY_CACHE_SIZE") or 512)
+    query_cache_ttl = int(os.getenv("RAG_QUERY_CACHE_TTL") or 7 * 24 * 3600)
+    query_cache_disk_max = int(os.getenv("RAG_QUERY_CACHE_DISK_MAX") or 20000)
+    embed_store_max = int(os.getenv("RAG_EMBED_STORE_MAX") or 200000)
+    reindex_embed_batch = int(os.getenv("RAG_REINDEX_EMBED_BATCH") or 256)
+    reindex_write_batch = int(os.getenv("RAG_REINDEX_WRITE_BATCH") or 256)
+    reindex_queue_size = int(os.getenv("RAG_REINDEX_QUEUE_SIZE") or 8)
+    collection_gc_grace = int(os.getenv("RAG_COLLECTION_GC_GRACE") or 600)
 
     return RagConfig(
         blog_root=blog_root,
         posts_dir=posts_dir,
         persist_dir=persist_dir,
         collection_name="hexo_posts",
+        vector_backend=vector_backend,
+        flat_dtype=flat_dtype,
         site_url=site_url,
         permalink=permalink,
         embed_provider=embed_provider,
@@ -375,53 +626,126 @@ def load_rag_config() -> RagConfig:
         retrieve_per_post_max=retrieve_per_post_max,
         max_context_chars=max_context_chars,
         max_chunk_chars=max_chunk_chars,
+        max_context_tokens=max_context_tokens,
+        max_chunk_tokens=max_chunk_tokens,
+        hybrid_retrieval=hybrid_retrieval,
+        lexical_k=lexical_k,
+        rrf_k=rrf_k,
+        lexical_min_score=lexical_min_score,
+        embed_query_timeout=embed_query_timeout,
+        two_stage=two_stage,
+        stage1_dim=stage1_dim,
+        stage1_quant=stage1_quant,
+        stage1_k=stage1_k,
+        answer_cache_size=answer_cache_size,
+        answer_cache_ttl=answer_cache_ttl,
+        answer_cache_threshold=answer_cache_threshold,
+        citation_cache_size=citation_cache_size,
+        query_cache_size=query_cache_size,
+        query_cache_ttl=query_cache_ttl,
+        query_cache_disk_max=query_cache_disk_max,
+        embed_store_max=embed_store_max,
+        reindex_embed_batch=reindex_embed_batch,
+        reindex_write_batch=reindex_write_batch,
+        reindex_queue_size=reindex_queue_size,
+        collection_gc_grace=collection_gc_grace,
         zhipu_api_key=zhipu_api_key,
         zhipu_embed_model=zhipu_embed_model,
         zhipu_embed_dimensions=zhipu_embed_dimensions,
         zhipu_embed_base_url=zhipu_embed_base_url,
+        embed_concurrency=embed_concurrency,
+        embed_max_qps=embed_max_qps,
+        embed_max_retries=embed_max_retries,
+        embed_batch_window_ms=embed_batch_window_ms,
+        embed_batch_max=embed_batch_max,
         openai_api_key=openai_api_key,
         openai_embed_model=openai_embed_model,
         openai_embed_base_url=openai_embed_base_url,
+        openai_embed_dimensions=openai_embed_dimensions,
         chat_provider=chat_provider,
         chat_base_url=chat_base_url,
         deepseek_api_key=deepseek_api_key,
         chat_model=chat_model,
         chat_system_prompt=chat_system_prompt,
+        chat_pool_size=chat_pool_size,
+        chat_keepalive_expiry=chat_keepalive_expiry,
+        chat_connect_timeout=chat_connect_timeout,
+        chat_read_timeout=chat_read_timeout,
+        chat_warmup=chat_warmup,
+        chat_warmup_interval=chat_warmup_interval,
+        timing_event=timing_event,
+        timing_window=timing_window,
+        log_level=log_level,
+        log_chunk_every=log_chunk_every,
+        sse_flush_ms=sse_flush_ms,
+        sse_flush_bytes=sse_flush_bytes,
+        gateway_max_streams=gateway_max_streams,
+        gateway_retrieve_workers=gateway_retrieve_workers,
+        gateway_wsgi_workers=gateway_wsgi_workers,
     )
 
 
-def _get_collection(cfg: RagConfig):
-    client = chromadb.PersistentClient(path=str(cfg.persist_dir))
+def embed_namespace(cfg: RagConfig) -> str:
+    """embedding 的"身份"（provider:model:dimensions），用作向量缓存 key 的前缀"""
     if cfg.embed_provider == "zhipu":
-        ef = ZhipuEmbeddingFunction(
+        return f"zhipu:{cfg.zhipu_embed_model}:{cfg.zhipu_embed_dimensions}"
+    if cfg.embed_provider == "openai":
+        # 同一模型按不同 dimensions 截断的向量互不兼容，维度必须进 key
+        return f"openai:{cfg.openai_embed_model}:{cfg.openai_embed_dimensions or 'default'}"
+    return f"local:{cfg.local_embed_model}"
+
+
+def _build_embedding_function(cfg: RagConfig):
+    if cfg.embed_provider == "zhipu":
+        return ZhipuEmbeddingFunction(
             api_key=cfg.zhipu_api_key,
             model=cfg.zhipu_embed_model,
             dimensions=cfg.zhipu_embed_dimensions,
             base_url=cfg.zhipu_embed_base_url,
+            concurrency=cfg.embed_concurrency,
+            max_qps=cfg.embed_max_qps,
+            max_retries=cfg.embed_max_retries,
         )
-    elif cfg.embed_provider == "openai":
+    if cfg.embed_provider == "openai":
         if not cfg.openai_api_key:
             raise RuntimeError("RAG_EMBED_PROVIDER=openai 但未配置 OPENAI_API_KEY")
-        ef = embedding_functions.OpenAIEmbeddingFunction(
+        from chromadb.utils import embedding_functions
+
+        return embedding_functions.OpenAIEmbeddingFunction(
             api_key=cfg.openai_api_key,
             model_name=cfg.openai_embed_model,
             api_base=cfg.openai_embed_base_url or None,
+            dimensions=cfg.openai_embed_dimensions,
         )
-    else:
-        # 本地 embedding：2C2G 不推荐，且需要额外安装 torch/sentence-transformers
-        try:
-            ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=cfg.local_embed_model
-            )
-        except Exception as e:
-            raise RuntimeError(
-                "当前选择了本地 embedding（RAG_EMBED_PROVIDER=local），但未安装本地向量依赖。"
-                "在 2C2G 机器上建议改用远程 embedding：设置 RAG_EMBED_PROVIDER=zhipu 并配置 ZHIPU_API_KEY。"
-                f" 原因：{e}"
-            )
+    # 本地 embedding：2C2G 不推荐，且需要额外安装 torch/sentence-transformers
+    try:
+        from chromadb.utils import embedding_functions
+
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=cfg.local_embed_model
+        )
+    except Exception as e:
+        raise RuntimeError(
+            "当前选择了本地 embedding（RAG_EMBED_PROVIDER=local），但未安装本地向量依赖。"
+            "在 2C2G 机器上建议改用远程 embedding：设置 RAG_EMBED_PROVIDER=zhipu 并配置 ZHIPU_API_KEY。"
+            f" 原因：{e}"
+        )
+
+
+def _get_collection(cfg: RagConfig, client=None, ef=None, name: Optional[str] = None):
+    """
+    打开（必要时创建）collection。
+    client / ef 可由 RagRuntime 传入复用；不传则新建（仅脚本/一次性调用使用）。
+    name 默认 cfg.collection_name（全量重建时用于打开临时 collection）。
+    """
+    name = name or cfg.collection_name
+    if client is None:
+        client = open_vector_client(cfg)
+    if ef is None:
+        ef = _build_embedding_function(cfg)
     try:
         col = client.get_or_create_collection(
-            name=cfg.collection_name,
+            name=name,
             embedding_function=ef,
             metadata={"hnsw:space": "cosine"},
         )
@@ -431,11 +755,11 @@ def _get_collection(cfg: RagConfig):
         msg = str(e)
         if "Embedding function conflict" in msg:
             try:
-                client.delete_collection(cfg.collection_name)
+                client.delete_collection(name)
             except Exception:
                 pass
             col = client.get_or_create_collection(
-                name=cfg.collection_name,
+                name=name,
                 embedding_function=ef,
                 metadata={"hnsw:space": "cosine"},
             )
@@ -444,129 +768,50 @@ def _get_collection(cfg: RagConfig):
     return client, col
 
 
-def reindex_posts(cfg: RagConfig) -> Dict[str, Any]:
-    if not cfg.posts_dir.exists():
-        raise RuntimeError(f"未找到文章目录：{cfg.posts_dir}")
+def _index_signature(cfg: RagConfig) -> str:
+    """切分/拼接参数签名：参数变了，即使文章没改也要重新切块"""
+    raw = f"{cfg.chunk_size}|{cfg.chunk_overlap}|{int(cfg.include_title_in_chunks)}|{cfg.site_url}|{cfg.permalink}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
 
-    client, _ = _get_collection(cfg)
-    # 重建：删掉旧 collection 再建
-    try:
-        client.delete_collection(cfg.collection_name)
-    except Exception:
-        pass
-    client, col = _get_collection(cfg)
 
-    # 兼容 _posts 子目录
-    md_files = sorted(cfg.posts_dir.rglob("*.md") if cfg.posts_recursive else cfg.posts_dir.glob("*.md"))
-    total_chunks = 0
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    ids: List[str] = []
-    docs: List[str] = []
-    metas: List[Dict[str, Any]] = []
 
-    for md_path in md_files:
-        raw = md_path.read_text(encoding="utf-8", errors="ignore")
-        meta, body = _parse_front_matter(raw)
-
-        title = str(meta.get("title") or md_path.stem).strip()
-        url = _build_post_url(cfg.site_url, cfg.permalink, meta, md_path)
-        dt = _parse_date(meta.get("date"))
-        date_str = dt.strftime("%Y-%m-%d %H:%M:%S") if dt else str(meta.get("date") or "")
-        # 用相对路径保证唯一（支持 _posts 子目录）
-        try:
-            post_id = str(md_path.relative_to(cfg.posts_dir).with_suffix("")).replace("\\", "/")
-        except Exception:
-            post_id = md_path.stem  # 兜底
-
-        tags = meta.get("tags")
-        if isinstance(tags, (list, tuple)):
-            tags_str = ", ".join([str(x).strip() for x in tags if str(x or "").strip()])
-        else:
-            tags_str = str(tags or "").strip()
-        categories = meta.get("categories")
-        if isinstance(categories, (list, tuple)):
-            categories_str = ", ".join([str(x).strip() for x in categories if str(x or "").strip()])
-        else:
-            categories_str = str(categories or "").strip()
-
-        chunks = _chunk_text(body, chunk_size=cfg.chunk_size, overlap=cfg.chunk_overlap)
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{post_id}:::{i}"
-            doc = chunk
-            # 将标题/标签/分类注入每个 chunk 的文档内容里（提升按标题/标签提问时的召回）
-            if cfg.include_title_in_chunks:
-                header_lines = [f"标题：{title}"]
-                if tags_str:
-                    header_lines.append(f"标签：{tags_str}")
-                if categories_str:
-                    header_lines.append(f"分类：{categories_str}")
-                doc = "\n".join(header_lines) + "\n\n" + chunk
-            ids.append(chunk_id)
-            docs.append(doc)
-            metas.append(
-                {
-                    "title": title,
-                    "url": url,
-                    "date": date_str,
-                    "source": str(md_path.relative_to(cfg.blog_root)).replace("\\", "/"),
-                    "post_id": post_id,
-                    "chunk": i,
-                    "tags": tags_str,
-                    "categories": categories_str,
-                }
-            )
-        total_chunks += len(chunks)
+def _post_id_for(cfg: RagConfig, md_path: Path) -> str:
+    # 用相对路径保证唯一（支持 _posts 子目录）
+    try:
+        return str(md_path.relative_to(cfg.posts_dir).with_suffix("")).replace("\\", "/")
+    except Exception:
+        return md_path.stem  # 兜底
 
-    if ids:
-        # 批量写入
-        col.add(ids=ids, documents=docs, metadatas=metas)
 
-    return {
-        "posts": len(md_files),
-        "chunks": total_chunks,
-        "persist_dir": str(cfg.persist_dir),
-        "collection": cfg.collection_name,
-    }
+def _list_post_files(cfg: RagConfig) -> Dict[Path, float]:
+    """文章路径 -> mtime；与 /api/posts/list 共用文章目录（一次 scandir + stat，兼容 _posts 子目录）"""
+    entries = get_catalog(cfg.posts_dir).entries(recursive=cfg.posts_recursive)
+    return {cfg.posts_dir / e["filename"]: e["mtime"] for e in entries}
 
 
-def upsert_post(post_path: str) -> Dict[str, Any]:
+def _build_post_chunks(cfg: RagConfig, md_path: Path, sig: str, raw: Optional[str] = None) -> Dict[str, Any]:
     """
-    增量入库：只对单篇文章做 embedding 并写入向量库。
-    - 先按 post_id 删除旧 chunks（同一文章更新时覆盖）
-    - 再 add 新 chunks
+    读取单篇文章并切块，返回 {post_id, title, url, ids, docs, metas}。
+    每个 chunk 的 metadata 带 chunk_hash；文章级带 post_hash / post_mtime / index_sig，供差量重建比对。
+    raw 已读出时可直接传入（reindex 流水线的读取阶段）。
     """
-    cfg = load_rag_config()
-    p = Path(post_path)
-    if not p.exists():
-        raise RuntimeError(f"文章文件不存在：{p}")
-    if p.suffix.lower() != ".md":
-        raise RuntimeError(f"仅支持 Markdown：{p}")
-
-    _, col = _get_collection(cfg)
-
-    raw = p.read_text(encoding="utf-8", errors="ignore")
+    st = md_path.stat()
+    if raw is None:
+        raw = md_path.read_text(encoding="utf-8", errors="ignore")
     meta, body = _parse_front_matter(raw)
 
-    title = str(meta.get("title") or p.stem).strip()
-    url = _build_post_url(cfg.site_url, cfg.permalink, meta, p)
+    title = str(meta.get("title") or md_path.stem).strip()
+    url = _build_post_url(cfg.site_url, cfg.permalink, meta, md_path)
     dt = _parse_date(meta.get("date"))
     date_str = dt.strftime("%Y-%m-%d %H:%M:%S") if dt else str(meta.get("date") or "")
+    post_id = _post_id_for(cfg, md_path)
     try:
-        post_id = str(p.relative_to(cfg.posts_dir).with_suffix("")).replace("\\", "/")
-    except Exception:
-        post_id = p.stem
-    try:
-        source = str(p.relative_to(cfg.blog_root)).replace("\\", "/")
+        source = str(md_path.relative_to(cfg.blog_root)).replace("\\", "/")
     except Exception:
-        source = str(p).replace("\\", "/")
-
-    # 删除旧数据（同一 post_id）
-    try:
-        # Chroma where 语法要求显式操作符，避免云端版本差异导致解析失败
-        col.delete(where={"post_id": {"$eq": post_id}})
-    except Exception:
-        # 不阻断（不同版本/权限可能不支持 where delete）
-        pass
+        source = str(md_path).replace("\\", "/")
 
     tags = meta.get("tags")
     if isinstance(tags, (list, tuple)):
@@ -579,14 +824,15 @@ def upsert_post(post_path: str) -> Dict[str, Any]:
     else:
         categories_str = str(categories or "").strip()
 
-    chunks = _chunk_text(body, chunk_size=cfg.chunk_size, overlap=cfg.chunk_overlap)
+    post_hash = _sha256(sig + "\n" + raw)
+    # 未迁移的内嵌 base64 图片不参与切块（否则会被当成正文送去 embedding）
+    chunks = _chunk_text(strip_inline_images(body), chunk_size=cfg.chunk_size, overlap=cfg.chunk_overlap)
     ids: List[str] = []
     docs: List[str] = []
     metas: List[Dict[str, Any]] = []
-
     for i, chunk in enumerate(chunks):
-        ids.append(f"{post_id}:::{i}")
         doc = chunk
+        # 将标题/标签/分类注入每个 chunk 的文档内容里（提升按标题/标签提问时的召回）
         if cfg.include_title_in_chunks:
             header_lines = [f"标题：{title}"]
             if tags_str:
@@ -594,6 +840,7 @@ def upsert_post(post_path: str) -> Dict[str, Any]:
             if categories_str:
                 header_lines.append(f"分类：{categories_str}")
             doc = "\n".join(header_lines) + "\n\n" + chunk
+        ids.append(f"{post_id}:::{i}")
         docs.append(doc)
         metas.append(
             {
@@ -605,22 +852,316 @@ def upsert_post(post_path: str) -> Dict[str, Any]:
                 "chunk": i,
                 "tags": tags_str,
                 "categories": categories_str,
+                "chunk_hash": _sha256(doc),
+                "post_hash": post_hash,
+                "post_mtime": st.st_mtime,
+                "index_sig": sig,
             }
         )
+    return {"post_id": post_id, "title": title, "url": url, "ids": ids, "docs": docs, "metas": metas}
 
-    if ids:
-        col.add(ids=ids, documents=docs, metadatas=metas)
+
+def _diff_post(post: Dict[str, Any], existing: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    对比单篇文章的新 chunks 与库里已有的 chunks（existing: id -> metadata）。
+    - 文本 hash 不变：不 embedding；若 url/标题/mtime 等 metadata 有变化，仅更新 metadata
+    - 新增 / 文本变化：需要 embedding
+    - 多出来的旧 chunk：删除
+    """
+    embed_ids: List[str] = []
+    embed_docs: List[str] = []
+    embed_metas: List[Dict[str, Any]] = []
+    meta_ids: List[str] = []
+    meta_metas: List[Dict[str, Any]] = []
+    added = updated = skipped = 0
+    for cid, doc, m in zip(post["ids"], post["docs"], post["metas"]):
+        old = existing.get(cid)
+        if old is not None and old.get("chunk_hash") == m["chunk_hash"]:
+            skipped += 1
+            if any(old.get(k) != v for k, v in m.items()):
+                meta_ids.append(cid)
+                meta_metas.append(m)
+            continue
+        if old is None:
+            added += 1
+        else:
+            updated += 1
+        embed_ids.append(cid)
+        embed_docs.append(doc)
+        embed_metas.append(m)
+    new_ids = set(post["ids"])
+    delete_ids = [cid for cid in existing if cid not in new_ids]
+    return {
+        "embed_ids": embed_ids,
+        "embed_docs": embed_docs,
+        "embed_metas": embed_metas,
+        "meta_ids": meta_ids,
+        "meta_metas": meta_metas,
+        "delete_ids": delete_ids,
+        "added": added,
+        "updated": updated,
+        "skipped": skipped,
+        "deleted": len(delete_ids),
+    }
+
+
+def _apply_post_diff(col, diff: Dict[str, Any], embed_documents, lexical=None, coarse=None) -> None:
+    """
+    embed_documents: 文本 -> 向量（RagRuntime.embed_documents，先查向量仓库再请求接口）
+    lexical / coarse: 已构建的 Bm25Index / CoarseIndex（可选），同步更新
+    """
+    if diff["delete_ids"]:
+        col.delete(ids=diff["delete_ids"])
+    vecs: List[List[float]] = []
+    if diff["embed_ids"]:
+        vecs = embed_documents(diff["embed_docs"])
+        col.upsert(
+            ids=diff["embed_ids"],
+            embeddings=vecs,
+            documents=diff["embed_docs"],
+            metadatas=diff["embed_metas"],
+        )
+    if diff["meta_ids"]:
+        col.update(ids=diff["meta_ids"], metadatas=diff["meta_metas"])
+    if lexical is not None:
+        lexical.remove(diff["delete_ids"])
+        lexical.upsert(zip(diff["embed_ids"], diff["embed_docs"], diff["embed_metas"]))
+        lexical.update_meta(diff["meta_ids"], diff["meta_metas"])
+    if coarse is not None:
+        coarse.remove(diff["delete_ids"])
+        coarse.upsert(diff["embed_ids"], vecs)
+
+
+def _existing_by_post(col, where: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """读出库里已有 chunk 的 metadata（不取文档/向量），按 post_id 分组"""
+    res = col.get(where=where, include=["metadatas"]) if where else col.get(include=["metadatas"])
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for cid, m in zip(res.get("ids") or [], res.get("metadatas") or []):
+        m = m or {}
+        out.setdefault(str(m.get("post_id") or cid.split(":::")[0]), {})[cid] = m
+    return out
+
+
+def _rollback_reindex(rt, journal: WriteJournal, changed_posts: Set[str]) -> None:
+    """差量 reindex 失败/取消：恢复被改动的 chunks；运行期间可能缓存过半成品，一并失效"""
+    try:
+        n = journal.rollback()
+    except Exception:
+        print(f"[RAG reindex] 回滚失败，请执行一次全量重建: {traceback.format_exc()}")
+        return
+    if n:
+        print(f"[RAG reindex] 已回滚 {n} 个 chunk")
+        rt.answer_cache().invalidate_posts(changed_posts)
+        rt.citation_cache().invalidate_posts(changed_posts)
+
+
+def reindex_posts(
+    cfg: RagConfig,
+    full: bool = False,
+    *,
+    on_progress: Optional[Callable[[str, int], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
+    """
+    重建向量库。
+    - 默认差量：按文章 mtime / 内容 hash 与库中 metadata 比对，只对变化的 chunk 做 embedding，
+      删除已删除文章的 chunks，其余保持不动
+    - full=True：写入新版本的影子 collection，完成后原子切换别名（切换 embedding 模型等情况下使用），
+      重建期间旧版本照常提供检索，旧版本过宽限期后回收。全量模式是原子的：检索要么看到旧版本，要么看到新版本
+    - 差量模式直接写当前 collection（复制一份全库的代价与全量重建相当），写入前记录被改动 chunk 的原状
+      （WriteJournal）；失败或取消时回滚，库恢复为开始前的状态。差量模式只保证“全部生效或全部回滚”，
+      运行期间的检索可能看到部分已更新的文章
+    on_progress / cancel_event 见 ReindexPipeline；on_progress("total", n) 在开始时报告文章总数。
+    """
+    if not cfg.posts_dir.exists():
+        raise RuntimeError(f"未找到文章目录：{cfg.posts_dir}")
+
+    from .runtime import get_runtime
+
+    rt = get_runtime()
+    staging = None
+    if full:
+        client = rt.client()
+        _, staging = _get_collection(
+            cfg, client=client, ef=rt.embedding_function(), name=rt.alias().new_version_name()
+        )
+        col = staging
+        existing: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    else:
+        journal = WriteJournal(rt.collection())
+        col = journal
+        existing = _existing_by_post(journal.col)
+
+    sig = _index_signature(cfg)
+    md_files = _list_post_files(cfg)
+    if on_progress is not None:
+        on_progress("total", len(md_files))
+    seen_posts = set()
+    changed_posts = set()
+    counts = {"fast_skipped": 0, "fast_chunks": 0, "chunks": 0}
+
+    def read_post(md_path: Path) -> Optional[Dict[str, Any]]:
+        post_id = _post_id_for(cfg, md_path)
+        seen_posts.add(post_id)
+        old = existing.get(post_id) or {}
+        # 快路径：mtime 与切分参数都没变，连文件都不用读
+        mtime = md_files[md_path]
+        if old and all(m.get("post_mtime") == mtime and m.get("index_sig") == sig for m in old.values()):
+            counts["fast_skipped"] += len(old)
+            counts["fast_chunks"] += len(old)
+            return None
+        raw = md_path.read_text(encoding="utf-8", errors="ignore")
+        return {"md_path": md_path, "old": old, "raw": raw}
+
+    def chunk_post(item: Dict[str, Any]) -> Dict[str, Any]:
+        post = _build_post_chunks(cfg, item["md_path"], sig, raw=item["raw"])
+        counts["chunks"] += len(post["ids"])
+        diff = _diff_post(post, item["old"])
+        if diff["embed_ids"] or diff["delete_ids"] or diff["meta_ids"]:
+            changed_posts.add(post["post_id"])
+        return diff
+
+    pipeline = ReindexPipeline(
+        col,
+        read_post,
+        chunk_post,
+        rt.embed_documents,
+        embed_batch=cfg.reindex_embed_batch,
+        write_batch=cfg.reindex_write_batch,
+        queue_size=cfg.reindex_queue_size,
+        on_progress=on_progress,
+        cancel_event=cancel_event,
+    )
+    try:
+        result = pipeline.run(list(md_files))
+        result["skipped"] += counts["fast_skipped"]
+
+        # 文章已被删除：清掉对应 chunks
+        removed_posts = [pid for pid in existing if pid not in seen_posts]
+        removed_ids = [cid for pid in removed_posts for cid in existing[pid]]
+        if removed_ids:
+            col.delete(ids=removed_ids)
+            result["deleted"] += len(removed_ids)
+    except BaseException:
+        if staging is not None:
+            try:
+                client.delete_collection(staging.name)
+            except Exception:
+                pass
+        else:
+            _rollback_reindex(rt, journal, changed_posts)
+        raise
+
+    if staging is not None:
+        rt.activate_collection(staging.name)
+        rt.answer_cache().clear()
+        rt.citation_cache().clear()
+    else:
+        # 引用过改动/删除文章的缓存回答、引用详情失效
+        rt.answer_cache().invalidate_posts(changed_posts | set(removed_posts))
+        rt.citation_cache().invalidate_posts(changed_posts | set(removed_posts))
+    # 词法索引与 collection 同步重建（在任务线程里完成，不占用首个查询）
+    if cfg.hybrid_retrieval:
+        rt.rebuild_lexical_index()
+    if cfg.two_stage:
+        rt.rebuild_coarse_index()
+
+    return {
+        "mode": "full" if full else "incremental",
+        "posts": len(md_files),
+        "chunks": counts["chunks"] + counts["fast_chunks"],
+        **result,
+        "posts_removed": len(removed_posts),
+        "persist_dir": str(cfg.persist_dir),
+        "collection": col.name,
+    }
+
+
+def upsert_post(post_path: str) -> Dict[str, Any]:
+    """
+    增量入库：只对单篇文章做 embedding 并写入向量库。
+    - 与库中同一 post_id 的 chunks 按内容 hash 比对，只 embedding 变化的 chunk
+    - 多余的旧 chunks 删除
+    """
+    from .runtime import get_runtime
+
+    rt = get_runtime()
+    cfg = rt.config()
+    p = Path(post_path)
+    if not p.exists():
+        raise RuntimeError(f"文章文件不存在：{p}")
+    if p.suffix.lower() != ".md":
+        raise RuntimeError(f"仅支持 Markdown：{p}")
+
+    col = rt.collection()
+    post = _build_post_chunks(cfg, p, _index_signature(cfg))
+    post_id = post["post_id"]
+    try:
+        # Chroma where 语法要求显式操作符，避免云端版本差异导致解析失败
+        old = _existing_by_post(col, where={"post_id": {"$eq": post_id}}).get(post_id) or {}
+    except Exception:
+        # 不同版本/权限可能不支持 where 查询：退化为全量覆盖本文
+        old = {}
+    diff = _diff_post(post, old)
+    _apply_post_diff(
+        col, diff, rt.embed_documents, lexical=rt.lexical_index(build=False), coarse=rt.coarse_index(build=False)
+    )
+    if diff["embed_ids"] or diff["delete_ids"] or diff["meta_ids"]:
+        rt.answer_cache().invalidate_posts([post_id])
+        rt.citation_cache().invalidate_posts([post_id])
 
     return {
         "post_id": post_id,
-        "title": title,
-        "url": url,
-        "chunks": len(ids),
-        "collection": cfg.collection_name,
+        "title": post["title"],
+        "url": post["url"],
+        "chunks": len(post["ids"]),
+        "added": diff["added"],
+        "updated": diff["updated"],
+        "deleted": diff["deleted"],
+        "skipped": diff["skipped"],
+        "collection": col.name,
         "persist_dir": str(cfg.persist_dir),
     }
 
 
+def _make_hit(doc: Optional[str], meta: Optional[Dict[str, Any]], dist: Optional[float], match: str) -> Dict[str, Any]:
+    m = meta or {}
+    return {
+        "title": m.get("title") or "",
+        "url": m.get("url") or "",
+        "date": m.get("date") or "",
+        "source": m.get("source") or "",
+        "post_id": m.get("post_id") or "",
+        "chunk": m.get("chunk"),
+        "tags": m.get("tags") or "",
+        "categories": m.get("categories") or "",
+        "snippet": (doc or "")[:280],
+        "distance": dist,
+        "content": doc or "",
+        "match": match,  # vector | lexical | hybrid
+    }
+
+
+def _two_stage_query(rt, col, query_vec: List[float], n: int, stage1_k: int) -> Tuple[List, List, List, List]:
+    """
+    粗排：内存里的截断向量索引取 stage1_k 个候选；
+    精排：从向量库取候选的全精度向量重新算 cosine，保留前 n 个。
+    返回与 col.query 单条结果相同结构的 (ids, documents, metadatas, distances)。
+    """
+    cands = [cid for cid, _ in rt.coarse_index().search(query_vec, max(n, stage1_k))]
+    if not cands:
+        return [], [], [], []
+    got = col.get(ids=cands, include=["embeddings", "documents", "metadatas"])
+    got_ids = list(got.get("ids") or [])
+    embs = got.get("embeddings")
+    if embs is None or not got_ids:
+        return [], [], [], []
+    rows = {cid: (doc, meta) for cid, doc, meta in zip(got_ids, got.get("documents") or [], got.get("metadatas") or [])}
+    ranked = rescore(query_vec, got_ids, embs)[: max(1, n)]
+    ids = [cid for cid, _ in ranked]
+    return ids, [rows[c][0] for c in ids], [rows[c][1] for c in ids], [d for _, d in ranked]
+
+
 def retrieve(
     cfg: RagConfig,
     query: str,
@@ -630,39 +1171,91 @@ def retrieve(
     max_distance: Optional[float] = None,
     per_post_max: Optional[int] = None,
 ) -> List[Dict[str, Any]]:
-    _, col = _get_collection(cfg)
+    """检索，只返回命中列表（见 retrieve_with_vector）"""
+    hits, _ = retrieve_with_vector(
+        cfg, query, k, candidate_k=candidate_k, max_distance=max_distance, per_post_max=per_post_max
+    )
+    return hits
+
+
+def retrieve_with_vector(
+    cfg: RagConfig,
+    query: str,
+    k: Optional[int] = None,
+    *,
+    candidate_k: Optional[int] = None,
+    max_distance: Optional[float] = None,
+    per_post_max: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[List[float]]]:
+    """
+    检索：向量召回（Chroma ANN）+ 可选的 BM25 词法召回，RRF 融合。
+    - RAG_HYBRID=0 时与原来一样只走向量
+    - RAG_TWO_STAGE=1 时向量召回改为两阶段：截断向量粗排 RAG_STAGE1_K 个候选，再用全精度向量精排
+    - embedding 接口超时（RAG_EMBED_QUERY_TIMEOUT）或报错时，混合模式下退化为纯词法结果
+    - 词法命中需 BM25 分数 >= RAG_LEXICAL_MIN_SCORE；设置了距离阈值且向量召回一条都没过阈值时，
+      不再用词法结果兜底（问题与博客无关，应走“没找到”的回答）。embedding 超时退化时只看 BM25 分数
+    返回 (命中列表, 问题向量)；问题向量给语义回答缓存复用，embedding 超时/失败时为 None
+    """
+    from .runtime import get_runtime
+
+    rt = get_runtime()
+    col = rt.collection()
     k_final = max(1, int(k if k is not None else cfg.retrieve_k))
     cand = max(k_final, int(candidate_k if candidate_k is not None else cfg.retrieve_candidate_k))
-    res = col.query(query_texts=[query], n_results=max(1, cand))
-    docs = (res.get("documents") or [[]])[0]
-    metas = (res.get("metadatas") or [[]])[0]
-    dists = (res.get("distances") or [[]])[0]
-
     max_d = max_distance if max_distance is not None else cfg.retrieve_max_distance
     per_post = max(1, int(per_post_max if per_post_max is not None else cfg.retrieve_per_post_max))
 
-    out_all: List[Dict[str, Any]] = []
-    for doc, meta, dist in zip(docs, metas, dists):
-        m = meta or {}
-        out_all.append(
-            {
-                "title": m.get("title") or "",
-                "url": m.get("url") or "",
-                "date": m.get("date") or "",
-                "source": m.get("source") or "",
-                "post_id": m.get("post_id") or "",
-                "chunk": m.get("chunk"),
-                "tags": m.get("tags") or "",
-                "categories": m.get("categories") or "",
-                "snippet": (doc or "")[:280],
-                "distance": dist,
-                "content": doc or "",
-            }
-        )
-
-    # 过滤：相似度阈值（Chroma cosine 距离通常越小越相关）
-    if max_d is not None:
-        out_all = [x for x in out_all if (x.get("distance") is not None and float(x["distance"]) <= float(max_d))]
+    vector_hits: Dict[str, Dict[str, Any]] = {}
+    vector_rank: List[str] = []
+    with span("embed"):
+        if cfg.hybrid_retrieval:
+            try:
+                # 查询向量走运行时缓存；超时则本次只用词法结果（后台请求完成后仍会写入缓存）
+                query_vec = rt.embed_query_with_timeout(query, cfg.embed_query_timeout)
+            except Exception as e:
+                print(f"[RAG] 问题 embedding 失败，退化为词法检索: {e}")
+                query_vec = None
+        else:
+            # 查询向量走运行时缓存：重复问题不再请求 embedding 接口
+            query_vec = rt.embed_query(query)
+
+    if query_vec is not None:
+        with span("vector"):
+            if cfg.two_stage:
+                ids, docs, metas, dists = _two_stage_query(rt, col, query_vec, cand, cfg.stage1_k)
+            else:
+                res = col.query(query_embeddings=[query_vec], n_results=max(1, cand))
+                ids = (res.get("ids") or [[]])[0]
+                docs = (res.get("documents") or [[]])[0]
+                metas = (res.get("metadatas") or [[]])[0]
+                dists = (res.get("distances") or [[]])[0]
+            for cid, doc, meta, dist in zip(ids, docs, metas, dists):
+                # 过滤：相似度阈值（Chroma cosine 距离通常越小越相关）
+                if max_d is not None and (dist is None or float(dist) > float(max_d)):
+                    continue
+                vector_hits[cid] = _make_hit(doc, meta, dist, "vector")
+                vector_rank.append(cid)
+
+    if cfg.hybrid_retrieval:
+        with span("lexical"):
+            lexical = rt.lexical_index().search(query, max(cand, cfg.lexical_k))
+        lexical = [x for x in lexical if x[1] >= cfg.lexical_min_score]
+        if query_vec is not None and max_d is not None and not vector_hits:
+            lexical = []
+        lexical_rank = [cid for cid, _, _, _ in lexical]
+        lexical_hits = {cid: (doc, meta) for cid, _, doc, meta in lexical}
+        out_all = []
+        for cid, _ in rrf_fuse([vector_rank, lexical_rank], k=cfg.rrf_k):
+            if cid in vector_hits:
+                hit = vector_hits[cid]
+                if cid in lexical_hits:
+                    hit["match"] = "hybrid"
+            else:
+                doc, meta = lexical_hits[cid]
+                hit = _make_hit(doc, meta, None, "lexical")
+            out_all.append(hit)
+    else:
+        out_all = [vector_hits[cid] for cid in vector_rank]
 
     # 去重/分散：同一文章最多取 per_post 条
     picked: List[Dict[str, Any]] = []
@@ -677,43 +1270,53 @@ def retrieve(
         if len(picked) >= k_final:
             break
 
-    return picked
+    return picked, query_vec
 
 
-def get_citation_detail(post_id: str, chunk: int) -> Dict[str, Any]:
+def get_citation_details(items: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
     """
-    按需获取引用详情（避免首次 chat 就下发 snippet）。
+    批量获取引用详情（按需下发 snippet，避免首次 chat 就带上）。
+    chunk id 是确定的：直接按 id 一次读取未缓存的条目，结果进 LRU。
     """
-    cfg = load_rag_config()
-    if not post_id:
-        raise RuntimeError("post_id 不能为空")
-    try:
-        chunk_i = int(chunk)
-    except Exception:
-        raise RuntimeError("chunk 必须是整数")
-
-    _, col = _get_collection(cfg)
-    # Chroma where 语法：多条件用 $and 组合
-    res = col.get(
-        where={
-            "$and": [
-                {"post_id": {"$eq": post_id}},
-                {"chunk": {"$eq": chunk_i}},
-            ]
-        }
-    )
-    docs = res.get("documents") or []
-    metas = res.get("metadatas") or []
+    from .runtime import get_runtime
 
-    doc = docs[0] if docs else ""
-    meta = metas[0] if metas else {}
-    meta = meta or {}
+    rt = get_runtime()
+    keys: List[Tuple[str, int]] = []
+    for post_id, chunk in items:
+        if not post_id:
+            raise RuntimeError("post_id 不能为空")
+        try:
+            keys.append((str(post_id), int(chunk)))
+        except Exception:
+            raise RuntimeError("chunk 必须是整数")
+
+    col = rt.collection()
+    cache = rt.citation_cache()
+    ckeys = [(col.name, pid, ci) for pid, ci in keys]
+    found = cache.get_many(dict.fromkeys(ckeys))
+    missing = [k for k in dict.fromkeys(ckeys) if k not in found]
+    if missing:
+        res = col.get(ids=[f"{pid}:::{ci}" for _, pid, ci in missing], include=["documents", "metadatas"])
+        by_id = {
+            cid: (doc, meta or {})
+            for cid, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or [])
+        }
+        fetched = {}
+        for key in missing:
+            _, pid, ci = key
+            doc, meta = by_id.get(f"{pid}:::{ci}", ("", {}))
+            fetched[key] = {
+                "post_id": pid,
+                "chunk": ci,
+                "title": meta.get("title") or "",
+                "url": meta.get("url") or "",
+                "snippet": (doc or "")[:600],
+            }
+        cache.put_many({k: v for k, v in fetched.items() if by_id.get(f"{k[1]}:::{k[2]}")})
+        found.update(fetched)
+    return [found[k] for k in ckeys]
 
-    return {
-        "post_id": post_id,
-        "chunk": chunk_i,
-        "title": meta.get("title") or "",
-        "url": meta.get("url") or "",
-        "snippet": (doc or "")[:600],
-    }
 
+def get_citation_detail(post_id: str, chunk: int) -> Dict[str, Any]:
+    """单条引用详情（见 get_citation_details）"""
+    return get_citation_details([(post_id, chunk)])[0]
@@ -0,0 +1,390 @@
+"""
+RAG 运行时：进程内常驻的 config / Chroma client / collection / embedding function。
+
+以前每次请求都会 load_rag_config()（重读两个 .env + _config.yml）并新建 PersistentClient 与
+embedding function；在 2C2G 机器上这部分是首 token 延迟的大头。现在：
+- 每个进程只构建一次，waitress 多线程共享，构建过程加锁
+- 仅当配置文件 mtime 变化时才热重载
+- 同一批 chunk 的 BM25 词法索引（lexical.py）与两阶段检索的截断向量索引（coarse.py）
+  也常驻在这里，与当前 collection 绑定
+- collection 通过别名指针（alias.py）定位：全量重建完成后 activate_collection() 原子切换，
+  旧版本过宽限期后回收；collection 被外部删除/重建时调用 invalidate_runtime()
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+
+from .alias import CollectionAlias
+from .answer_cache import AnswerCache
+from .citation_cache import CitationCache
+from .batcher import QueryBatcher
+from .coarse import CoarseIndex
+from .embed_cache import QueryEmbeddingCache
+from .embed_store import EmbeddingStore
+from .lexical import Bm25Index
+from .vector_store import iter_embeddings, open_vector_client
+from .rag_store import (
+    RagConfig,
+    _build_embedding_function,
+    _get_collection,
+    config_source_paths,
+    embed_namespace,
+    load_rag_config,
+)
+
+
+def _snapshot_mtimes() -> Tuple[Optional[float], ...]:
+    out = []
+    for p in config_source_paths():
+        try:
+            out.append(p.stat().st_mtime)
+        except OSError:
+            out.append(None)  # 文件不存在也是一种状态（新建 .env 时同样触发重载）
+    return tuple(out)
+
+
+class RagRuntime:
+    """
+    长生命周期的 RAG 资源持有者（线程安全）。
+    - config()：当前配置；配置文件 mtime 变化时自动重载，并丢弃依赖旧配置的 client/collection
+    - client() / embedding_function() / collection()：懒加载，构建后复用
+    - invalidate()：丢弃 collection 句柄（collection 被删除/重建后必须调用）
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._config: Optional[RagConfig] = None
+        self._mtimes: Optional[Tuple[Optional[float], ...]] = None
+        self._client = None
+        self._ef = None
+        self._collection = None
+        self._collection_name: Optional[str] = None
+        self._alias: Optional[CollectionAlias] = None
+        self._gc_timer: Optional[threading.Timer] = None
+        self._query_cache: Optional[QueryEmbeddingCache] = None
+        self._query_cache_key = None
+        self._embed_store: Optional[EmbeddingStore] = None
+        self._embed_store_key = None
+        self._answer_cache: Optional[AnswerCache] = None
+        self._citation_cache: Optional[CitationCache] = None
+        self._batcher: Optional[QueryBatcher] = None
+        self._batcher_key = None
+        self._lexical: Optional[Bm25Index] = None
+        self._lexical_name: Optional[str] = None
+        self._lexical_lock = threading.Lock()
+        self._coarse: Optional[CoarseIndex] = None
+        self._coarse_key: Optional[Tuple[str, int, str]] = None
+        self._coarse_lock = threading.Lock()
+        self._query_pool: Optional[ThreadPoolExecutor] = None
+        self._loads = 0
+
+    def _refresh_locked(self) -> None:
+        mtimes = _snapshot_mtimes()
+        if self._config is not None and mtimes == self._mtimes:
+            return
+        # 首次加载保持原语义（进程环境变量优先）；之后的热重载以 .env 为准
+        cfg = load_rag_config(override_env=self._config is not None)
+        if (
+            self._config is None
+            or cfg.persist_dir != self._config.persist_dir
+            or cfg.vector_backend != self._config.vector_backend
+        ):
+            self._client = None
+        self._config = cfg
+        self._mtimes = mtimes
+        self._ef = None
+        self._collection = None
+        # 两种向量后端的 collection 互不相通，各用一个指针文件
+        pointer = "active_collection.json" if cfg.vector_backend == "chroma" else f"active_collection.{cfg.vector_backend}.json"
+        self._alias = CollectionAlias(cfg.persist_dir.parent / pointer, cfg.collection_name)
+        self._loads += 1
+
+    def config(self) -> RagConfig:
+        # 快路径：mtime 未变化时不加锁（只做几次 stat）
+        cfg = self._config
+        if cfg is not None and _snapshot_mtimes() == self._mtimes:
+            return cfg
+        with self._lock:
+            self._refresh_locked()
+            return self._config
+
+    def client(self):
+        self.config()
+        with self._lock:
+            if self._client is None:
+                self._client = open_vector_client(self._config)
+            return self._client
+
+    def embedding_function(self):
+        self.config()
+        with self._lock:
+            if self._ef is None:
+                self._ef = _build_embedding_function(self._config)
+            return self._ef
+
+    def alias(self) -> CollectionAlias:
+        self.config()
+        return self._alias
+
+    def collection(self):
+        """当前别名指向的 collection；指针被切换后自动换成新版本的句柄"""
+        cfg = self.config()
+        name = self._alias.active_name()
+        col = self._collection
+        if col is not None and self._collection_name == name:
+            return col
+        client = self.client()
+        ef = self.embedding_function()
+        with self._lock:
+            if self._collection is None or self._collection_name != name:
+                _, self._collection = _get_collection(cfg, client=client, ef=ef, name=name)
+                self._collection_name = name
+            return self._collection
+
+    def activate_collection(self, name: str) -> str:
+        """
+        蓝绿切换：把别名指向新建好的 collection，旧版本在宽限期后回收。
+        返回被替换下来的旧名字。
+        """
+        cfg = self.config()
+        old = self._alias.swap(name)
+        self.invalidate()
+        self.schedule_gc(cfg.collection_gc_grace)
+        return old
+
+    def gc_collections(self) -> List[str]:
+        cfg = self.config()
+        return self._alias.gc(self.client(), cfg.collection_gc_grace)
+
+    def schedule_gc(self, delay_seconds: float) -> None:
+        with self._lock:
+            if self._gc_timer is not None:
+                self._gc_timer.cancel()
+            # 多等 1 秒，确保到点时最新一批退役版本也已过宽限期
+            self._gc_timer = threading.Timer(max(0.0, delay_seconds) + 1, self._gc_quietly)
+            self._gc_timer.daemon = True
+            self._gc_timer.start()
+
+    def _gc_quietly(self) -> None:
+        try:
+            dropped = self.gc_collections()
+            if dropped:
+                print(f"[RAG] 已回收旧版本 collection: {', '.join(dropped)}")
+        except Exception as e:
+            print(f"[RAG] 回收旧版本 collection 失败: {e}")
+
+    def query_cache(self) -> QueryEmbeddingCache:
+        cfg = self.config()
+        key = (cfg.persist_dir, cfg.query_cache_size, cfg.query_cache_ttl, cfg.query_cache_disk_max)
+        with self._lock:
+            if self._query_cache is None or self._query_cache_key != key:
+                self._query_cache = QueryEmbeddingCache(
+                    cfg.persist_dir.parent / "query_cache.sqlite3",
+                    max_items=cfg.query_cache_size,
+                    ttl_seconds=cfg.query_cache_ttl,
+                    disk_max_items=cfg.query_cache_disk_max,
+                )
+                self._query_cache_key = key
+            return self._query_cache
+
+    def embed_query(self, text: str) -> List[float]:
+        """问题向量：先查两级缓存，未命中才请求 embedding 接口"""
+        cfg = self.config()
+        cache = self.query_cache()
+        ns = embed_namespace(cfg)
+        vec = cache.get(ns, text)
+        if vec is None:
+            # 未命中的问题经微批合并后再请求接口（并发请求共享一次往返）
+            vec = self.query_batcher().embed(text)
+            cache.put(ns, text, vec)
+        return vec
+
+    def query_batcher(self) -> QueryBatcher:
+        cfg = self.config()
+        ef = self.embedding_function()
+        key = (id(ef), cfg.embed_batch_window_ms, cfg.embed_batch_max)
+        with self._lock:
+            if self._batcher is None or self._batcher_key != key:
+                self._batcher = QueryBatcher(ef, window_ms=cfg.embed_batch_window_ms, max_batch=cfg.embed_batch_max)
+                self._batcher_key = key
+            return self._batcher
+
+    def answer_cache(self) -> AnswerCache:
+        cfg = self.config()
+        with self._lock:
+            c = self._answer_cache
+            if c is None:
+                c = self._answer_cache = AnswerCache(
+                    max_items=cfg.answer_cache_size,
+                    ttl_seconds=cfg.answer_cache_ttl,
+                    threshold=cfg.answer_cache_threshold,
+                )
+            else:
+                # 热重载时就地调整参数，已缓存的回答保留
+                c.max_items = max(0, cfg.answer_cache_size)
+                c.ttl_seconds = max(0, cfg.answer_cache_ttl)
+                c.threshold = cfg.answer_cache_threshold
+            return c
+
+    def citation_cache(self) -> CitationCache:
+        cfg = self.config()
+        with self._lock:
+            c = self._citation_cache
+            if c is None:
+                c = self._citation_cache = CitationCache(cfg.citation_cache_size)
+            else:
+                c.max_items = max(0, cfg.citation_cache_size)
+            return c
+
+    def embed_query_with_timeout(self, text: str, timeout: float) -> Optional[List[float]]:
+        """
+        与 embed_query 相同，但最多等待 timeout 秒；超时返回 None（调用方退化为词法检索）。
+        超时的请求仍在后台完成并写入缓存，下一次同样的问题直接命中。
+        """
+        if timeout is None or timeout <= 0:
+            return self.embed_query(text)
+        with self._lock:
+            if self._query_pool is None:
+                self._query_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-query-embed")
+            pool = self._query_pool
+        fut = pool.submit(self.embed_query, text)
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeoutError:
+            return None
+
+    def _load_lexical_index(self, name: str) -> Bm25Index:
+        col = self.collection()
+        got = col.get(include=["documents", "metadatas"])
+        index = Bm25Index()
+        index.build(zip(got.get("ids") or [], got.get("documents") or [], got.get("metadatas") or []))
+        print(
+            f"[RAG] BM25 索引已构建: {name} docs={index.stats()['docs']} "
+            f"terms={index.stats()['terms']} {index.build_seconds * 1000:.0f}ms"
+        )
+        return index
+
+    def lexical_index(self, build: bool = True) -> Optional[Bm25Index]:
+        """
+        当前 collection 的 BM25 索引；首次访问时从 Chroma 读出全部 chunk 构建。
+        build=False 时只返回已构建的索引（没有则 None），用于增量同步。
+        """
+        self.config()
+        name = self._alias.active_name()
+        index = self._lexical
+        if index is not None and self._lexical_name == name:
+            return index
+        if not build:
+            return None
+        # 单独的锁：构建可能要几秒，不能挡住 config()/collection() 的其它调用方
+        with self._lexical_lock:
+            if self._lexical is None or self._lexical_name != name:
+                self._lexical = self._load_lexical_index(name)
+                self._lexical_name = name
+            return self._lexical
+
+    def rebuild_lexical_index(self) -> Bm25Index:
+        """reindex 完成后调用：按当前 collection 重新构建词法索引"""
+        self.config()
+        name = self._alias.active_name()
+        with self._lexical_lock:
+            self._lexical = self._load_lexical_index(name)
+            self._lexical_name = name
+            return self._lexical
+
+    def _load_coarse_index(self, name: str, cfg: RagConfig) -> CoarseIndex:
+        index = CoarseIndex(dim=cfg.stage1_dim, quant=cfg.stage1_quant)
+        # 按批读取：不把整库全精度向量一次性搬进内存（numpy 后端读完即解除映射）
+        index.build_batches(iter_embeddings(self.collection()))
+        st = index.stats()
+        print(
+            f"[RAG] 粗排索引已构建: {name} docs={st['docs']} dim={st['dim']}/{st['full_dim']} "
+            f"quant={st['quant']} {st['index_bytes'] / 1024:.0f}KB {index.build_seconds * 1000:.0f}ms"
+        )
+        return index
+
+    def coarse_index(self, build: bool = True) -> Optional[CoarseIndex]:
+        """
+        两阶段检索的截断向量索引；首次访问时从向量库按批读出全部向量构建。
+        build=False 时只返回已构建的索引（没有则 None），用于增量同步。
+        """
+        cfg = self.config()
+        key = (self._alias.active_name(), cfg.stage1_dim, cfg.stage1_quant)
+        index = self._coarse
+        if index is not None and self._coarse_key == key:
+            return index
+        if not build:
+            return None
+        with self._coarse_lock:
+            if self._coarse is None or self._coarse_key != key:
+                self._coarse = self._load_coarse_index(key[0], cfg)
+                self._coarse_key = key
+            return self._coarse
+
+    def rebuild_coarse_index(self) -> CoarseIndex:
+        """reindex 完成后调用：按当前 collection 重新构建截断向量索引"""
+        cfg = self.config()
+        key = (self._alias.active_name(), cfg.stage1_dim, cfg.stage1_quant)
+        with self._coarse_lock:
+            self._coarse = self._load_coarse_index(key[0], cfg)
+            self._coarse_key = key
+            return self._coarse
+
+    def embed_store(self) -> EmbeddingStore:
+        cfg = self.config()
+        # 与 query_cache 一样按配置签名重建：.env 改了 RAG_EMBED_STORE_MAX 后热重载生效
+        key = (cfg.persist_dir, cfg.embed_store_max)
+        with self._lock:
+            if self._embed_store is None or self._embed_store_key != key:
+                self._embed_store = EmbeddingStore(
+                    cfg.persist_dir.parent / "embeddings.sqlite3", max_items=cfg.embed_store_max
+                )
+                self._embed_store_key = key
+            return self._embed_store
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """文档向量：先查内容寻址仓库，只对新文本请求 embedding 接口"""
+        cfg = self.config()
+        return self.embed_store().embed(embed_namespace(cfg), texts, self.embedding_function())
+
+    def invalidate(self, reload_config: bool = False) -> None:
+        with self._lock:
+            self._collection = None
+            if reload_config:
+                self._mtimes = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "config_loads": self._loads,
+            "vector_backend": self._config.vector_backend if self._config is not None else None,
+            "collection_open": self._collection is not None,
+            "collections": self._alias.snapshot() if self._alias is not None else None,
+            "query_cache": self._query_cache.stats() if self._query_cache is not None else None,
+            "embed_store": self._embed_store.stats() if self._embed_store is not None else None,
+            "answer_cache": self._answer_cache.stats() if self._answer_cache is not None else None,
+            "citation_cache": self._citation_cache.stats() if self._citation_cache is not None else None,
+            "embed_requests": getattr(self._ef, "requests_sent", None),
+            "embed_retries": getattr(self._ef, "retries", None),
+            "query_batcher": self._batcher.stats() if self._batcher is not None else None,
+            "lexical_index": self._lexical.stats() if self._lexical is not None else None,
+            "coarse_index": self._coarse.stats() if self._coarse is not None else None,
+        }
+
+
+_runtime: Optional[RagRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> RagRuntime:
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = RagRuntime()
+    return _runtime
+
+
+def invalidate_runtime(reload_config: bool = False) -> None:
+    """collection 被删除/重建后调用：下次访问时重新打开 collection"""
+    get_runtime().invalidate(reload_config=reload_config)
@@ -0,0 +1,234 @@
+"""
+相同问题的并发合并（single-flight）。
+
+文章被转发时，同一时刻会涌进大量相同的问题，每个请求各自做一次 embedding、各开一条大模型流。
+这里按归一化后的问题合并：第一个请求启动一个后台生产者（检索 + 上游流式生成），
+把产生的事件写进共享缓冲；之后到达的相同问题直接订阅这条缓冲——
+先拿到已经产生的事件，再继续接收实时事件。N 个并发的相同问题只消耗一次上游调用。
+
+生产者跑在独立线程里：发起请求的客户端先断开，不影响仍在等待的其他订阅者；
+所有订阅者都离开后，生产者在下一个事件处停止（不再消耗 token）。
+
+订阅时可传入 coalescer（见 sse.py）：有新事件后最多再等 coalescer.window 秒凑一批，
+由 coalescer.merge 合并后再交给订阅者（每个订阅者各自合并，互不影响）。
+
+AsyncFlightGroup 是同样语义的 asyncio 版本，供异步网关（gateway.py）使用：
+生产者是事件循环里的一个 task，订阅者等待时不占线程。
+"""
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Set
+
+
+class Flight:
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.events: List[Any] = []
+        self.finished = False
+        self.subscribers = 0
+        self.started_at = time.time()
+        self._cond = threading.Condition()
+
+    def publish(self, event: Any) -> None:
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self) -> None:
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def abandoned(self) -> bool:
+        return self.subscribers <= 0
+
+    def attach(self, coalescer=None) -> Iterator[Any]:
+        """立即登记为订阅者（不等迭代开始），返回事件迭代器"""
+        with self._cond:
+            self.subscribers += 1
+        return self._follow(coalescer)
+
+    def _follow(self, coalescer=None, poll_seconds: float = 15.0) -> Iterator[Any]:
+        """先回放已有事件，再跟随实时事件，直到生产者结束"""
+        pos = 0
+        try:
+            while True:
+                with self._cond:
+                    while pos >= len(self.events) and not self.finished:
+                        self._cond.wait(poll_seconds)
+                    if coalescer is not None and coalescer.window > 0:
+                        # 攒批：直到超时 / 生产者结束 / coalescer 认为该立即下发（非 content 事件、字节数够了）
+                        deadline = time.monotonic() + coalescer.window
+                        while not self.finished and coalescer.hold(self.events[pos:]):
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self._cond.wait(remaining)
+                    batch = self.events[pos:]
+                    pos = len(self.events)
+                    done = self.finished and pos >= len(self.events)
+                if coalescer is not None:
+                    batch = coalescer.merge(batch)
+                for event in batch:
+                    yield event
+                if done:
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class FlightGroup:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def _run(self, flight: Flight, produce: Callable[[], Iterator[Any]]) -> None:
+        gen = produce()
+        try:
+            for event in gen:
+                flight.publish(event)
+                if flight.abandoned():
+                    break
+        finally:
+            gen.close()
+            # 先从登记表摘除再标记结束：结束之后到达的请求会开启新的一轮
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            flight.finish()
+
+    def subscribe(self, key: str, produce: Callable[[], Iterator[Any]], coalescer=None) -> Iterator[Any]:
+        """
+        key 相同的并发调用共享同一次 produce()；返回事件迭代器。
+        produce 的异常需自行转换成事件（这里只负责搬运）。
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = Flight(key)
+                self._flights[key] = flight
+                self.started += 1
+                leader = True
+            else:
+                self.joined += 1
+                leader = False
+            # 在锁内登记订阅：生产者不会在"已找到、未登记"的间隙判定无人订阅而退出
+            events = flight.attach(coalescer)
+        if leader:
+            threading.Thread(target=self._run, args=(flight, produce), name="chat-flight", daemon=True).start()
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "subscribers": sum(f.subscribers for f in self._flights.values()),
+                "started": self.started,
+                "joined": self.joined,
+            }
+
+
+class AsyncFlight:
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.events: List[Any] = []
+        self.finished = False
+        self.subscribers = 0
+        self.started_at = time.time()
+        self._cond = asyncio.Condition()
+
+    async def publish(self, event: Any) -> None:
+        async with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    async def finish(self) -> None:
+        async with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def abandoned(self) -> bool:
+        return self.subscribers <= 0
+
+    def attach(self, coalescer=None) -> AsyncIterator[Any]:
+        # 单线程事件循环里计数不需要加锁
+        self.subscribers += 1
+        return self._follow(coalescer)
+
+    async def _follow(self, coalescer=None) -> AsyncIterator[Any]:
+        pos = 0
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                async with self._cond:
+                    while pos >= len(self.events) and not self.finished:
+                        await self._cond.wait()
+                    if coalescer is not None and coalescer.window > 0:
+                        deadline = loop.time() + coalescer.window
+                        while not self.finished and coalescer.hold(self.events[pos:]):
+                            remaining = deadline - loop.time()
+                            if remaining <= 0:
+                                break
+                            try:
+                                await asyncio.wait_for(self._cond.wait(), remaining)
+                            except asyncio.TimeoutError:
+                                break
+                    batch = self.events[pos:]
+                    pos = len(self.events)
+                    done = self.finished and pos >= len(self.events)
+                if coalescer is not None:
+                    batch = coalescer.merge(batch)
+                for event in batch:
+                    yield event
+                if done:
+                    return
+        finally:
+            self.subscribers -= 1
+
+
+class AsyncFlightGroup:
+    def __init__(self) -> None:
+        self._flights: Dict[str, AsyncFlight] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.started = 0
+        self.joined = 0
+
+    async def _run(self, flight: AsyncFlight, produce: Callable[[], AsyncIterator[Any]]) -> None:
+        gen = produce()
+        try:
+            async for event in gen:
+                await flight.publish(event)
+                if flight.abandoned():
+                    break
+        finally:
+            await gen.aclose()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            await flight.finish()
+
+    def subscribe(self, key: str, produce: Callable[[], AsyncIterator[Any]], coalescer=None) -> AsyncIterator[Any]:
+        """语义同 FlightGroup.subscribe；produce 返回异步生成器，必须在事件循环里调用"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = AsyncFlight(key)
+            self._flights[key] = flight
+            self.started += 1
+            task = asyncio.get_running_loop().create_task(self._run(flight, produce))
+            # 事件循环只持有 task 的弱引用，这里保留到结束
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.joined += 1
+        return flight.attach(coalescer)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+            "started": self.started,
+            "joined": self.joined,
+        }
@@ -0,0 +1,141 @@
+"""
+问答流水线的分阶段耗时统计。
+
+一次看板娘回答慢，可能慢在加载配置、问题 embedding、向量库查询、拼上下文、大模型首 token，
+也可能慢在 token 流本身；以前只能靠逐 chunk 的 print 猜。这里：
+- Trace：一次问答的各阶段耗时（span），通过 contextvars 传递，rag_store.retrieve 里的子阶段自动挂到当前 Trace
+- 结果可作为 SSE `timing` 事件 / `Server-Timing` 响应头下发
+- StageStats：每个阶段保留最近 RAG_TIMING_WINDOW 个样本，给出滚动 p50/p95/p99
+- chat_logger：替代 print 的 logging，级别由 RAG_LOG_LEVEL 控制，逐 chunk 日志按 RAG_LOG_CHUNK_EVERY 抽样
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional
+
+chat_logger = logging.getLogger("rag_bot.chat")
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("rag_trace", default=None)
+
+
+class Trace:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}  # 阶段 -> 毫秒（同名阶段累加），按首次出现顺序
+
+    def add(self, name: str, ms: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + ms
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def snapshot(self, total: bool = True) -> Dict[str, float]:
+        out = {k: round(v, 1) for k, v in self.spans.items()}
+        if total:
+            out["total"] = round(self.total_ms(), 1)
+        return out
+
+
+def begin_trace() -> Trace:
+    """为当前上下文（线程 / 生成器所在线程）开启一个 Trace"""
+    trace = Trace()
+    _current.set(trace)
+    return trace
+
+
+def end_trace() -> None:
+    _current.set(None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """当前没有 Trace 时什么也不做（调试接口、bench 脚本直接调用 retrieve 的情况）"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def server_timing(spans: Dict[str, float]) -> str:
+    """Server-Timing 响应头：embed;dur=12.3, vector;dur=4.0, ..."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in spans.items())
+
+
+class StageStats:
+    def __init__(self, window: int = 1000) -> None:
+        self.window = max(1, int(window))
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self.requests = 0
+
+    def resize(self, window: int) -> None:
+        window = max(1, int(window))
+        with self._lock:
+            if window != self.window:
+                self.window = window
+                self._samples = {k: deque(v, maxlen=window) for k, v in self._samples.items()}
+
+    def record(self, spans: Dict[str, float]) -> None:
+        with self._lock:
+            self.requests += 1
+            for name, ms in spans.items():
+                q = self._samples.get(name)
+                if q is None:
+                    q = self._samples[name] = deque(maxlen=self.window)
+                q.append(float(ms))
+
+    @staticmethod
+    def _pct(sorted_vals, p: float) -> float:
+        return sorted_vals[min(len(sorted_vals) - 1, max(0, int(round(len(sorted_vals) * p)) - 1))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self._samples.items()}
+            requests = self.requests
+        return {
+            "window": self.window,
+            "requests": requests,
+            "stages": {
+                name: {
+                    "count": len(vals),
+                    "p50_ms": round(self._pct(vals, 0.50), 1),
+                    "p95_ms": round(self._pct(vals, 0.95), 1),
+                    "p99_ms": round(self._pct(vals, 0.99), 1),
+                    "max_ms": round(vals[-1], 1),
+                }
+                for name, vals in samples.items() if vals
+            },
+        }
+
+
+stage_stats = StageStats()
+
+_log_configured_level: Optional[str] = None
+
+
+def configure_chat_logging(level: str) -> None:
+    """按 RAG_LOG_LEVEL 设置日志级别；应用没有配置 logging 时给 rag_bot 挂一个控制台 handler"""
+    global _log_configured_level
+    level = (level or "INFO").upper()
+    if level == _log_configured_level:
+        return
+    _log_configured_level = level
+    root = logging.getLogger("rag_bot")
+    root.setLevel(getattr(logging, level, logging.INFO))
+    if not root.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("[%(name)s] %(levelname)s %(message)s"))
+        root.addHandler(handler)
@@ -0,0 +1,538 @@
+"""
+向量库后端：Chroma（默认）或 NumPy 平铺矩阵（RAG_VECTOR_BACKEND=numpy）。
+
+博客的 chunk 最多几千条，精确暴力检索一次矩阵乘法就够了；而 chromadb 每个进程都要付出
+import 时间、SQLite + HNSW 持久化和常驻内存的代价。这里实现一个与 Chroma collection
+接口兼容（get / query / add / upsert / update / delete / count）的轻量后端：
+- 向量：连续的 float32/float16 矩阵，存为 .npy，以内存映射（mmap）方式打开，已单位化，
+  cosine 相似度 = 一次矩阵乘法 + argpartition 取 top-k
+- 文档 / metadata：旁路 SQLite 表（meta.sqlite3），where 条件翻译成 json_extract
+- 写入：追加到增量段 delta.<gen>.vec（float32 原始字节）/ delta.<gen>.log（每行一个 put/del 操作），
+  被覆盖或删除的旧行只记墓碑，最后原子改写 manifest.json（记录增量段的有效字节数）；
+  每批写入的开销与批大小成正比，不再复制整个矩阵
+- 合并（compaction）：增量行 + 墓碑超过 base 的 COMPACT_RATIO（至少 COMPACT_MIN 行）时，
+  把存活的行写成新一代 vectors.<gen>.npy / ids.<gen>.json；读者按 manifest mtime 切换
+  （Windows 上被 mmap 的文件不能覆盖，所以不原地改写）
+
+rag_store / runtime 通过 open_vector_client(cfg) 取得 client，上层代码不感知后端差异。
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_SQL_OPS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _where_sql(where: Dict[str, Any], params: List[Any]) -> str:
+    """Chroma where 语法（$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$and/$or）-> SQL 条件"""
+    parts = []
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            subs = [_where_sql(c, params) for c in cond]
+            parts.append("(" + (" AND " if key == "$and" else " OR ").join(subs or ["1=1"]) + ")")
+            continue
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        field = f"json_extract(metadata, '$.{key}')"
+        for op, val in cond.items():
+            if op in _SQL_OPS:
+                parts.append(f"{field} {_SQL_OPS[op]} ?")
+                params.append(val)
+            elif op in ("$in", "$nin"):
+                vals = list(val) or [None]
+                parts.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({','.join('?' * len(vals))})")
+                params.extend(vals)
+            else:
+                raise ValueError(f"不支持的 where 操作符：{op}")
+    return " AND ".join(parts) or "1=1"
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+class _Segments:
+    """
+    某一时刻的只读快照：base 段（.npy 内存映射）+ delta 段（增量追加的行）+ 存活标记。
+    全局行号：base 在前（0..B-1），delta 接在后面；pos 只含存活的 id。写入时生成新对象整体替换，读者无需加锁。
+    """
+
+    __slots__ = ("gen", "base", "base_ids", "delta", "delta_ids", "alive", "pos", "live", "vec_bytes", "log_bytes")
+
+    def __init__(self, gen: int, base: Optional[np.ndarray], base_ids: List[str]) -> None:
+        self.gen = gen
+        self.base = base
+        self.base_ids = base_ids
+        self.delta: Optional[np.ndarray] = None
+        self.delta_ids: List[str] = []
+        self.alive = np.ones(len(base_ids), dtype=bool)
+        self.pos = {cid: i for i, cid in enumerate(base_ids)}
+        self.live = np.arange(len(base_ids), dtype=np.int64)
+        # 已应用的增量段字节数（与 manifest 对比，读取其它进程追加的部分）
+        self.vec_bytes = 0
+        self.log_bytes = 0
+
+    @property
+    def dim(self) -> Optional[int]:
+        if self.base is not None:
+            return int(self.base.shape[1])
+        if self.delta is not None:
+            return int(self.delta.shape[1])
+        return None
+
+    @property
+    def dead(self) -> int:
+        return len(self.alive) - len(self.live)
+
+    def row_id(self, row: int) -> str:
+        n = len(self.base_ids)
+        return self.base_ids[row] if row < n else self.delta_ids[row - n]
+
+    def vector(self, row: int) -> np.ndarray:
+        n = len(self.base_ids)
+        return self.base[row] if row < n else self.delta[row - n]
+
+    def rows(self, rows: np.ndarray) -> np.ndarray:
+        """按全局行号取向量（rows 升序），返回 float32 矩阵"""
+        n = len(self.base_ids)
+        parts = []
+        if self.base is not None and len(rows) and rows[0] < n:
+            parts.append(np.asarray(self.base[rows[rows < n]], dtype=np.float32))
+        if self.delta is not None and len(rows) and rows[-1] >= n:
+            parts.append(self.delta[rows[rows >= n] - n])
+        return np.vstack(parts)
+
+    def extended(self, ops: List[Tuple[str, str]], vecs: np.ndarray, vec_bytes: int, log_bytes: int) -> "_Segments":
+        """应用一批增量操作（put 依次对应 vecs 的各行），返回新快照；只复制 delta 段与行标记"""
+        out = _Segments.__new__(_Segments)
+        out.gen, out.base, out.base_ids = self.gen, self.base, self.base_ids
+        out.delta = self.delta
+        if len(vecs):
+            out.delta = vecs if self.delta is None else np.vstack([self.delta, vecs])
+        out.delta_ids = list(self.delta_ids)
+        out.alive = np.concatenate([self.alive, np.ones(len(vecs), dtype=bool)])
+        out.pos = dict(self.pos)
+        row = len(self.alive)
+        for op, cid in ops:
+            old = out.pos.pop(cid, None)
+            if old is not None:
+                out.alive[old] = False
+            if op == "put":
+                out.pos[cid] = row
+                out.delta_ids.append(cid)
+                row += 1
+        out.live = np.flatnonzero(out.alive)
+        out.vec_bytes, out.log_bytes = vec_bytes, log_bytes
+        return out
+
+
+class FlatVectorCollection:
+    # 增量行 + 墓碑达到 base 行数的这个比例（且至少 COMPACT_MIN 行）时合并成新一代
+    COMPACT_RATIO = 0.25
+    COMPACT_MIN = 512
+
+    def __init__(self, root: Path, name: str, dtype: str = "float32") -> None:
+        self.name = name
+        self.root = root
+        self.dtype = np.float16 if dtype == "float16" else np.float32
+        self._write_lock = threading.RLock()  # 写入过程中会重新读取快照
+        self._db_lock = threading.Lock()
+        self._snap = _Segments(0, None, [])
+        self._manifest_mtime: Optional[int] = None
+        root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(root / "meta.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, document TEXT, metadata TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    # ---------- 快照 / 持久化 ----------
+    def _manifest_path(self) -> Path:
+        return self.root / "manifest.json"
+
+    def _delta_paths(self, gen: int) -> Tuple[Path, Path]:
+        return self.root / f"delta.{gen}.vec", self.root / f"delta.{gen}.log"
+
+    def _snapshot(self) -> _Segments:
+        """返回最新快照；manifest 被（其它进程）改写过则重新 mmap base / 读入新追加的增量"""
+        try:
+            mtime = self._manifest_path().stat().st_mtime_ns
+        except OSError:
+            return self._snap
+        if mtime != self._manifest_mtime:
+            with self._write_lock:
+                if mtime != self._manifest_mtime:
+                    manifest = json.loads(self._manifest_path().read_text(encoding="utf-8"))
+                    gen = int(manifest["gen"])
+                    vec_bytes = int(manifest.get("delta_vec_bytes") or 0)
+                    log_bytes = int(manifest.get("delta_log_bytes") or 0)
+                    snap = self._snap
+                    if gen != snap.gen or vec_bytes < snap.vec_bytes or log_bytes < snap.log_bytes:
+                        # 第 0 代还没有合并过：只有增量段
+                        ids_path = self.root / f"ids.{gen}.json"
+                        ids = json.loads(ids_path.read_text(encoding="utf-8")) if ids_path.exists() else []
+                        mat = np.load(self.root / f"vectors.{gen}.npy", mmap_mode="r") if ids else None
+                        snap = _Segments(gen, mat, ids)
+                    if log_bytes > snap.log_bytes:
+                        snap = self._read_delta(snap, manifest.get("dim"), vec_bytes, log_bytes)
+                    self._snap = snap
+                    self._manifest_mtime = mtime
+        return self._snap
+
+    def _read_delta(self, snap: _Segments, dim: Optional[int], vec_bytes: int, log_bytes: int) -> _Segments:
+        vec_path, log_path = self._delta_paths(snap.gen)
+        with open(log_path, "rb") as f:
+            f.seek(snap.log_bytes)
+            raw = f.read(log_bytes - snap.log_bytes)
+        ops = [tuple(json.loads(line)) for line in raw.decode("utf-8").splitlines() if line.strip()]
+        buf = b""
+        if vec_bytes > snap.vec_bytes:
+            with open(vec_path, "rb") as f:
+                f.seek(snap.vec_bytes)
+                buf = f.read(vec_bytes - snap.vec_bytes)
+        vecs = np.frombuffer(buf, dtype=np.float32).reshape(-1, int(dim or 1))
+        return snap.extended(ops, vecs, vec_bytes, log_bytes)
+
+    def _write_manifest_locked(self, snap: _Segments) -> None:
+        manifest = {
+            "gen": snap.gen,
+            "count": len(snap.pos),
+            "dim": snap.dim,
+            "delta_vec_bytes": snap.vec_bytes,
+            "delta_log_bytes": snap.log_bytes,
+        }
+        tmp = self.root / "manifest.tmp"
+        tmp.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmp, self._manifest_path())
+        self._snap = snap
+        self._manifest_mtime = self._manifest_path().stat().st_mtime_ns
+
+    def _append_locked(self, ops: List[Tuple[str, str]], vecs: np.ndarray) -> None:
+        """增量段追加一批操作；manifest 只在数据落盘后才更新，读者不会读到写了一半的批次"""
+        snap = self._snapshot()
+        vec_path, log_path = self._delta_paths(snap.gen)
+        vec_data = np.ascontiguousarray(vecs, dtype=np.float32).tobytes()
+        log_data = "".join(json.dumps([op, cid], ensure_ascii=False) + "\n" for op, cid in ops).encode("utf-8")
+        for path, offset, data in ((vec_path, snap.vec_bytes, vec_data), (log_path, snap.log_bytes, log_data)):
+            if not data:
+                continue
+            # 从 manifest 记录的有效长度处写（覆盖上次崩溃时写了一半、未登记的尾巴）
+            with open(path, "r+b" if path.exists() else "wb") as f:
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+        snap = snap.extended(ops, vecs, snap.vec_bytes + len(vec_data), snap.log_bytes + len(log_data))
+        self._write_manifest_locked(snap)
+        if len(snap.delta_ids) + snap.dead >= max(self.COMPACT_MIN, self.COMPACT_RATIO * len(snap.base_ids)):
+            self.compact()
+
+    def compact(self) -> None:
+        """把存活的行合并成新一代 base，清空增量段与墓碑"""
+        with self._write_lock:
+            snap = self._snapshot()
+            if not snap.delta_ids and not snap.dead:
+                return
+            gen = snap.gen + 1
+            ids = [snap.row_id(int(i)) for i in snap.live]
+            if ids:
+                np.save(self.root / f"vectors.{gen}.npy", np.ascontiguousarray(snap.rows(snap.live), dtype=self.dtype))
+            (self.root / f"ids.{gen}.json").write_text(json.dumps(ids), encoding="utf-8")
+            mapped = np.load(self.root / f"vectors.{gen}.npy", mmap_mode="r") if ids else None
+            self._write_manifest_locked(_Segments(gen, mapped, ids))
+            # 保留上一代给进行中的查询；更早的尽量删除（Windows 下仍被映射的文件会删除失败，下次再试）
+            for pattern in ("vectors.*.npy", "ids.*.json", "delta.*.vec", "delta.*.log"):
+                for p in self.root.glob(pattern):
+                    try:
+                        if int(p.name.split(".")[1]) < gen - 1:
+                            p.unlink()
+                    except (OSError, ValueError):
+                        pass
+
+    # ---------- 写入 ----------
+    def upsert(
+        self,
+        ids: Sequence[str],
+        embeddings: Optional[Sequence[Sequence[float]]] = None,
+        documents: Optional[Sequence[str]] = None,
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> None:
+        ids = list(ids)
+        if not ids:
+            return
+        if embeddings is None:
+            raise ValueError("NumPy 向量后端要求显式传入 embeddings")
+        vecs = _normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+        with self._write_lock:
+            dim = self._snapshot().dim
+            if dim is not None and dim != vecs.shape[1]:
+                raise ValueError(f"embedding 维度不一致：collection 为 {dim}，写入为 {vecs.shape[1]}")
+            # 先写向量、成功后才提交 metadata：追加失败（磁盘满、进程崩溃）时不留下没有向量的行
+            self._append_locked([("put", cid) for cid in ids], vecs)
+            if documents is not None or metadatas is not None:
+                docs = list(documents) if documents is not None else [None] * len(ids)
+                metas = list(metadatas) if metadatas is not None else [{}] * len(ids)
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO chunks(id, document, metadata) VALUES (?, ?, ?)",
+                        [(cid, d, json.dumps(m or {}, ensure_ascii=False)) for cid, d, m in zip(ids, docs, metas)],
+                    )
+                    self._db.commit()
+
+    add = upsert
+
+    def update(
+        self,
+        ids: Sequence[str],
+        embeddings: Optional[Sequence[Sequence[float]]] = None,
+        documents: Optional[Sequence[str]] = None,
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> None:
+        ids = list(ids)
+        if not ids:
+            return
+        with self._db_lock:
+            if documents is not None:
+                self._db.executemany("UPDATE chunks SET document = ? WHERE id = ?", list(zip(documents, ids)))
+            if metadatas is not None:
+                self._db.executemany(
+                    "UPDATE chunks SET metadata = ? WHERE id = ?",
+                    [(json.dumps(m or {}, ensure_ascii=False), cid) for m, cid in zip(metadatas, ids)],
+                )
+            self._db.commit()
+        if embeddings is not None:
+            known = self._snapshot().pos
+            pairs = [(cid, v) for cid, v in zip(ids, embeddings) if cid in known]
+            if pairs:
+                self.upsert([c for c, _ in pairs], embeddings=[v for _, v in pairs], documents=None, metadatas=None)
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        targets = set(ids or [])
+        if where:
+            targets.update(self.get(where=where, include=[])["ids"])
+        if not targets:
+            return
+        with self._write_lock:
+            with self._db_lock:
+                self._db.executemany("DELETE FROM chunks WHERE id = ?", [(cid,) for cid in targets])
+                self._db.commit()
+            pos = self._snapshot().pos
+            gone = [cid for cid in targets if cid in pos]
+            if gone:
+                self._append_locked([("del", cid) for cid in gone], np.empty((0, 0), dtype=np.float32))
+
+    # ---------- 读取 ----------
+    def count(self) -> int:
+        return len(self._snapshot().pos)
+
+    def _fetch(self, ids: Sequence[str]) -> Dict[str, Tuple[Optional[str], Dict[str, Any]]]:
+        out: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = {}
+        ids = list(ids)
+        with self._db_lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start : start + 500]
+                sql = f"SELECT id, document, metadata FROM chunks WHERE id IN ({','.join('?' * len(part))})"
+                for cid, doc, meta in self._db.execute(sql, part):
+                    out[cid] = (doc, json.loads(meta))
+        return out
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        include: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] if include is None else list(include)
+        params: List[Any] = []
+        sql = "SELECT id, document, metadata FROM chunks WHERE " + (_where_sql(where, params) if where else "1=1")
+        if ids is not None:
+            ids = list(ids)
+            sql += f" AND id IN ({','.join('?' * len(ids)) or 'NULL'})"
+            params.extend(ids)
+        sql += " ORDER BY rowid"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+        # 只返回有向量的行（旧版本写入失败可能留下孤立的 metadata；与 query 的结果一致）
+        snap = self._snapshot()
+        rows = [r for r in rows if r[0] in snap.pos]
+        out: Dict[str, Any] = {"ids": [r[0] for r in rows]}
+        if "documents" in include:
+            out["documents"] = [r[1] for r in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [json.loads(r[2]) for r in rows]
+        if "embeddings" in include:
+            out["embeddings"] = [v.tolist() for v in self._read_vectors(snap, [snap.pos[r[0]] for r in rows])]
+        return out
+
+    def _read_vectors(self, snap: _Segments, rows: List[int]) -> List[np.ndarray]:
+        """
+        按全局行号取 float32 向量。base 段用普通文件读取而不经过 mmap：按 id 零散取行（两阶段精排）时，
+        每次缺页都会把一整簇页映射进来，几十次检索后整个矩阵就都算进了本进程的常驻内存。
+        """
+        n = len(snap.base_ids)
+        out: List[np.ndarray] = []
+        f = None
+        try:
+            if snap.base is not None and any(row < n for row in rows):
+                try:
+                    f = open(self.root / f"vectors.{snap.gen}.npy", "rb", buffering=0)
+                except OSError:
+                    f = None  # 这一代已被其它进程合并清理：退回 mmap
+            width = snap.base.shape[1] * snap.base.dtype.itemsize if snap.base is not None else 0
+            for row in rows:
+                if row >= n or f is None:
+                    out.append(np.asarray(snap.vector(row), dtype=np.float32))
+                    continue
+                f.seek(snap.base.offset + row * width)
+                out.append(np.frombuffer(f.read(width), dtype=snap.base.dtype).astype(np.float32))
+        finally:
+            if f is not None:
+                f.close()
+        return out
+
+    def iter_embeddings(self, batch_size: int = 4096) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        按批返回存活行的 (ids, float32 向量)。
+        base 段另开一个临时映射读取，遍历结束即解除：读过的页不会一直算在本进程的常驻内存里。
+        """
+        snap = self._snapshot()
+        n = len(snap.base_ids)
+        base_rows = snap.live[snap.live < n]
+        if len(base_rows):
+            mat = np.load(self.root / f"vectors.{snap.gen}.npy", mmap_mode="r")
+            try:
+                for start in range(0, len(base_rows), batch_size):
+                    rows = base_rows[start : start + batch_size]
+                    yield [snap.base_ids[int(i)] for i in rows], np.array(mat[rows], dtype=np.float32)
+            finally:
+                del mat
+        delta_rows = snap.live[snap.live >= n] - n
+        for start in range(0, len(delta_rows), batch_size):
+            rows = delta_rows[start : start + batch_size]
+            yield [snap.delta_ids[int(i)] for i in rows], snap.delta[rows]
+
+    def _base_scores(self, mat: np.ndarray, q: np.ndarray) -> np.ndarray:
+        if mat.dtype == np.float32:
+            return mat @ q
+        # float16 没有 BLAS 加速：分块转成 float32 再乘，避免整体复制一份 float32 矩阵
+        out = np.empty(mat.shape[0], dtype=np.float32)
+        step = 8192
+        for start in range(0, mat.shape[0], step):
+            out[start : start + step] = np.asarray(mat[start : start + step], dtype=np.float32) @ q
+        return out
+
+    def _scores(self, snap: _Segments, q: np.ndarray) -> np.ndarray:
+        """全局行号上的 cosine 相似度（含已被覆盖/删除的行，由调用方按存活行筛选）"""
+        parts = []
+        if snap.base is not None:
+            parts.append(self._base_scores(snap.base, q))
+        if snap.delta is not None:
+            parts.append(snap.delta @ q)
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Any]:
+        include = ["documents", "metadatas", "distances"] if include is None else list(include)
+        snap = self._snapshot()
+        cand = snap.live
+        if where:
+            pos = snap.pos
+            cand = np.array([pos[c] for c in self.get(where=where, include=[])["ids"] if c in pos], dtype=np.int64)
+        res: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        qs = _normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        for q in qs:
+            if not len(cand):
+                top_ids, top_d = [], []
+            else:
+                sub = self._scores(snap, q)[cand]
+                n = min(max(1, int(n_results)), sub.shape[0])
+                part = np.argpartition(-sub, n - 1)[:n] if n < sub.shape[0] else np.arange(sub.shape[0])
+                order = part[np.argsort(-sub[part])]
+                top_ids = [snap.row_id(int(cand[i])) for i in order]
+                # 与 Chroma cosine 空间一致：distance = 1 - cos
+                top_d = [float(1.0 - sub[i]) for i in order]
+            rows = self._fetch(top_ids)
+            kept = [(cid, d) for cid, d in zip(top_ids, top_d) if cid in rows]  # 并发删除的行跳过
+            res["ids"].append([cid for cid, _ in kept])
+            res["documents"].append([rows[cid][0] for cid, _ in kept])
+            res["metadatas"].append([rows[cid][1] for cid, _ in kept])
+            res["distances"].append([d for _, d in kept])
+        return {k: v for k, v in res.items() if k == "ids" or k in include}
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._db.close()
+
+
+class FlatVectorClient:
+    """与 chromadb.PersistentClient 对齐的最小接口：每个 collection 一个子目录"""
+
+    def __init__(self, path: Path, dtype: str = "float32") -> None:
+        self.path = Path(path)
+        self.dtype = dtype
+        self._lock = threading.Lock()
+        self._open: Dict[str, FlatVectorCollection] = {}
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def get_or_create_collection(self, name: str, embedding_function=None, metadata=None) -> FlatVectorCollection:
+        with self._lock:
+            col = self._open.get(name)
+            if col is None:
+                col = FlatVectorCollection(self.path / name, name, dtype=self.dtype)
+                self._open[name] = col
+            return col
+
+    def get_collection(self, name: str, embedding_function=None) -> FlatVectorCollection:
+        if not (self.path / name).exists():
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.get_or_create_collection(name)
+
+    def list_collections(self) -> List[str]:
+        return sorted(p.name for p in self.path.iterdir() if p.is_dir())
+
+    def delete_collection(self, name: str) -> None:
+        with self._lock:
+            col = self._open.pop(name, None)
+        if col is not None:
+            col.close()
+        shutil.rmtree(self.path / name, ignore_errors=True)
+
+
+def iter_embeddings(col, batch_size: int = 4096) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """按批遍历 collection 的全部向量，不一次性把整库转成 Python 列表；Chroma 按 offset 分页"""
+    if isinstance(col, FlatVectorCollection):
+        yield from col.iter_embeddings(batch_size)
+        return
+    offset = 0
+    while True:
+        got = col.get(include=["embeddings"], limit=batch_size, offset=offset)
+        ids = list(got.get("ids") or [])
+        if not ids:
+            return
+        yield ids, np.asarray(got["embeddings"], dtype=np.float32).reshape(len(ids), -1)
+        offset += len(ids)
+
+
+def open_vector_client(cfg):
+    """按 cfg.vector_backend 打开向量库 client；chromadb 只在真正使用时才 import"""
+    if cfg.vector_backend == "numpy":
+        return FlatVectorClient(cfg.persist_dir.parent / "flat", dtype=cfg.flat_dtype)
+    import chromadb
+
+    return chromadb.PersistentClient(path=str(cfg.persist_dir))
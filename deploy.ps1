@@ -5,6 +5,8 @@ param(
     [string]$NginxExe = $(if ($env:NGINX_EXE) { $env:NGINX_EXE } elseif ($env:NGINX_PATH) { $env:NGINX_PATH } else { "" }),
     [string]$NginxConf = $env:NGINX_CONF,
     [int]$BackendPort = 5000,
+    # uvicorn（默认，asgi:app：看板娘聊天走异步网关）| waitress（纯 WSGI，app:app）
+    [string]$BackendServer = $(if ($env:BACKEND_SERVER) { $env:BACKEND_SERVER } else { "uvicorn" }),
     [int]$HexoPort = 4000,
     [string]$StartHexoServer = $env:START_HEXO_SERVER
 )
@@ -295,7 +297,20 @@ Pip-InstallWithFallback -PythonExePath $venvPy -PipInstallArgs @("--disable-pip-
 # 兜底：确保 waitress 在 Windows 一定存在（避免上一步失败导致后端起不来）
 Pip-InstallWithFallback -PythonExePath $venvPy -PipInstallArgs @("--disable-pip-version-check", "waitress==2.1.2")
 
-Write-Step "Start backend (waitress, 127.0.0.1:$BackendPort)"
+$BackendServer = $BackendServer.Trim().ToLower()
+if ($BackendServer -eq "waitress") {
+    $backendArgs = @("-m", "waitress", "--host=127.0.0.1", "--port=$BackendPort", "app:app")
+} else {
+    $BackendServer = "uvicorn"
+    # asgi.py 缺 a2wsgi 时会直接启动失败：部署阶段先检查，别等计划任务起来后才在日志里报错
+    & $venvPy -c "import uvicorn, a2wsgi"
+    if ($LASTEXITCODE -ne 0) {
+        throw "uvicorn / a2wsgi 未安装成功（见上方 pip 输出）。修复依赖后重试，或设置 BACKEND_SERVER=waitress"
+    }
+    $backendArgs = @("-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", "$BackendPort")
+}
+
+Write-Step "Start backend ($BackendServer, 127.0.0.1:$BackendPort)"
 $backendOut = Join-Path $logsDir "backend.out.log"
 $backendErr = Join-Path $logsDir "backend.err.log"
 $backendWd = (Join-Path $BlogDir "backend")
@@ -306,17 +321,17 @@ if ($isSsh) {
     Write-CmdFile -Path $backendCmdFile -Lines @(
         "@echo off"
         "cd /d `"$backendWd`""
-        "`"$venvPy`" -m waitress --host=127.0.0.1 --port=$BackendPort app:app >> `"$backendOut`" 2>> `"$backendErr`""
+        "`"$venvPy`" $($backendArgs -join ' ') >> `"$backendOut`" 2>> `"$backendErr`""
     )
     $backendTask = "cmd.exe /c `"`"$backendCmdFile`"`""
     Ensure-ScheduledTask -TaskName "blog-backend" -CommandLine $backendTask
     Run-ScheduledTask -TaskName "blog-backend"
-    Write-Host "Scheduled task started: blog-backend (waitress)" -ForegroundColor Green
+    Write-Host "Scheduled task started: blog-backend ($BackendServer)" -ForegroundColor Green
 } else {
     Start-Process `
         -FilePath $venvPy `
         -WorkingDirectory $backendWd `
-        -ArgumentList @("-m", "waitress", "--host=127.0.0.1", "--port=$BackendPort", "app:app") `
+        -ArgumentList $backendArgs `
         -WindowStyle Hidden `
         -RedirectStandardOutput $backendOut `
         -RedirectStandardError $backendErr | Out-Null
@@ -327,7 +342,7 @@ if (-not (Wait-ListeningPort -Port $BackendPort -TimeoutSeconds 25)) {
 }
 
 Write-Step "Reindex RAG vector store (Chroma)"
-# 说明：每次 push 部署后全量重建向量库（会调用 Embedding API，耗时取决于文章数量/网络）
+# 说明：每次 push 部署后差量同步向量库（只对内容变化的 chunk 调用 Embedding API）
 # 可选：如需临时关闭，可在服务器环境变量里设置 RAG_REINDEX_ON_DEPLOY=0
 $reindexOnDeploy = ($env:RAG_REINDEX_ON_DEPLOY)
 if ([string]::IsNullOrWhiteSpace($reindexOnDeploy)) { $reindexOnDeploy = "1" }
@@ -336,13 +351,23 @@ if ($reindexOnDeploy.Trim().ToLower() -in @("0", "false", "no", "n", "off")) {
 } else {
     $reindexUrl = "http://127.0.0.1:$BackendPort/api/ai/mascot/reindex"
     try {
-        # PS 5.1/7 都支持 TimeoutSec；给大一些，避免文章多时超时
-        $resp = Invoke-RestMethod -Method Post -Uri $reindexUrl -ContentType "application/json" -Body "{}" -TimeoutSec 3600
+        # 重建在后端后台线程执行：这里只提交任务，然后轮询状态（不再长时间占用一个 waitress 线程）
+        $resp = Invoke-RestMethod -Method Post -Uri $reindexUrl -ContentType "application/json" -Body "{}" -TimeoutSec 60
         if ($null -eq $resp) { throw "Empty response" }
         if ($resp.errno -ne 0) { throw ("API errno={0}, errmsg={1}" -f $resp.errno, $resp.errmsg) }
-        $posts = $resp.data.posts
-        $chunks = $resp.data.chunks
-        Write-Host ("RAG reindex OK. posts={0}, chunks={1}" -f $posts, $chunks) -ForegroundColor Green
+        $jobId = $resp.data.job_id
+        $statusUrl = "http://127.0.0.1:$BackendPort/api/ai/mascot/reindex/status?job_id=$jobId"
+        $deadline = (Get-Date).AddSeconds(3600)
+        do {
+            Start-Sleep -Seconds 5
+            $st = Invoke-RestMethod -Method Get -Uri $statusUrl -TimeoutSec 30
+            if ($st.errno -ne 0) { throw ("API errno={0}, errmsg={1}" -f $st.errno, $st.errmsg) }
+            $job = $st.data
+            Write-Host ("RAG reindex {0}: posts {1}/{2}, chunks written {3}, eta {4}s" -f $job.status, $job.posts_done, $job.posts_total, $job.chunks_written, $job.eta_seconds)
+        } while ($job.status -in @("queued", "running") -and (Get-Date) -lt $deadline)
+        if ($job.status -ne "succeeded") { throw ("job {0} status={1}, errors={2}" -f $jobId, $job.status, ($job.errors -join "; ")) }
+        $r = $job.result
+        Write-Host ("RAG reindex OK. posts={0}, chunks={1}, added={2}, updated={3}, deleted={4}, skipped={5}" -f $r.posts, $r.chunks, $r.added, $r.updated, $r.deleted, $r.skipped) -ForegroundColor Green
     } catch {
         throw ("RAG reindex failed: {0}. Check backend logs: {1}" -f $_.Exception.Message, $backendErr)
     }
@@ -0,0 +1,85 @@
+/**
+ * 常驻 Hexo 生成进程（由 backend/routes/hexo_worker.py 启动、看护）
+ *
+ * 每次 `npx hexo generate` 都要解析 npx、启动 Node、加载 Hexo 和全部插件/主题，然后才开始渲染。
+ * 这里只初始化一次，之后按需调用 generate（Hexo 的 load 走缓存，只处理变化的源文件）。
+ *
+ * 协议：stdin 每行一个 JSON 请求 {"id": 1, "cmd": "generate" | "ping"}；
+ * 以 "@@hexo-worker " 开头的 stdout 行是回复，其余输出都是日志。
+ */
+'use strict';
+
+const readline = require('readline');
+const util = require('util');
+const Hexo = require('hexo');
+
+const PREFIX = '@@hexo-worker ';
+const write = process.stdout.write.bind(process.stdout);
+
+// Hexo / 插件的日志收集到当前请求里，随回复一起返回
+let logs = [];
+function capture(level, args) {
+    logs.push(`${level} ${util.format(...args)}`);
+    if (logs.length > 2000) logs.shift();
+}
+console.log = console.info = (...args) => capture('INFO', args);
+console.warn = (...args) => capture('WARN', args);
+console.error = (...args) => capture('ERROR', args);
+
+function send(msg) {
+    write(PREFIX + JSON.stringify(msg) + '\n');
+}
+
+const hexo = new Hexo(process.cwd(), { silent: true });
+for (const level of ['trace', 'debug', 'info', 'warn', 'error', 'fatal']) {
+    if (typeof hexo.log[level] === 'function') {
+        hexo.log[level] = (...args) => capture(level.toUpperCase(), args);
+    }
+}
+
+// 同一时间只处理一个 generate；ping 不排队
+let chain = Promise.resolve();
+
+async function generate(req) {
+    const t0 = Date.now();
+    logs = [];
+    try {
+        await hexo.call('generate', {});
+        send({ id: req.id, ok: true, ms: Date.now() - t0, log: logs.join('\n') });
+    } catch (e) {
+        send({ id: req.id, ok: false, ms: Date.now() - t0, error: String((e && e.stack) || e), log: logs.join('\n') });
+    }
+}
+
+function handle(line) {
+    let req;
+    try {
+        req = JSON.parse(line);
+    } catch (e) {
+        return;
+    }
+    if (req.cmd === 'ping') {
+        send({ id: req.id, ok: true });
+    } else if (req.cmd === 'generate') {
+        chain = chain.then(() => generate(req));
+    } else {
+        send({ id: req.id, ok: false, error: `unknown cmd: ${req.cmd}` });
+    }
+}
+
+const started = Date.now();
+hexo.init()
+    .then(() => hexo.load())
+    .then(() => {
+        send({ type: 'ready', ms: Date.now() - started, version: hexo.version });
+        const rl = readline.createInterface({ input: process.stdin });
+        rl.on('line', handle);
+        // 后端退出（stdin 关闭）时跟着退出
+        rl.on('close', () => {
+            chain.then(() => hexo.exit()).finally(() => process.exit(0));
+        });
+    })
+    .catch((e) => {
+        send({ type: 'fatal', error: String((e && e.stack) || e), log: logs.join('\n') });
+        process.exit(1);
+    });